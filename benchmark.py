@@ -0,0 +1,373 @@
+"""Benchmark the PO pipeline on synthetic data, entirely offline.
+
+Generates Toyhouse-shaped invoice PDFs, wide master data CSVs and orders pages
+with synthetic.py (cached in .cache/bench/), then times each stage of the
+pipeline in a fresh worker process, so every stage gets its own peak RSS:
+
+    parse_invoice        PDF → invoice items (per engine)
+    master_csv_load      ToyhousemasterData.csv → SKU → MasterRow, the --no-index path
+    master_csv_load_full the same as full row dicts (iter_master_rows), for comparison
+    master_index_build   compiling the SQLite master index
+    master_lookup        SKU lookups against the compiled index
+    secondary_index_build  UPC/title indexes for unmatched lines (secondary_match.py)
+    secondary_match      candidate lookups for unknown Item #s
+    build_po_row         invoice item + SKU template → PO row (templating included)
+    generate_po          matching and writing the PO/exceptions CSVs
+    parse_orders         orders-page HTML → order dicts (per backend)
+
+Results are printed and written as JSON. --save-baseline stores them as the
+baseline, and later runs compare against it: a stage that got slower (or
+grew its peak RSS) by more than --threshold is flagged as a regression and
+the exit status is 1.
+
+Usage:
+    python benchmark.py [--profile quick|full] [--only NAME] [--repeat 3]
+    python benchmark.py --save-baseline
+    python benchmark.py --baseline benchmark_baseline.json --threshold 0.2
+"""
+
+import argparse
+import json
+import os
+import platform
+import random
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import get_context
+
+import synthetic
+import timings
+from generate_po import (
+    DEFAULT_LOCATION, INVOICES_DIR, PAGE_PARSERS, POProjection, ParsedInvoice,
+    _items_from_tables, fill_po_row, generate_po, parse_invoice,
+)
+from master_index import build_index, iter_master_rows, load_master_records, open_index
+from orders_parser import BACKENDS, parse_orders
+from secondary_match import SecondaryIndex
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+BENCH_DIR = os.path.join(".cache", "bench")
+DATA_DIR = os.path.join(BENCH_DIR, "data")
+RUN_DIR = os.path.join(BENCH_DIR, "run")
+RESULTS_FILE = os.path.join(BENCH_DIR, "results.json")
+BASELINE_FILE = "benchmark_baseline.json"
+DEFAULT_THRESHOLD = 0.2
+
+# Sizes per profile. "width" is the master CSV's column count; the real sheet
+# export runs to column ZZ (702 columns)
+PROFILES = {
+    "quick": {"pages": [1, 10], "skus": [1000, 10000], "width": 120, "orders": [200],
+              "lookups": 2000},
+    "full":  {"pages": [1, 20, 200], "skus": [1000, 20000, 200000], "width": 702,
+              "orders": [100, 1000], "lookups": 20000},
+}
+ROWS_PER_PAGE = 25
+
+
+# --- Synthetic data ----------------------------------------------------------
+
+def invoice_file(pages, skus):
+    path = os.path.join(DATA_DIR, f"invoice_{pages}p_{skus}.pdf")
+    if not os.path.exists(path):
+        synthetic.write_invoice_pdf(path, pages, ROWS_PER_PAGE, skus)
+    return path
+
+
+def master_file(skus, width):
+    path = os.path.join(DATA_DIR, f"master_{skus}x{width}.csv")
+    if not os.path.exists(path):
+        print(f"  generating {path}...")
+        synthetic.write_master_csv(f"{path}.tmp", skus, width)
+        os.replace(f"{path}.tmp", path)
+    return path
+
+
+def orders_file(orders):
+    path = os.path.join(DATA_DIR, f"orders_{orders}.html")
+    if not os.path.exists(path):
+        synthetic.write_orders_html(path, orders)
+    return path
+
+
+def invoice_items(pages, skus):
+    """The items parse_invoice() returns for invoice_file(pages, skus), without parsing it."""
+    return _items_from_tables(synthetic.invoice_rows(pages, ROWS_PER_PAGE, skus))
+
+
+# --- Stages ------------------------------------------------------------------
+# Each stage does its setup and returns (units, unit_name, run); only run() is timed
+
+def stage_parse_invoice(path, pages, engine):
+    return pages, "pages", lambda: parse_invoice(path, engine=engine)
+
+
+def stage_master_csv_load(path, skus):
+    return skus, "rows", lambda: load_master_records(path)
+
+
+def stage_master_csv_load_full(path, skus):
+    return skus, "rows", lambda: dict(iter_master_rows(path))
+
+
+def stage_master_index_build(path, skus):
+    index_path = os.path.join(".cache", f"bench_index_{skus}.sqlite")
+    return skus, "rows", lambda: build_index(path, index_path)
+
+
+def stage_master_lookup(path, skus, lookups):
+    index_path = os.path.join(".cache", f"bench_index_{skus}.sqlite")
+    build_index(path, index_path)
+    index = open_index(path, index_path)
+    rng = random.Random(3)
+    # Mostly hits, some misses, like a real invoice
+    wanted = [synthetic.sku(rng.randrange(int(skus * 1.1))) for _ in range(lookups)]
+
+    def run():
+        for sku in wanted:
+            index.get(sku)
+    return lookups, "lookups", run
+
+
+def stage_secondary_index_build(path, skus):
+    master = load_master_records(path)
+    return skus, "rows", lambda: SecondaryIndex(master)
+
+
+def stage_secondary_match(path, skus, lookups):
+    index = SecondaryIndex(load_master_records(path))
+    rng = random.Random(4)
+    # Unknown Item #s whose title names a master item, and a UPC that may or may not match
+    items = []
+    for _ in range(lookups):
+        code = synthetic.sku(rng.randrange(skus))
+        items.append({"sku": f"X{code}", "title": f"LEGO {rng.choice(synthetic.THEMES)} Set {code}",
+                      "upc": f"6734{rng.randint(10000000, 99999999)}"})
+
+    def run():
+        for item in items:
+            index.candidates(item)
+    return lookups, "lookups", run
+
+
+def stage_build_po_row(path, pages, skus):
+    master = load_master_records(path)
+    pairs = [(item, master[item["sku"]]) for item in invoice_items(pages, skus)
+             if item["sku"] in master]
+
+    def run():
+        # A fresh projection per run, so SKU templating is timed too
+        projection = POProjection(master)
+        for item, _ in pairs:
+            fill_po_row(projection.template(item["sku"]), "TH20003", "01/05/2025", item,
+                        DEFAULT_LOCATION)
+    return len(pairs), "rows", run
+
+
+def stage_generate_po(path, pages, skus):
+    master = load_master_records(path)
+    items = invoice_items(pages, skus)
+    os.makedirs(INVOICES_DIR, exist_ok=True)
+
+    def run():
+        invoice = ParsedInvoice("TH20003", "01/05/2025", items)
+        generate_po("BENCH", invoice, master, DEFAULT_LOCATION)
+    return len(items), "items", run
+
+
+def stage_parse_orders(path, orders, backend):
+    with open(path, encoding="utf-8") as f:
+        html = f.read()
+    return orders, "orders", lambda: parse_orders(html, backend)
+
+
+STAGES = {
+    "parse_invoice":        stage_parse_invoice,
+    "master_csv_load":      stage_master_csv_load,
+    "master_csv_load_full": stage_master_csv_load_full,
+    "master_index_build":   stage_master_index_build,
+    "master_lookup":        stage_master_lookup,
+    "secondary_index_build": stage_secondary_index_build,
+    "secondary_match":      stage_secondary_match,
+    "build_po_row":         stage_build_po_row,
+    "generate_po":          stage_generate_po,
+    "parse_orders":         stage_parse_orders,
+}
+
+
+def plan(profile, engines):
+    """[(name, stage, make_params)] for every stage in a profile.
+
+    make_params() generates the stage's data on first use, so --only never
+    builds data it won't run on.
+    """
+    sizes = PROFILES[profile]
+    smallest = min(sizes["skus"])
+    biggest = max(sizes["pages"])
+    width = sizes["width"]
+    runs = []
+    for pages in sizes["pages"]:
+        for engine in engines:
+            runs.append((f"parse_invoice[{pages}p,{engine}]", "parse_invoice",
+                         lambda pages=pages, engine=engine: {
+                             "path": invoice_file(pages, smallest), "pages": pages, "engine": engine}))
+    for skus in sizes["skus"]:
+        for stage in ("master_csv_load", "master_csv_load_full"):
+            runs.append((f"{stage}[{skus}]", stage,
+                         lambda skus=skus: {"path": master_file(skus, width), "skus": skus}))
+        runs.append((f"master_index_build[{skus}]", "master_index_build",
+                     lambda skus=skus: {"path": master_file(skus, width), "skus": skus}))
+        runs.append((f"master_lookup[{skus}]", "master_lookup",
+                     lambda skus=skus: {"path": master_file(skus, width), "skus": skus,
+                                        "lookups": sizes["lookups"]}))
+        runs.append((f"secondary_index_build[{skus}]", "secondary_index_build",
+                     lambda skus=skus: {"path": master_file(skus, width), "skus": skus}))
+        runs.append((f"secondary_match[{skus}]", "secondary_match",
+                     lambda skus=skus: {"path": master_file(skus, width), "skus": skus,
+                                        "lookups": sizes["lookups"]}))
+    for stage in ("build_po_row", "generate_po"):
+        runs.append((f"{stage}[{biggest}p]", stage,
+                     lambda: {"path": master_file(smallest, width), "pages": biggest, "skus": smallest}))
+    for orders in sizes["orders"]:
+        for backend in BACKENDS:
+            runs.append((f"parse_orders[{orders},{backend}]", "parse_orders",
+                         lambda orders=orders, backend=backend: {
+                             "path": orders_file(orders), "orders": orders, "backend": backend}))
+    return runs
+
+
+def run_stage(stage, params, repeat, workdir):
+    """Run one stage repeat times in this (fresh) process. Returns its result dict."""
+    os.chdir(workdir)
+    params = {k: os.path.abspath(os.path.join(ROOT, v)) if k == "path" else v
+              for k, v in params.items()}
+    units, unit, run = STAGES[stage](**params)
+    best = None
+    for _ in range(repeat):
+        wall, cpu = time.perf_counter(), time.process_time()
+        run()
+        wall, cpu = time.perf_counter() - wall, time.process_time() - cpu
+        if best is None or wall < best[0]:
+            best = (wall, cpu)
+    return {
+        "seconds":     round(best[0], 6),
+        "cpu_seconds": round(best[1], 6),
+        "units":       units,
+        "unit":        unit,
+        "throughput":  round(units / best[0], 2) if best[0] else None,
+        "peak_rss_mb": timings.peak_rss_mb(),
+    }
+
+
+def run_benchmarks(profile="quick", engines=("table",), only=None, repeat=3):
+    os.makedirs(DATA_DIR, exist_ok=True)
+    os.makedirs(RUN_DIR, exist_ok=True)
+    print(f"Preparing synthetic data ({profile} profile)...")
+    runs = [r for r in plan(profile, engines) if not only or any(o in r[0] for o in only)]
+
+    results = {
+        "created":   time.strftime("%Y-%m-%d %H:%M:%S"),
+        "profile":   profile,
+        "repeat":    repeat,
+        "python":    platform.python_version(),
+        "platform":  platform.platform(),
+        "cpu_count": os.cpu_count(),
+        "stages":    {},
+    }
+    spawn = get_context("spawn")
+    for name, stage, make_params in runs:
+        params = make_params()
+        # A fresh process per stage, so peak RSS belongs to that stage alone
+        with ProcessPoolExecutor(max_workers=1, mp_context=spawn) as pool:
+            result = pool.submit(run_stage, stage, params, repeat, os.path.abspath(RUN_DIR)).result()
+        results["stages"][name] = result
+        rss = f"{result['peak_rss_mb']:>8.1f}MB" if result["peak_rss_mb"] is not None else "       n/a"
+        print(f"  {name:<34} {result['seconds'] * 1000:>10.1f}ms "
+              f"{result['throughput']:>12,.0f} {result['unit']}/s {rss}")
+    return results
+
+
+def compare(results, baseline, threshold=DEFAULT_THRESHOLD):
+    """Print each stage against the baseline. Returns the names of regressed stages."""
+    if baseline.get("profile") != results["profile"]:
+        print(f"\nNote: baseline is the {baseline.get('profile')!r} profile, this run is "
+              f"{results['profile']!r}; only stages in both are compared.")
+    regressions = []
+    print(f"\n{'stage':<34} {'baseline':>10} {'now':>10} {'change':>8} {'rss':>8}")
+    for name, now in results["stages"].items():
+        base = baseline.get("stages", {}).get(name)
+        if not base:
+            continue
+        change = now["seconds"] / base["seconds"] - 1 if base["seconds"] else 0.0
+        rss_change = None
+        if now["peak_rss_mb"] and base.get("peak_rss_mb"):
+            rss_change = now["peak_rss_mb"] / base["peak_rss_mb"] - 1
+        flags = []
+        if change > threshold:
+            flags.append("SLOWER")
+        if rss_change is not None and rss_change > threshold:
+            flags.append("MORE MEMORY")
+        if flags:
+            regressions.append(name)
+        rss_text = f"{rss_change:+.0%}" if rss_change is not None else "n/a"
+        print(f"{name:<34} {base['seconds'] * 1000:>8.1f}ms {now['seconds'] * 1000:>8.1f}ms "
+              f"{change:>+8.0%} {rss_text:>8}  {' '.join(flags)}")
+    return regressions
+
+
+def write_json(data, path):
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(data, f, indent=2)
+    os.replace(tmp_path, path)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the PO pipeline on synthetic data.")
+    parser.add_argument("--profile", choices=sorted(PROFILES), default="quick",
+                        help="data sizes to run (default: quick)")
+    parser.add_argument("--engines", default="table",
+                        help=f"comma-separated invoice engines ({', '.join(PAGE_PARSERS)}; default: table)")
+    parser.add_argument("--only", action="append", metavar="NAME",
+                        help="run only stages whose name contains NAME (repeatable)")
+    parser.add_argument("--repeat", type=int, default=3,
+                        help="runs per stage; the fastest is reported (default: 3)")
+    parser.add_argument("--output", default=RESULTS_FILE,
+                        help=f"where to write the results JSON (default: {RESULTS_FILE})")
+    parser.add_argument("--baseline", default=BASELINE_FILE,
+                        help=f"baseline to compare against, if it exists (default: {BASELINE_FILE})")
+    parser.add_argument("--save-baseline", action="store_true",
+                        help="store this run as the baseline instead of comparing")
+    parser.add_argument("--threshold", type=float, default=DEFAULT_THRESHOLD,
+                        help=f"slowdown/RSS growth that counts as a regression (default: {DEFAULT_THRESHOLD})")
+    args = parser.parse_args()
+
+    engines = [e.strip() for e in args.engines.split(",") if e.strip()]
+    unknown = [e for e in engines if e not in PAGE_PARSERS]
+    if unknown:
+        parser.error(f"unknown engine(s): {', '.join(unknown)}")
+
+    os.chdir(ROOT)
+    results = run_benchmarks(args.profile, engines, args.only, args.repeat)
+    write_json(results, args.output)
+    print(f"\nResults written to {args.output}")
+
+    if args.save_baseline:
+        write_json(results, args.baseline)
+        print(f"Baseline saved to {args.baseline}")
+        return 0
+    if not os.path.exists(args.baseline):
+        print(f"No baseline at {args.baseline}; run with --save-baseline to create one.")
+        return 0
+    with open(args.baseline, encoding="utf-8") as f:
+        regressions = compare(results, json.load(f), args.threshold)
+    if regressions:
+        print(f"\n{len(regressions)} regression(s) beyond {args.threshold:.0%}: {', '.join(regressions)}")
+        return 1
+    print(f"\nNo regressions beyond {args.threshold:.0%}.")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,192 @@
+"""Keep one logged-in Chromium running for the orders-page scripts.
+
+Usage:
+    python browser_daemon.py start [--port 9333] [--headless]
+    python browser_daemon.py status
+    python browser_daemon.py stop
+
+`start` runs in the foreground (Ctrl+C to stop). It launches Chromium with a
+CDP port, loads toyhouse_session.json, opens the orders page (waiting for a
+manual login if needed) and keeps that tab loaded. It reloads the tab every
+few minutes and re-saves the session. While the daemon is running,
+list_orders.py, download_invoice.py and download_orders.py attach to it
+instead of cold-starting their own browser. See toyhouse_browser.py.
+"""
+
+import argparse
+import json
+import os
+import signal
+import sys
+import time
+import urllib.request
+
+from playwright.sync_api import Error as PlaywrightError
+from playwright.sync_api import TimeoutError as PlaywrightTimeoutError
+from playwright.sync_api import sync_playwright
+
+from toyhouse_browser import (
+    DAEMON_STATE_FILE, LOGIN_TIMEOUT, ORDER_ROW_SELECTOR, ORDERS_URL, SESSION_FILE,
+    daemon_endpoint, is_orders_tab,
+)
+
+DEFAULT_PORT = 9333
+PROFILE_DIR = os.path.join(".cache", "browser-profile")
+REFRESH_SECONDS = 300
+
+
+def write_state(port, path=DAEMON_STATE_FILE):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    state = {
+        "pid": os.getpid(),
+        "port": port,
+        "endpoint": f"http://127.0.0.1:{port}",
+        "started_at": time.strftime("%Y-%m-%d %H:%M:%S"),
+    }
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(state, f, indent=2)
+    os.replace(tmp_path, path)
+    return state
+
+
+def read_state(path=DAEMON_STATE_FILE):
+    try:
+        with open(path, encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def remove_state(path=DAEMON_STATE_FILE):
+    state = read_state(path)
+    if state and state.get("pid") == os.getpid():
+        os.remove(path)
+
+
+def _load_cookies(context):
+    if not os.path.exists(SESSION_FILE):
+        return
+    with open(SESSION_FILE, encoding="utf-8") as f:
+        cookies = json.load(f).get("cookies", [])
+    if cookies:
+        context.add_cookies(cookies)
+
+
+def _orders_tab(context, page=None):
+    """The daemon's own orders tab, reopened if it was closed or navigated away.
+
+    Clients open orders tabs of their own in this context, so the daemon
+    tracks its tab rather than adopting any tab that shows the orders list.
+    """
+    if page is None or page.is_closed():
+        # Reuse the startup blank tab, never a client's tab
+        blank = [p for p in context.pages if p.url == "about:blank"] if page is None else []
+        page = blank[0] if blank else context.new_page()
+    if not is_orders_tab(page):
+        page.goto(ORDERS_URL)
+    if "authentication" in page.url.lower():
+        print("\nNot logged in. Please log in in the browser.")
+        print("Waiting until you reach the orders page...")
+        page.wait_for_url(ORDERS_URL, timeout=LOGIN_TIMEOUT)
+    try:
+        page.wait_for_selector(ORDER_ROW_SELECTOR)
+    except PlaywrightTimeoutError:
+        page.wait_for_load_state("networkidle")  # an account with no orders yet
+    context.storage_state(path=SESSION_FILE)
+    return page
+
+
+def start(port=DEFAULT_PORT, headless=False):
+    if daemon_endpoint():
+        print(f"A browser daemon is already running ({read_state()['endpoint']}).")
+        return 1
+
+    def _stop(signum, frame):
+        raise KeyboardInterrupt
+    signal.signal(signal.SIGTERM, _stop)
+
+    with sync_playwright() as p:
+        # A persistent context is the browser's default context, which is the
+        # one clients see as browser.contexts[0] after connect_over_cdp
+        context = p.chromium.launch_persistent_context(
+            PROFILE_DIR,
+            headless=headless and os.path.exists(SESSION_FILE),
+            accept_downloads=True,
+            args=[f"--remote-debugging-port={port}"],
+        )
+        try:
+            _load_cookies(context)
+            print(f"Opening {ORDERS_URL}...")
+            page = _orders_tab(context)
+            state = write_state(port)
+            print(f"Browser daemon ready at {state['endpoint']} (pid {state['pid']}). Ctrl+C to stop.")
+
+            while True:
+                try:
+                    # wait_for_timeout (not time.sleep) keeps the connection serviced
+                    page.wait_for_timeout(REFRESH_SECONDS * 1000)
+                    if is_orders_tab(page):
+                        page.reload()
+                except PlaywrightError:
+                    pass  # tab was closed; _orders_tab opens a new one
+                page = _orders_tab(context, page)
+        except KeyboardInterrupt:
+            print("\nStopping the browser daemon...")
+        except PlaywrightError as e:
+            print(f"Browser daemon stopped: {e}")
+        finally:
+            remove_state()
+            try:
+                context.close()
+            except PlaywrightError:
+                pass
+    return 0
+
+
+def status():
+    state = read_state()
+    endpoint = daemon_endpoint()
+    if not endpoint:
+        print("No browser daemon running.")
+        return 1
+    with urllib.request.urlopen(f"{endpoint}/json/version", timeout=1) as response:
+        version = json.load(response).get("Browser", "")
+    print(f"Browser daemon running at {endpoint}")
+    print(f"  pid:     {state['pid']}")
+    print(f"  started: {state['started_at']}")
+    print(f"  browser: {version}")
+    return 0
+
+
+def stop():
+    state = read_state()
+    if not state or not daemon_endpoint():
+        print("No browser daemon running.")
+        return 1
+    os.kill(state["pid"], signal.SIGTERM)
+    print(f"Sent stop to the browser daemon (pid {state['pid']}).")
+    return 0
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Keep a logged-in browser running for the Toyhouse scripts.")
+    sub = parser.add_subparsers(dest="command", required=True)
+    s = sub.add_parser("start", help="run the daemon in the foreground")
+    s.add_argument("--port", type=int, default=DEFAULT_PORT,
+                   help=f"CDP port (default: {DEFAULT_PORT})")
+    s.add_argument("--headless", action="store_true",
+                   help="run headless once a saved session exists")
+    sub.add_parser("status", help="show whether the daemon is running")
+    sub.add_parser("stop", help="stop a running daemon")
+    args = parser.parse_args()
+
+    if args.command == "start":
+        return start(args.port, args.headless)
+    if args.command == "status":
+        return status()
+    return stop()
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,109 +1,112 @@
+"""Download the invoice PDF for one Toyhouse order.
+
+Usage:
+    python download_invoice.py <order_number> [--browser] [--fast]
+
+Tries a browser-free fetch with the saved session cookies first, and falls back
+to driving Chromium when that isn't possible. --browser skips the fast path.
+--fast runs the browser headless with images, fonts and third-party scripts
+blocked (see toyhouse_browser.py).
+"""
+
 import os
 import sys
 from playwright.sync_api import sync_playwright
-from bs4 import BeautifulSoup
 
-ORDERS_URL = "https://account.toyhousellc.com/orders"
-SESSION_FILE = "toyhouse_session.json"
+import timings
+from order_index import lookup, normalize, record_orders
+from orders_parser import OrderList
+from toyhouse_browser import SESSION_FILE, BrowserSession, order_url
+from toyhouse_http import FastPathUnavailable, ToyhouseHTTP
+
 INVOICES_DIR = "invoices"
 
 
-def find_order_id(page, order_number):
-    """Find the numeric order ID for a given TH order number by scraping the orders list."""
-    from bs4 import BeautifulSoup
+def _find_and_record(order_list, page, order_number):
+    """Index the orders loaded since the last call, then return the ID for order_number or None."""
+    new = order_list.read(page)
+    record_orders(new)
+    for order in new:
+        if normalize(order["order_number"]) == normalize(order_number):
+            return order["order_id"]
+    return None
 
-    normalized = order_number.upper().lstrip("#")
 
-    soup = BeautifulSoup(page.content(), "html.parser")
-    for link in soup.find_all("a", href=lambda h: h and "/orders/" in h):
-        text = link.get_text(strip=True).lstrip("#").upper()
-        if text == normalized:
-            return link["href"].split("/orders/")[1].split("?")[0]
+def download_invoice_http(order_number):
+    """Fetch the invoice over plain HTTP with the saved session. Returns the file path.
 
-    return None
+    Raises FastPathUnavailable when the browser is needed instead.
+    """
+    filepath = os.path.join(INVOICES_DIR, f"{normalize(order_number)}_invoice.pdf")
+    return ToyhouseHTTP(SESSION_FILE).download_invoice(order_number, filepath)
 
 
-def download_invoice(order_number):
+def download_invoice(order_number, use_browser=False, fast=False):
     normalized = order_number.upper()
     if not normalized.startswith("#"):
         normalized = "#" + normalized
 
-    with sync_playwright() as p:
-        browser = p.chromium.launch(headless=False)
-
-        if os.path.exists(SESSION_FILE):
-            context = browser.new_context(
-                storage_state=SESSION_FILE,
-                accept_downloads=True,
-            )
-        else:
-            context = browser.new_context(accept_downloads=True)
-
-        page = context.new_page()
-
-        # Navigate to orders list to find the numeric ID for this order number
-        print(f"Looking up order {normalized}...")
-        page.goto(ORDERS_URL)
-        page.wait_for_load_state("networkidle")
-
-        if "authentication" in page.url.lower():
-            print("\nNot logged in. Please log in in the browser.")
-            print("Waiting until you reach the orders page...")
-            page.wait_for_url(ORDERS_URL, timeout=300000)
-            page.wait_for_load_state("networkidle")
-
-        context.storage_state(path=SESSION_FILE)
-
-        order_id = find_order_id(page, normalized)
-
-        # If not found on the first page, keep loading more
-        while order_id is None:
-            btn = page.locator("button", has_text="Load more")
-            if btn.count() == 0:
-                break
-            print("Order not found yet, loading more orders...")
-            btn.first.click()
-            page.wait_for_load_state("networkidle")
-            order_id = find_order_id(page, normalized)
-
-        if order_id is None:
-            print(f"ERROR: Order {normalized} not found.")
-            browser.close()
+    if not use_browser:
+        try:
+            filepath = download_invoice_http(normalized)
+            print(f"\nDone! Invoice saved to: {os.path.abspath(filepath)}")
             return
+        except FastPathUnavailable as e:
+            print(f"Fast path unavailable ({e}); using the browser...")
+
+    with sync_playwright() as p, BrowserSession(p, fast=fast, accept_downloads=True) as session:
+        indexed = lookup(normalized)
+        if indexed:
+            # Known order: skip the orders list and its "Load more" pagination
+            order_id = indexed["order_id"]
+            print(f"Order {normalized} is indexed — opening {order_url(order_id)}...")
+            session.open_order(order_id)
+        else:
+            # Navigate to orders list to find the numeric ID for this order number
+            print(f"Looking up order {normalized}...")
+            session.open_orders()
 
-        # Navigate to the order detail page
-        order_url = f"https://account.toyhousellc.com/orders/{order_id}"
-        print(f"Opening {order_url}...")
-        page.goto(order_url)
-        page.wait_for_load_state("networkidle")
-
-        # Find the Download Your Invoice button
-        btn = page.locator("button", has_text="Download Your Invoice")
-        if btn.count() == 0:
-            btn = page.locator("a", has_text="Download Your Invoice")
-        if btn.count() == 0:
-            print("ERROR: 'Download Your Invoice' button not found on this order page.")
-            browser.close()
-            return
+            order_list = OrderList()
+            order_id = _find_and_record(order_list, session.page, normalized)
+
+            # If not found on the first page, keep loading more
+            while order_id is None:
+                print("Order not found yet, loading more orders...")
+                if not session.load_more():
+                    break
+                order_id = _find_and_record(order_list, session.page, normalized)
+
+            if order_id is None:
+                print(f"ERROR: Order {normalized} not found.")
+                return
+
+            # Navigate to the order detail page
+            print(f"Opening {order_url(order_id)}...")
+            session.open_order(order_id)
 
         os.makedirs(INVOICES_DIR, exist_ok=True)
         filename = f"{normalized.lstrip('#')}_invoice.pdf"
         filepath = os.path.join(INVOICES_DIR, filename)
 
         print("Clicking 'Download Your Invoice'...")
-        with page.expect_download() as dl_info:
-            btn.first.click()
-
-        dl_info.value.save_as(filepath)
+        if session.download_invoice(filepath) is None:
+            print("ERROR: 'Download Your Invoice' button not found on this order page.")
+            return
         print(f"\nDone! Invoice saved to: {os.path.abspath(filepath)}")
 
-        browser.close()
-
 
 if __name__ == "__main__":
-    if len(sys.argv) != 2:
-        print("Usage: python download_invoice.py <order_number>")
+    argv = timings.start_from_argv("download_invoice", sys.argv[1:])
+    flags = {"--browser", "--fast"}
+    args = [a for a in argv if a not in flags]
+    if len(args) != 1:
+        print("Usage: python download_invoice.py <order_number> [--browser] [--fast] "
+              "[--timings] [--profile FILE] [--trace FILE]")
         print("Example: python download_invoice.py TH19087")
         sys.exit(1)
 
-    download_invoice(sys.argv[1])
+    try:
+        timings.annotate(order=args[0])
+        download_invoice(args[0], use_browser="--browser" in argv, fast="--fast" in argv)
+    finally:
+        timings.finish()
@@ -1,50 +1,42 @@
+"""Pick Toyhouse orders and download their invoice PDFs.
+
+Usage:
+    python download_orders.py                          # interactive: pick one order
+    python download_orders.py --bulk TH19087 TH19102   # download several orders at once
+    python download_orders.py --range TH19050-TH19100
+    python download_orders.py --missing                # every order without a local PDF
+
+Options:
+    --concurrency N   invoices downloading at once (default 4)
+    --retries N       extra attempts per failed invoice (default 2)
+    --fast            headless, resource-blocking browser (see toyhouse_browser.py);
+                      also works on its own for the interactive picker
+    --timings         per-stage timings (also --profile FILE, --trace FILE)
+"""
+
+import argparse
+import asyncio
 import os
+import re
+import sys
+import time
+from playwright.async_api import Error as PlaywrightError
+from playwright.async_api import TimeoutError as PlaywrightTimeoutError
+from playwright.async_api import async_playwright
 from playwright.sync_api import sync_playwright
-from bs4 import BeautifulSoup
+import timings
+from order_index import load_index, normalize, record_orders
+from orders_parser import OrderList
+from toyhouse_browser import (
+    DAEMON_CONNECT_TIMEOUT, DOWNLOAD_SELECTOR, LOAD_MORE_SELECTOR, LOGIN_TIMEOUT,
+    ORDER_ROW_SELECTOR, ORDERS_URL, SELECTOR_TIMEOUT, SESSION_FILE, BrowserSession,
+    daemon_endpoint, order_url, should_block,
+)
 
-ORDERS_URL = "https://account.toyhousellc.com/orders"
-SESSION_FILE = "toyhouse_session.json"
 INVOICES_DIR = "invoices"
 
-
-
-def parse_orders(html):
-    """Parse order rows from HTML into a list of dicts."""
-    soup = BeautifulSoup(html, "html.parser")
-    orders = []
-
-    for row in soup.find_all("div", role="row"):
-        # Skip header rows
-        if row.find(attrs={"role": "columnheader"}):
-            continue
-
-        link = row.find("a", href=lambda h: h and "/orders/" in h)
-        if not link:
-            continue
-
-        order_id = link["href"].split("/orders/")[1].split("?")[0]
-        order_number = link.get_text(strip=True)
-
-        cells = row.find_all("div", role="cell")
-
-        status = ""
-        if len(cells) >= 3:
-            strong = cells[2].find("strong")
-            if strong:
-                status = strong.get_text(strip=True)
-
-        total = ""
-        if len(cells) >= 5:
-            total = cells[4].get_text(strip=True)
-
-        orders.append({
-            "order_id": order_id,
-            "order_number": order_number,
-            "status": status,
-            "total": total,
-        })
-
-    return orders
+DEFAULT_CONCURRENCY = 4
+DEFAULT_RETRIES = 2
 
 
 def display_orders(orders):
@@ -55,75 +47,41 @@ def display_orders(orders):
         print(f"{i:<4} {o['order_number']:<12} {o['status']:<20} {o['total']}")
 
 
-def download_invoice(page, order):
-    """Navigate to the order page and click Download Your Invoice."""
-    order_url = f"https://account.toyhousellc.com/orders/{order['order_id']}"
+def download_invoice(session, order):
+    """Open the order page and click Download Your Invoice."""
     print(f"\nOpening order {order['order_number']}...")
-    page.goto(order_url)
-    page.wait_for_load_state("networkidle")
+    session.open_order(order["order_id"])
 
     os.makedirs(INVOICES_DIR, exist_ok=True)
-
-    btn = page.locator("button", has_text="Download Your Invoice")
-    if btn.count() == 0:
-        # Try link variant too
-        btn = page.locator("a", has_text="Download Your Invoice")
-    if btn.count() == 0:
-        print("ERROR: 'Download Your Invoice' button not found on this order page.")
-        return None
-
     filename = f"{order['order_number'].lstrip('#')}_invoice.pdf"
     filepath = os.path.join(INVOICES_DIR, filename)
 
     print("Clicking 'Download Your Invoice'...")
-    with page.expect_download() as dl_info:
-        btn.first.click()
-
-    download = dl_info.value
-    download.save_as(filepath)
+    if session.download_invoice(filepath) is None:
+        print("ERROR: 'Download Your Invoice' button not found on this order page.")
+        return None
     print(f"Saved: {filepath}")
     return filepath
 
 
-def main():
-    with sync_playwright() as p:
-        browser = p.chromium.launch(headless=False)
-
-        if os.path.exists(SESSION_FILE):
-            print(f"Loading saved session from {SESSION_FILE}...")
-            context = browser.new_context(
-                storage_state=SESSION_FILE,
-                accept_downloads=True,
-            )
-        else:
-            context = browser.new_context(accept_downloads=True)
-
-        page = context.new_page()
-
+def main(fast=False):
+    with sync_playwright() as p, BrowserSession(p, fast=fast, accept_downloads=True) as session:
         # --- Navigate to orders ---
         print(f"Navigating to {ORDERS_URL}...")
-        page.goto(ORDERS_URL)
-        page.wait_for_load_state("networkidle")
-
-        if "authentication" in page.url.lower():
-            print("\nNot logged in. Please log in in the browser.")
-            print("Waiting until you reach the orders page...")
-            page.wait_for_url(ORDERS_URL, timeout=300000)
-            page.wait_for_load_state("networkidle")
-
-        context.storage_state(path=SESSION_FILE)
+        session.open_orders()
 
         # --- Show orders and let user load more pages as needed ---
+        listed = OrderList()
         while True:
-            orders = parse_orders(page.content())
+            record_orders(listed.read(session.page))
+            orders = listed.orders
             if not orders:
                 print("No orders found.")
-                browser.close()
                 return
 
             display_orders(orders)
 
-            has_more = page.locator("button", has_text="Load more").count() > 0
+            has_more = session.page.locator(LOAD_MORE_SELECTOR).count() > 0
 
             if has_more:
                 raw = input(f"\nShowing {len(orders)} orders. Enter order # to download, 'm' to load more, or 'q' to quit: ").strip().lower()
@@ -132,12 +90,10 @@ def main():
 
             if raw == "q":
                 print("Exiting.")
-                browser.close()
                 return
             elif raw == "m" and has_more:
                 print("Loading more orders...")
-                page.locator("button", has_text="Load more").first.click()
-                page.wait_for_load_state("networkidle")
+                session.load_more()
                 continue
 
             try:
@@ -152,12 +108,304 @@ def main():
         print(f"\nSelected: {selected['order_number']}  {selected['status']}  {selected['total']}")
 
         # --- Download invoice ---
-        filepath = download_invoice(page, selected)
+        filepath = download_invoice(session, selected)
         if filepath:
             print(f"\nDone! Invoice saved to: {os.path.abspath(filepath)}")
 
-        browser.close()
+
+def invoice_file(order_number):
+    return os.path.join(INVOICES_DIR, f"{normalize(order_number)}_invoice.pdf")
+
+
+def expand_range(spec):
+    """'TH19050-TH19100' → ['TH19050', ..., 'TH19100']."""
+    m = re.fullmatch(r"#?([A-Za-z]*)(\d+)-#?([A-Za-z]*)(\d+)", spec.strip())
+    if not m:
+        raise ValueError(f"Invalid order range: {spec!r} (expected e.g. TH19050-TH19100)")
+    prefix = (m.group(1) or m.group(3)).upper()
+    first, last = sorted((int(m.group(2)), int(m.group(4))))
+    return [f"{prefix}{n}" for n in range(first, last + 1)]
+
+
+def _order_serial(order_number):
+    """Numeric part of an order number ('TH19087' → 19087), or None."""
+    digits = re.sub(r"\D", "", order_number)
+    return int(digits) if digits else None
+
+
+async def _route(route):
+    if should_block(route.request.resource_type, route.request.url):
+        await route.abort()
+    else:
+        await route.continue_()
+
+
+async def _attach(p, fast):
+    """(browser, context) attached to a running browser_daemon.py, or None."""
+    endpoint = daemon_endpoint()
+    if endpoint is None:
+        return None
+    try:
+        browser = await p.chromium.connect_over_cdp(endpoint, timeout=DAEMON_CONNECT_TIMEOUT)
+    except PlaywrightError as e:
+        print(f"Browser daemon at {endpoint} not usable ({e}); launching a browser.")
+        return None
+    print(f"Using the browser daemon at {endpoint}")
+    # Fast mode routes each of our pages instead (see _new_page): a route on the
+    # daemon's shared context would block resources for its other clients too
+    return browser, browser.contexts[0]
+
+
+async def _launch(p, fast, headless):
+    browser = await p.chromium.launch(headless=headless)
+    if os.path.exists(SESSION_FILE):
+        context = await browser.new_context(storage_state=SESSION_FILE, accept_downloads=True)
+    else:
+        context = await browser.new_context(accept_downloads=True)
+    if fast:
+        await context.route("**/*", _route)
+    return browser, context
+
+
+async def _new_page(context, route_page=False):
+    page = await context.new_page()
+    if route_page:
+        await page.route("**/*", _route)
+    return page
+
+
+async def _settle(page, selector, fast):
+    """Wait for selector in fast mode (network idle if it never shows), else for network idle."""
+    if fast:
+        try:
+            await page.wait_for_selector(selector, timeout=SELECTOR_TIMEOUT)
+            return
+        except PlaywrightTimeoutError:
+            pass
+    await page.wait_for_load_state("networkidle")
+
+
+async def _open_orders(context, fast=False, headless=False, route_page=False):
+    """Open the orders list, waiting for a manual login if the session has expired.
+
+    Returns None if a login is needed but the browser is headless.
+    """
+    page = await _new_page(context, route_page)
+    print(f"Navigating to {ORDERS_URL}...")
+    start = time.perf_counter()
+    await page.goto(ORDERS_URL, wait_until="domcontentloaded" if fast else "load")
+
+    if "authentication" in page.url.lower():
+        if headless:
+            await page.close()
+            return None
+        print("\nNot logged in. Please log in in the browser.")
+        print("Waiting until you reach the orders page...")
+        await page.wait_for_url(ORDERS_URL, timeout=LOGIN_TIMEOUT)
+    await _settle(page, ORDER_ROW_SELECTOR, fast)
+    elapsed = time.perf_counter() - start
+    timings.add("navigate", elapsed)
+    print(f"  orders page: {elapsed:.2f}s")
+
+    await context.storage_state(path=SESSION_FILE)
+    return page
+
+
+async def _resolve_orders(page, wanted, load_all, fast=False):
+    """Page through the orders list until every wanted order has an ID (or the list ends).
+
+    Returns {order_number: order_id}. With load_all, every order is loaded and
+    returned. Orders already in the order index never require paging.
+    """
+    index = load_index()
+    found = {o: index[o]["order_id"] for o in wanted if o in index}
+    if not load_all and len(found) == len(wanted):
+        return found
+    # The list is newest first: once it reaches orders older than the oldest
+    # wanted one, the rest cannot be in the account
+    oldest = min((n for n in map(_order_serial, wanted) if n is not None), default=None)
+
+    order_list = OrderList()
+    while True:
+        new = await order_list.read_async(page)
+        record_orders(new)
+        orders = order_list.orders
+        listed = {normalize(o["order_number"]): o["order_id"] for o in new}
+        if load_all:
+            found = {normalize(o["order_number"]): o["order_id"] for o in orders}
+        else:
+            found.update({o: listed[o] for o in wanted if o in listed})
+            if len(found) == len(wanted):
+                return found
+            serials = [n for n in map(_order_serial, listed) if n is not None]
+            if oldest is not None and serials and min(serials) < oldest:
+                return found
+
+        btn = page.locator("button", has_text="Load more")
+        if await btn.count() == 0:
+            return found
+        print(f"Loaded {len(orders)} orders, loading more...")
+        start = time.perf_counter()
+        await btn.first.click()
+        if fast:
+            try:
+                await page.wait_for_function(
+                    "([sel, n]) => document.querySelectorAll(sel).length > n",
+                    arg=[ORDER_ROW_SELECTOR, len(orders)], timeout=SELECTOR_TIMEOUT,
+                )
+            except PlaywrightTimeoutError:
+                await page.wait_for_load_state("networkidle")
+        else:
+            await page.wait_for_load_state("networkidle")
+        elapsed = time.perf_counter() - start
+        timings.add("load_more", elapsed)
+        print(f"  load more: {elapsed:.2f}s")
+
+
+async def _download_one(context, order_number, order_id, semaphore, retries, fast=False,
+                        route_page=False):
+    """Download one invoice in its own page, retrying failures. Returns (status, detail)."""
+    filepath = invoice_file(order_number)
+    async with semaphore:
+        error = None
+        for attempt in range(1 + retries):
+            page = await _new_page(context, route_page)
+            start = time.perf_counter()
+            try:
+                await page.goto(order_url(order_id), wait_until="domcontentloaded" if fast else "load")
+                await _settle(page, DOWNLOAD_SELECTOR, fast)
+
+                btn = page.locator("button", has_text="Download Your Invoice")
+                if await btn.count() == 0:
+                    btn = page.locator("a", has_text="Download Your Invoice")
+                if await btn.count() == 0:
+                    raise RuntimeError("'Download Your Invoice' button not found")
+
+                async with page.expect_download() as dl_info:
+                    await btn.first.click()
+                download = await dl_info.value
+                # Save beside the target and rename, so a failed save never looks done
+                tmp_path = f"{filepath}.part"
+                await download.save_as(tmp_path)
+                os.replace(tmp_path, filepath)
+                elapsed = time.perf_counter() - start
+                timings.add("download", elapsed)
+                print(f"  {order_number:<10} saved {filepath} ({elapsed:.2f}s)")
+                return "downloaded", filepath
+            except Exception as e:
+                error = f"{type(e).__name__}: {e}".splitlines()[0]
+                if attempt < retries:
+                    print(f"  {order_number:<10} attempt {attempt + 1} failed ({error}), retrying...")
+                    await asyncio.sleep(2 ** attempt)
+            finally:
+                await page.close()
+        print(f"  {order_number:<10} FAILED {error}")
+        return "failed", error
+
+
+async def bulk_download(order_numbers=(), missing=False, concurrency=DEFAULT_CONCURRENCY,
+                        retries=DEFAULT_RETRIES, fast=False):
+    """Download many invoices concurrently in one authenticated browser context.
+
+    Invoices that already exist locally are skipped. With fast, the browser is
+    headless (once a session exists) and blocks resources the downloads don't
+    need. Returns {order_number: (status, detail)}.
+    """
+    wanted = [normalize(o) for o in order_numbers]
+    results = {}
+    os.makedirs(INVOICES_DIR, exist_ok=True)
+
+    async with async_playwright() as p:
+        attached = await _attach(p, fast)
+        if attached:
+            browser, context = attached
+            # The daemon can't show a login prompt to us; treat it like headless
+            headless = True
+        else:
+            headless = fast and os.path.exists(SESSION_FILE)
+            browser, context = await _launch(p, fast, headless)
+        # Attached to the daemon, fast mode routes our own pages, not its context
+        route_pages = bool(attached) and fast
+        page = await _open_orders(context, fast, headless, route_pages)
+        if page is None:
+            print("\nSaved session has expired; reopening the browser so you can log in.")
+            attached = None
+            route_pages = False
+            await browser.close()
+            browser, context = await _launch(p, fast, headless=False)
+            page = await _open_orders(context, fast)
+        pending = [o for o in wanted if not os.path.exists(invoice_file(o))]
+        for o in wanted:
+            if o not in pending:
+                results[o] = ("skipped", "already downloaded")
+
+        ids = await _resolve_orders(page, pending, load_all=missing, fast=fast)
+        await page.close()
+        if missing:
+            pending = [o for o in ids if not os.path.exists(invoice_file(o))]
+        for o in pending:
+            if o not in ids:
+                results[o] = ("not found", "not in the orders list")
+
+        todo = [o for o in pending if o in ids]
+        print(f"\nDownloading {len(todo)} invoices, {concurrency} at a time...")
+        semaphore = asyncio.Semaphore(concurrency)
+        outcomes = await asyncio.gather(*(
+            _download_one(context, o, ids[o], semaphore, retries, fast, route_pages) for o in todo
+        ))
+        results.update(zip(todo, outcomes))
+
+        await context.storage_state(path=SESSION_FILE)
+        # For the daemon this only disconnects; its browser keeps running
+        await browser.close()
+
+    counts = {}
+    for status, _ in results.values():
+        counts[status] = counts.get(status, 0) + 1
+    print("\nBulk download: " + ", ".join(f"{n} {status}" for status, n in sorted(counts.items())))
+    for o, (status, detail) in results.items():
+        if status in ("failed", "not found"):
+            print(f"  {o:<10} {status}: {detail}")
+    return results
+
+
+def bulk_main(argv):
+    parser = argparse.ArgumentParser(description="Download many Toyhouse invoices concurrently.")
+    parser.add_argument("--bulk", nargs="+", default=[], metavar="ORDER",
+                        help="order numbers to download")
+    parser.add_argument("--range", dest="ranges", action="append", default=[], metavar="FIRST-LAST",
+                        help="a range of order numbers, e.g. TH19050-TH19100")
+    parser.add_argument("--missing", action="store_true",
+                        help="every order in the account without a local invoice PDF")
+    parser.add_argument("--concurrency", type=int, default=DEFAULT_CONCURRENCY, metavar="N",
+                        help=f"invoices downloading at once (default: {DEFAULT_CONCURRENCY})")
+    parser.add_argument("--retries", type=int, default=DEFAULT_RETRIES, metavar="N",
+                        help=f"extra attempts per failed invoice (default: {DEFAULT_RETRIES})")
+    parser.add_argument("--fast", action="store_true",
+                        help="headless browser that blocks images, fonts and third-party scripts")
+    args = parser.parse_args(argv)
+
+    orders = list(args.bulk)
+    try:
+        for spec in args.ranges:
+            orders.extend(expand_range(spec))
+    except ValueError as e:
+        parser.error(str(e))
+    if not orders and not args.missing:
+        parser.error("give --bulk, --range or --missing")
+
+    results = asyncio.run(bulk_download(orders, args.missing, args.concurrency, args.retries,
+                                        args.fast))
+    if any(status == "failed" for status, _ in results.values()):
+        sys.exit(1)
 
 
 if __name__ == "__main__":
-    main()
+    argv = timings.start_from_argv("download_orders", sys.argv[1:])
+    try:
+        if argv and argv != ["--fast"]:
+            bulk_main(argv)
+        else:
+            main(fast="--fast" in argv)
+    finally:
+        timings.finish()
@@ -1,51 +1,359 @@
+"""Download the Toyhouse master data sheet to ToyhousemasterData.csv.
+
+Usage:
+    python download_sheet.py              # always download
+    python download_sheet.py --sync       # download only if the sheet changed, and diff it
+    python download_sheet.py --sync --force
+    python download_sheet.py --projected  # only the columns generate_po.py uses, fetched
+                                          # in parallel row chunks
+"""
+
+import argparse
 import os
 import csv
 import json
-from google.auth.transport.requests import Request
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import quote
+
+from google.auth.transport.requests import AuthorizedSession, Request
 from google.oauth2.credentials import Credentials
 from google_auth_oauthlib.flow import InstalledAppFlow
 from googleapiclient.discovery import build
 
+import timings
+from master_index import MASTER_COLUMNS, build_index, load_master_records
+
 SCOPES = ["https://www.googleapis.com/auth/spreadsheets.readonly"]
+# --sync also reads the spreadsheet's Drive metadata (modified time / version)
+SYNC_SCOPES = SCOPES + ["https://www.googleapis.com/auth/drive.metadata.readonly"]
 SPREADSHEET_ID = "1CN4a9mvQ-Suyi_dceUZ7miHyB4omrvOVK1QvuOvx-ME"
 OUTPUT_FILE = "ToyhousemasterData.csv"
+SYNC_STATE_FILE = "ToyhousemasterData.sync.json"
+DIFF_FILE = "ToyhousemasterData.diff.json"
 TOKEN_FILE = "token.json"
 CREDENTIALS_FILE = "credentials.json"
 
+SHEETS_API = "https://sheets.googleapis.com/v4/spreadsheets"
+CHUNK_ROWS = 5000
+FETCH_WORKERS = 4
+# Rate-limited (429) and transient server errors are retried with exponential backoff
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+FETCH_RETRIES = 3
+RETRY_SECONDS = 1.0
+
 
-def get_credentials():
+def get_credentials(scopes=SCOPES):
     creds = None
     if os.path.exists(TOKEN_FILE):
-        creds = Credentials.from_authorized_user_file(TOKEN_FILE, SCOPES)
+        creds = Credentials.from_authorized_user_file(TOKEN_FILE)
+        # A token granted for fewer scopes (e.g. before --sync was used) needs a new consent
+        if not creds.has_scopes(scopes):
+            creds = None
     if not creds or not creds.valid:
         if creds and creds.expired and creds.refresh_token:
             creds.refresh(Request())
         else:
-            flow = InstalledAppFlow.from_client_secrets_file(CREDENTIALS_FILE, SCOPES)
+            flow = InstalledAppFlow.from_client_secrets_file(CREDENTIALS_FILE, scopes)
             creds = flow.run_local_server(port=0)
         with open(TOKEN_FILE, "w") as f:
             f.write(creds.to_json())
     return creds
 
 
-def download_sheet():
-    creds = get_credentials()
+def download_sheet(creds=None):
+    """Download the sheet to OUTPUT_FILE and rebuild the index. Returns the row count."""
+    creds = creds or get_credentials()
     service = build("sheets", "v4", credentials=creds)
 
     sheet = service.spreadsheets()
-    result = sheet.values().get(spreadsheetId=SPREADSHEET_ID, range="A1:ZZ").execute()
+    with timings.stage("fetch"):
+        result = sheet.values().get(spreadsheetId=SPREADSHEET_ID, range="A1:ZZ").execute()
     rows = result.get("values", [])
 
     if not rows:
         print("No data found in the sheet.")
-        return
+        return 0
 
-    with open(OUTPUT_FILE, "w", newline="", encoding="utf-8") as f:
+    with timings.stage("csv_write"), open(OUTPUT_FILE, "w", newline="", encoding="utf-8") as f:
         writer = csv.writer(f)
         writer.writerows(rows)
 
     print(f"Downloaded {len(rows)} rows to {OUTPUT_FILE}")
+    timings.count("rows", len(rows))
+
+    # Compile the lookup index now so the next PO run doesn't pay for it
+    with timings.stage("index_build"):
+        count = build_index(OUTPUT_FILE)
+    print(f"Indexed {count} items for generate_po.py")
+    return len(rows)
+
+
+def _column_letter(index):
+    """0 → A, 25 → Z, 26 → AA."""
+    letters = ""
+    index += 1
+    while index:
+        index, rem = divmod(index - 1, 26)
+        letters = chr(ord("A") + rem) + letters
+    return letters
+
+
+def _column_runs(indexes):
+    """Group sorted column indexes into contiguous (first, last) runs."""
+    runs = []
+    for i in indexes:
+        if runs and runs[-1][1] == i - 1:
+            runs[-1][1] = i
+        else:
+            runs.append([i, i])
+    return [tuple(run) for run in runs]
+
+
+def fetch_projected(make_session, out_path=OUTPUT_FILE, columns=MASTER_COLUMNS,
+                    chunk_rows=CHUNK_ROWS, workers=FETCH_WORKERS, base_url=SHEETS_API,
+                    spreadsheet_id=SPREADSHEET_ID):
+    """Stream only the named columns of the sheet to out_path, in parallel row chunks.
+
+    make_session returns a requests.Session-like object authorised for the
+    Sheets API (an AuthorizedSession in practice; a plain Session works against
+    a local fake of the endpoint, see selfcheck.py); each fetch thread gets its
+    own. Each chunk is one values:batchGet request with a range per contiguous
+    run of wanted columns. At most 2 × workers chunks are in flight, and chunks
+    are written in row order as they arrive, so memory stays bounded however
+    long the sheet is. A header that repeats resolves to its last column, as in
+    master_index.iter_master_records(). Returns the number of rows written,
+    header included.
+    """
+    sheet_url = f"{base_url}/{spreadsheet_id}"
+    local = threading.local()
+
+    def get(url, params=None):
+        # requests sessions are not guaranteed thread-safe; one per thread
+        http = getattr(local, "session", None)
+        if http is None:
+            http = local.session = make_session()
+        for attempt in range(FETCH_RETRIES + 1):
+            response = http.get(url, params=params)
+            if response.status_code not in RETRY_STATUSES or attempt == FETCH_RETRIES:
+                break
+            time.sleep(RETRY_SECONDS * 2 ** attempt)
+        response.raise_for_status()
+        return response.json()
+
+    meta = get(sheet_url, {"fields": "sheets(properties(title,gridProperties(rowCount)))"})
+    props = meta["sheets"][0]["properties"]
+    title = props["title"].replace("'", "''")
+    row_count = props["gridProperties"]["rowCount"]
+
+    header_range = quote(f"'{title}'!1:1", safe="")
+    header = get(f"{sheet_url}/values/{header_range}").get("values", [[]])[0]
+    # Later duplicate headers win, as they do when the full CSV is loaded
+    positions = {h.strip(): i for i, h in enumerate(header)}
+    wanted = sorted(positions[c] for c in columns if c in positions)
+    missing = [c for c in columns if c not in positions]
+    if missing:
+        print(f"WARNING: columns not found in the sheet: {', '.join(missing)}")
+    if not wanted:
+        print("No data found in the sheet.")
+        return 0
+    runs = _column_runs(wanted)
+
+    def fetch_chunk(first_row):
+        last_row = min(first_row + chunk_rows - 1, row_count)
+        ranges = [f"'{title}'!{_column_letter(a)}{first_row}:{_column_letter(b)}{last_row}"
+                  for a, b in runs]
+        result = get(f"{sheet_url}/values:batchGet",
+                     {"ranges": ranges, "majorDimension": "ROWS"})
+        blocks = [vr.get("values", []) for vr in result.get("valueRanges", [])]
+        height = max((len(b) for b in blocks), default=0)
+        rows = []
+        for i in range(height):
+            row = []
+            for (a, b), block in zip(runs, blocks):
+                cells = block[i] if i < len(block) else []
+                row.extend(cells + [""] * (b - a + 1 - len(cells)))
+            rows.append(row)
+        return rows
+
+    written = 0
+    tmp_path = f"{out_path}.{os.getpid()}.tmp"
+    try:
+        with open(tmp_path, "w", newline="", encoding="utf-8") as f, \
+                ThreadPoolExecutor(max_workers=workers) as pool:
+            writer = csv.writer(f)
+            writer.writerow([header[i] for i in wanted])
+            written += 1
+
+            starts = iter(range(2, row_count + 1, chunk_rows))
+            in_flight = deque()
+            for start in starts:
+                in_flight.append(pool.submit(fetch_chunk, start))
+                if len(in_flight) >= workers * 2:
+                    break
+            while in_flight:
+                rows = in_flight.popleft().result()
+                next_start = next(starts, None)
+                if next_start is not None:
+                    in_flight.append(pool.submit(fetch_chunk, next_start))
+                rows = [row for row in rows if any(row)]
+                writer.writerows(rows)
+                written += len(rows)
+        os.replace(tmp_path, out_path)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+    return written
+
+
+def download_projected(creds=None, chunk_rows=CHUNK_ROWS, workers=FETCH_WORKERS,
+                       base_url=SHEETS_API):
+    """Download just MASTER_COLUMNS to OUTPUT_FILE and rebuild the index. Returns the row count."""
+    creds = creds or get_credentials()
+    start = time.perf_counter()
+    with timings.stage("fetch"):
+        written = fetch_projected(lambda: AuthorizedSession(creds), OUTPUT_FILE,
+                                  chunk_rows=chunk_rows, workers=workers, base_url=base_url)
+    if not written:
+        return 0
+    print(f"Downloaded {written} rows of {len(MASTER_COLUMNS)} columns to {OUTPUT_FILE} "
+          f"in {time.perf_counter() - start:.1f}s")
+    timings.count("rows", written)
+
+    with timings.stage("index_build"):
+        count = build_index(OUTPUT_FILE)
+    print(f"Indexed {count} items for generate_po.py")
+    return written
+
+
+def sheet_revision(creds):
+    """Return the spreadsheet's Drive {"modifiedTime", "version"} metadata."""
+    drive = build("drive", "v3", credentials=creds)
+    return drive.files().get(fileId=SPREADSHEET_ID, fields="modifiedTime,version").execute()
+
+
+def master_columns_in(path):
+    """The MASTER_COLUMNS present in a master CSV's header, in MASTER_COLUMNS order."""
+    with open(path, newline="", encoding="utf-8") as f:
+        header = {h.strip() for h in next(csv.reader(f), [])}
+    return [col for col in MASTER_COLUMNS if col in header]
+
+
+def diff_master(old_rows, new_rows, columns=MASTER_COLUMNS):
+    """Row-level diff of two {Item #: MasterRow} mappings over the given columns.
+
+    Rows are the compact MASTER_COLUMNS projection (master_index.load_master_records),
+    so a diff of two full-width exports costs about as much memory as one PO run.
+    Pass only the columns present in both exports, so switching between a full
+    and a --projected download doesn't mark every SKU as changed.
+
+    Returns {"added": [...], "removed": [...], "changed": {sku: {column: [old, new]}}}.
+    """
+    added = [sku for sku in new_rows if sku not in old_rows]
+    removed = [sku for sku in old_rows if sku not in new_rows]
+    changed = {}
+    for sku, new in new_rows.items():
+        old = old_rows.get(sku)
+        if old is None or old == new:
+            continue
+        cols = {col: [old.get(col), new.get(col)] for col in columns
+                if old.get(col) != new.get(col)}
+        if cols:
+            changed[sku] = cols
+    return {"added": added, "removed": removed, "changed": changed}
+
+
+def _read_json(path):
+    if not os.path.exists(path):
+        return None
+    with open(path, encoding="utf-8") as f:
+        return json.load(f)
+
+
+def sync_sheet(force=False, projected=False, chunk_rows=CHUNK_ROWS, workers=FETCH_WORKERS,
+               base_url=SHEETS_API):
+    """Download the sheet only if it changed since the last sync, writing DIFF_FILE.
+
+    chunk_rows, workers and base_url are passed to download_projected() when
+    projected is set. Returns the diff, or None when the sheet was unchanged.
+    """
+    creds = get_credentials(SYNC_SCOPES)
+    with timings.stage("revision_check"):
+        revision = sheet_revision(creds)
+    state = _read_json(SYNC_STATE_FILE) or {}
+
+    if not force and os.path.exists(OUTPUT_FILE) and state.get("revision") == revision:
+        print(f"Master data unchanged since {revision.get('modifiedTime')} — nothing to do.")
+        return None
+
+    old_rows, old_columns = {}, MASTER_COLUMNS
+    if os.path.exists(OUTPUT_FILE):
+        old_rows = load_master_records(OUTPUT_FILE)
+        old_columns = master_columns_in(OUTPUT_FILE)
+    if projected:
+        written = download_projected(creds, chunk_rows, workers, base_url)
+    else:
+        written = download_sheet(creds)
+    if not written:
+        return None
+    new_rows = load_master_records(OUTPUT_FILE)
+    columns = [col for col in master_columns_in(OUTPUT_FILE) if col in old_columns]
+
+    with timings.stage("diff"):
+        diff = diff_master(old_rows, new_rows, columns)
+    diff.update({
+        "generated_at": time.strftime("%Y-%m-%d %H:%M:%S"),
+        "revision":     revision,
+        "previous_revision": state.get("revision"),
+    })
+    with open(DIFF_FILE, "w", encoding="utf-8") as f:
+        json.dump(diff, f, indent=2)
+    with open(SYNC_STATE_FILE, "w", encoding="utf-8") as f:
+        json.dump({"revision": revision, "synced_at": diff["generated_at"]}, f, indent=2)
+
+    print(f"Sheet modified {revision.get('modifiedTime')} (version {revision.get('version')})")
+    print(f"  Added:   {len(diff['added'])} SKUs")
+    print(f"  Removed: {len(diff['removed'])} SKUs")
+    print(f"  Changed: {len(diff['changed'])} SKUs")
+    print(f"  Diff → {DIFF_FILE}")
+    return diff
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Download the Toyhouse master data sheet.")
+    parser.add_argument("--sync", action="store_true",
+                        help="skip the download if the sheet is unchanged; otherwise "
+                             f"write a per-SKU diff to {DIFF_FILE}")
+    parser.add_argument("--force", action="store_true",
+                        help="with --sync, download and diff even if the sheet looks unchanged")
+    parser.add_argument("--projected", action="store_true",
+                        help="download only the columns generate_po.py uses, in parallel "
+                             "row chunks streamed straight to the CSV")
+    parser.add_argument("--chunk-rows", type=int, default=CHUNK_ROWS, metavar="N",
+                        help=f"--projected: rows per request (default: {CHUNK_ROWS})")
+    parser.add_argument("--workers", type=int, default=FETCH_WORKERS, metavar="N",
+                        help=f"--projected: concurrent requests (default: {FETCH_WORKERS})")
+    parser.add_argument("--api-url", default=SHEETS_API, help=argparse.SUPPRESS)
+    timings.add_arguments(parser)
+    args = parser.parse_args()
+    if not args.projected and (args.chunk_rows != CHUNK_ROWS or args.workers != FETCH_WORKERS
+                               or args.api_url != SHEETS_API):
+        parser.error("--chunk-rows, --workers and --api-url only apply with --projected")
+
+    timings.start_from_args("download_sheet", args)
+    try:
+        if args.sync:
+            sync_sheet(args.force, args.projected, args.chunk_rows, args.workers, args.api_url)
+        elif args.projected:
+            download_projected(chunk_rows=args.chunk_rows, workers=args.workers,
+                               base_url=args.api_url)
+        else:
+            download_sheet()
+    finally:
+        timings.finish()
 
 
 if __name__ == "__main__":
-    download_sheet()
+    main()
@@ -6,20 +6,48 @@ Usage:
     python generate_po.py TH20003
     python generate_po.py TH20003 "My Store Name"
 
+Batch mode (master data is loaded once, invoices are parsed in parallel):
+    python generate_po.py --batch TH20003 TH20004 [--location NAME] [--jobs N]
+    python generate_po.py --glob "invoices/TH200*_invoice.pdf"
+    python generate_po.py --missing        # every invoice PDF without a PO yet
+
+After a master data update, update existing POs without re-parsing their PDFs:
+    python generate_po.py --refresh [TH20003 ...]
+
 Outputs:
     invoices/<order>_PO.csv          — matched items, ready for import
     invoices/<order>_exceptions.csv  — items not found in master data
+    invoices/batch_summary.csv       — per-order results (batch mode only)
+    invoice_ledger.sqlite            — every parsed invoice's lines, for cost history (ledger.py)
+    .cache/po_manifests/<order>.json — what each line matched, for --refresh (po_manifest.py)
 """
 
+import argparse
 import csv
+import glob
+import hashlib
+import json
+import os
 import re
 import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
 from datetime import datetime
 
 import pdfplumber
 
+import invoice_cache
+import ledger
+import po_manifest
+import timings
+from master_index import MASTER_FILE, load_master_records, open_index
+from secondary_match import SecondaryIndex
+
 PO_VENDOR = "ToyHouse"
 
+# Bump whenever parse_invoice() output changes; cached parses of older versions are ignored
+PARSER_VERSION = "1"
+
 PO_HEADERS = [
     "PO #", "PO Description", "PO Start Ship", "PO End Ship", "PO Vendor",
     "PO Received at location", "Item Description", "Item Default Cost",
@@ -40,97 +68,500 @@ PO_HEADERS = [
 EXCEPTION_HEADERS = [
     "Item #", "Title", "UPC", "Pack Size", "Cases Ordered", "Total Qty",
     "Invoice Unit Cost", "Invoice Total Cost", "Reason",
+    "Candidate Item #", "Candidate Description", "Candidate Reason", "Other Candidates",
 ]
 
 
-def parse_invoice(pdf_path):
-    """Parse a Toyhouse invoice PDF. Returns (invoice_no, invoice_date, items)."""
-    items = []
+INVOICE_NO_RE = re.compile(r'#(TH\d+)')
+INVOICE_DATE_RE = re.compile(
+    r'(January|February|March|April|May|June|July|August|'
+    r'September|October|November|December)\s+\d+,\s+\d{4}'
+)
+PACK_SIZE_RE = re.compile(r'CS\s+PK\s+(\d+)', re.IGNORECASE)
+
+
+def _header_fields(text):
+    """Return (invoice_no, invoice_date) found in a page's text, either may be None."""
     invoice_no = None
     invoice_date = None
 
-    with pdfplumber.open(pdf_path) as pdf:
-        for page in pdf.pages:
-            text = page.extract_text() or ""
-
-            if not invoice_no:
-                m = re.search(r'#(TH\d+)', text)
-                if m:
-                    invoice_no = m.group(1)
-
-            if not invoice_date:
-                m = re.search(
-                    r'(January|February|March|April|May|June|July|August|'
-                    r'September|October|November|December)\s+\d+,\s+\d{4}', text
+    m = INVOICE_NO_RE.search(text)
+    if m:
+        invoice_no = m.group(1)
+
+    m = INVOICE_DATE_RE.search(text)
+    if m:
+        try:
+            dt = datetime.strptime(m.group(0), "%B %d, %Y")
+            invoice_date = dt.strftime("%m/%d/%Y")
+        except ValueError:
+            pass
+
+    return invoice_no, invoice_date
+
+
+def _items_from_tables(tables):
+    """Convert extracted table rows (TITLE, SKU, UPC, QTY, PRICE) into invoice items."""
+    items = []
+    for table in tables:
+        for row in table:
+            if not row or len(row) < 5:
+                continue
+            title_raw = (row[0] or "").strip()
+            sku      = (row[1] or "").strip()
+            upc      = (row[2] or "").strip()
+            qty_str  = (row[3] or "").strip()
+            price_str = (row[4] or "").strip()
+
+            # Skip header rows
+            if title_raw.upper() == "TITLE" or not sku or not sku.isdigit():
+                continue
+
+            # Normalise multi-line title
+            title = title_raw.replace("\n", " ")
+
+            # Pack size from "CS PK N"
+            m = PACK_SIZE_RE.search(title)
+            pack_size = int(m.group(1)) if m else 1
+
+            try:
+                qty_cases = int(qty_str)
+                case_price = float(
+                    price_str.replace("$", "").replace(",", "").strip()
                 )
-                if m:
-                    try:
-                        dt = datetime.strptime(m.group(0), "%B %d, %Y")
-                        invoice_date = dt.strftime("%m/%d/%Y")
-                    except ValueError:
-                        pass
-
-            for table in page.extract_tables():
-                for row in table:
-                    if not row or len(row) < 5:
-                        continue
-                    title_raw = (row[0] or "").strip()
-                    sku      = (row[1] or "").strip()
-                    upc      = (row[2] or "").strip()
-                    qty_str  = (row[3] or "").strip()
-                    price_str = (row[4] or "").strip()
-
-                    # Skip header rows
-                    if title_raw.upper() == "TITLE" or not sku or not sku.isdigit():
-                        continue
-
-                    # Normalise multi-line title
-                    title = title_raw.replace("\n", " ")
-
-                    # Pack size from "CS PK N"
-                    m = re.search(r'CS\s+PK\s+(\d+)', title, re.IGNORECASE)
-                    pack_size = int(m.group(1)) if m else 1
-
-                    try:
-                        qty_cases = int(qty_str)
-                        case_price = float(
-                            price_str.replace("$", "").replace(",", "").strip()
-                        )
-                    except (ValueError, AttributeError):
-                        continue
-
-                    items.append({
-                        "sku":        sku,
-                        "upc":        upc,
-                        "title":      title,
-                        "pack_size":  pack_size,
-                        "qty_cases":  qty_cases,
-                        "case_price": case_price,
-                    })
+            except (ValueError, AttributeError):
+                continue
+
+            items.append({
+                "sku":        sku,
+                "upc":        upc,
+                "title":      title,
+                "pack_size":  pack_size,
+                "qty_cases":  qty_cases,
+                "case_price": case_price,
+            })
+    return items
+
+
+def parse_page(page):
+    """Parse one invoice page on its own. Returns (invoice_no, invoice_date, items)."""
+    invoice_no, invoice_date = _header_fields(page.extract_text() or "")
+    return invoice_no, invoice_date, _items_from_tables(page.extract_tables())
+
+
+class TablePageParser:
+    """Default engine: extract_text() and a full-page extract_tables() on every page."""
+
+    def parse(self, page):
+        return parse_page(page)
+
+
+LAYOUT_FILE = "invoice_layout.json"
+ITEM_COLUMNS = ("TITLE", "SKU", "UPC", "QTY", "PRICE")
+
+
+def load_layout(path=LAYOUT_FILE):
+    """Return the saved column boundaries (6 x positions), or None if there is no template."""
+    if not os.path.exists(path):
+        return None
+    with open(path, encoding="utf-8") as f:
+        columns = json.load(f).get("columns")
+    return columns if columns and len(columns) == len(ITEM_COLUMNS) + 1 else None
+
+
+def layout_version(path=LAYOUT_FILE):
+    """A short hash of the saved layout template, or "learned" when there is none."""
+    try:
+        with open(path, "rb") as f:
+            return hashlib.sha256(f.read()).hexdigest()[:12]
+    except FileNotFoundError:
+        return "learned"
+
+
+def save_layout(columns, source, path=LAYOUT_FILE):
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump({"columns": columns, "headers": ITEM_COLUMNS, "source": source}, f, indent=2)
+
+
+def _group_lines(words, tolerance):
+    """Group extract_words() output into text lines, top to bottom, left to right."""
+    lines = []
+    for word in sorted(words, key=lambda w: (w["top"], w["x0"])):
+        if lines and abs(word["top"] - lines[-1][0]["top"]) <= tolerance:
+            lines[-1].append(word)
+        else:
+            lines.append([word])
+    return [sorted(line, key=lambda w: w["x0"]) for line in lines]
+
+
+class WordsPageParser:
+    """Layout engine: places extract_words() output straight into the 5-column grid.
+
+    The column x-boundaries are learned once per document from the
+    TITLE/SKU/UPC/QTY/PRICE header row (snapped to the table's vertical rules),
+    or come from a saved template (invoice_layout.json). Rows are the bands
+    between the table's horizontal rules; on unruled pages a line with a SKU
+    starts a row and title-only lines directly below continue it. Any page the
+    layout does not fit, e.g. a word straddling a column boundary, is parsed
+    with extract_tables() instead.
+    """
+
+    LINE_TOLERANCE = 3
+    # Output depends on invoice_layout.json, so cached parses are keyed on it too
+    uses_layout = True
+
+    def __init__(self, layout_path=LAYOUT_FILE):
+        self.invoice_no = None
+        self.invoice_date = None
+        self.columns = load_layout(layout_path)
+        self.fallback_pages = 0
+
+    def parse(self, page):
+        words = page.extract_words()
+        lines = _group_lines(words, self.LINE_TOLERANCE)
+
+        invoice_no = invoice_date = None
+        if not (self.invoice_no and self.invoice_date):
+            text = "\n".join(" ".join(w["text"] for w in line) for line in lines)
+            invoice_no, invoice_date = _header_fields(text)
+            self.invoice_no = self.invoice_no or invoice_no
+            self.invoice_date = self.invoice_date or invoice_date
+
+        header = self._header_line(lines)
+        if header and self.columns is None:
+            self.columns = self.learn_columns(page, header)
+
+        rows = self._rows(page, words, lines) if self.columns else None
+        if rows is None:
+            self.fallback_pages += 1
+            rows = [row for table in page.extract_tables() for row in table]
+        return invoice_no, invoice_date, _items_from_tables([rows])
+
+    @staticmethod
+    def _header_line(lines):
+        for line in lines:
+            texts = [w["text"].upper() for w in line]
+            if all(name in texts for name in ITEM_COLUMNS):
+                return [line[texts.index(name)] for name in ITEM_COLUMNS]
+        return None
+
+    @staticmethod
+    def learn_columns(page, header):
+        """Column boundaries from the header words, snapped to nearby vertical rules."""
+        top, bottom = header[0]["top"], header[0]["bottom"]
+        rules = sorted(e["x0"] for e in page.edges
+                       if e["orientation"] == "v" and e["top"] <= bottom and e["bottom"] >= top)
+
+        left = [x for x in rules if x <= header[0]["x0"]]
+        columns = [left[-1] if left else header[0]["x0"] - 3]
+        for prev, word in zip(header, header[1:]):
+            between = [x for x in rules if prev["x1"] < x <= word["x0"]]
+            columns.append(between[-1] if between else (prev["x1"] + word["x0"]) / 2)
+        right = [x for x in rules if x >= header[-1]["x1"]]
+        columns.append(right[0] if right else page.width)
+        return columns
+
+    def _column(self, word):
+        """Index of the column holding word, -1 if outside the table, None if it straddles."""
+        cols = self.columns
+        if word["x1"] <= cols[0] or word["x0"] >= cols[-1]:
+            return -1
+        for i in range(len(ITEM_COLUMNS)):
+            if cols[i] <= word["x0"] and word["x1"] <= cols[i + 1] + 0.5:
+                return i
+        return None
+
+    def _cells(self, words):
+        cells = [[] for _ in ITEM_COLUMNS]
+        for word in words:
+            col = self._column(word)
+            if col is None:
+                raise ValueError("word straddles a column boundary")
+            if col >= 0:
+                cells[col].append(word)
+        return ["\n".join(" ".join(w["text"] for w in line)
+                          for line in _group_lines(cell, self.LINE_TOLERANCE))
+                for cell in cells]
+
+    def _rows(self, page, words, lines):
+        """Rows of 5 cell strings, or None if the learned layout does not fit this page."""
+        left, right = self.columns[0], self.columns[-1]
+        rules = sorted({round(e["top"], 1) for e in page.edges
+                        if e["orientation"] == "h"
+                        and e["x0"] <= left + self.LINE_TOLERANCE
+                        and e["x1"] >= right - self.LINE_TOLERANCE})
+        try:
+            if len(rules) >= 2:
+                bands = [[] for _ in rules[1:]]
+                for word in words:
+                    middle = (word["top"] + word["bottom"]) / 2
+                    for i, (top, bottom) in enumerate(zip(rules, rules[1:])):
+                        if top < middle < bottom:
+                            bands[i].append(word)
+                            break
+                return [self._cells(band) for band in bands if band]
+            return self._unruled_rows(lines)
+        except ValueError:
+            return None
+
+    def _unruled_rows(self, lines):
+        rows = []
+        current = None
+        last_bottom = None
+        for line in lines:
+            in_table = [w for w in line if self._column(w) != -1]
+            if not in_table:
+                current = None
+                continue
+            columns = {self._column(w) for w in in_table}
+            if None in columns:
+                raise ValueError("word straddles a column boundary")
+            height = in_table[0]["bottom"] - in_table[0]["top"]
+            if 1 in columns:
+                current = list(in_table)
+                rows.append(current)
+            elif (current is not None and columns == {0}
+                    and in_table[0]["top"] - last_bottom <= height):
+                current.extend(in_table)
+            else:
+                current = None
+            last_bottom = in_table[0]["bottom"]
+        return [self._cells(row) for row in rows]
+
+
+PAGE_PARSERS = {
+    "table": TablePageParser,
+    "words": WordsPageParser,
+}
+DEFAULT_ENGINE = "table"
+
+
+def cache_version(engine=DEFAULT_ENGINE):
+    """Parsed-invoice cache version for an engine; engines never share entries.
+
+    For engines that read invoice_layout.json the version includes a hash of
+    it, so parses made with an older layout are not served after a new learn.
+    """
+    if engine == DEFAULT_ENGINE:
+        return PARSER_VERSION
+    if getattr(PAGE_PARSERS[engine], "uses_layout", False):
+        return f"{PARSER_VERSION}-{engine}-{layout_version()}"
+    return f"{PARSER_VERSION}-{engine}"
+
+
+def _timed_parse(parser, page):
+    """Return (parse result, wall seconds, CPU seconds) for one page."""
+    start, cpu = time.perf_counter(), time.process_time()
+    result = parser.parse(page)
+    return result, time.perf_counter() - start, time.process_time() - cpu
+
+
+def _rss_mb():
+    """Current RSS in MB, or the peak where the current figure isn't available."""
+    rss = timings.current_rss_mb()
+    return rss if rss is not None else timings.peak_rss_mb()
+
+
+def _iter_released_pages(pdf_path, parser, start=0, stop=None, max_rss_mb=None):
+    """Yield (parse result, wall, cpu) for pages [start, stop), releasing each page once parsed.
+
+    pdfplumber keeps every page's layout objects until the page is closed, so
+    without page.close() RSS grows with the page count.
+
+    With max_rss_mb, RSS is checked before each page and the parse stops with
+    MemoryError as soon as it is over the ceiling. This is a hard stop: memory
+    the process already took is rarely returned, so nothing is retried.
+    """
+    with pdfplumber.open(pdf_path) as pdf:
+        for number, page in enumerate(pdf.pages[start:stop], start + 1):
+            if max_rss_mb:
+                rss = _rss_mb()
+                if rss is not None and rss > max_rss_mb:
+                    raise MemoryError(f"RSS is {rss:.0f} MB, over the {max_rss_mb} MB ceiling, "
+                                      f"before page {number}")
+            result = _timed_parse(parser, page)
+            page.close()
+            yield result
+
+
+def _parse_page_range(pdf_path, start, stop, engine=DEFAULT_ENGINE, max_rss_mb=None):
+    """Process-pool worker: parse pages [start, stop) of one PDF, with per-page times."""
+    parser = PAGE_PARSERS[engine]()
+    return list(_iter_released_pages(pdf_path, parser, start, stop, max_rss_mb))
+
+
+def iter_invoice_pages(pdf_path, page_workers=None, engine=DEFAULT_ENGINE, max_rss_mb=None):
+    """Yield (invoice_no, invoice_date, items) for every page of the PDF, in page order.
+
+    engine picks the page parser from PAGE_PARSERS. With page_workers > 1 the
+    pages are split into contiguous ranges and parsed in that many worker
+    processes; results are still yielded in page order. max_rss_mb is a memory
+    ceiling for the parsing process(es), see _iter_released_pages().
+    """
+    page_count = None
+    if page_workers and page_workers > 1:
+        with pdfplumber.open(pdf_path) as pdf:
+            page_count = len(pdf.pages)
+    if page_count is None or page_count < 2:
+        parser = PAGE_PARSERS[engine]()
+        offset = time.perf_counter()
+        for number, (result, wall, cpu) in enumerate(
+                _iter_released_pages(pdf_path, parser, max_rss_mb=max_rss_mb), 1):
+            timings.add("parse_page", wall, cpu)
+            timings.page(number, wall, cpu, len(result[2]), offset)
+            yield result
+            offset = time.perf_counter()
+        return
+
+    workers = min(page_workers, page_count)
+    # A couple of ranges per worker evens out pages that are slower than others
+    chunk = max(1, -(-page_count // (workers * 2)))
+    ranges = [(start, min(start + chunk, page_count)) for start in range(0, page_count, chunk)]
+
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        futures = [pool.submit(_parse_page_range, pdf_path, start, stop, engine, max_rss_mb)
+                   for start, stop in ranges]
+        number = 0
+        for future in futures:
+            # Page times here are the workers'; this process only waits for them
+            with timings.stage("parse_wait"):
+                results = future.result()
+            for result, wall, cpu in results:
+                number += 1
+                timings.page(number, wall, cpu, len(result[2]))
+                yield result
+
+
+def parse_invoice(pdf_path, page_workers=None, engine=DEFAULT_ENGINE, max_rss_mb=None):
+    """Parse a Toyhouse invoice PDF. Returns (invoice_no, invoice_date, items).
+
+    invoice_no and invoice_date come from the first page that has them.
+    """
+    items = []
+    invoice_no = None
+    invoice_date = None
+
+    for page_no, page_date, page_items in iter_invoice_pages(pdf_path, page_workers, engine,
+                                                             max_rss_mb):
+        invoice_no = invoice_no or page_no
+        invoice_date = invoice_date or page_date
+        items.extend(page_items)
 
     return invoice_no, invoice_date, items
 
 
-def load_master_data(path="ToyhousemasterData.csv"):
-    data = {}
-    with open(path, newline="", encoding="utf-8") as f:
-        reader = csv.DictReader(f)
-        # Strip whitespace from header names to handle trailing spaces in sheet
-        reader.fieldnames = [h.strip() for h in reader.fieldnames]
-        for row in reader:
-            row = {k.strip() if k else "": v for k, v in row.items()}
-            key = str(row.get("Item #", "")).strip()
-            if key:
-                data[key] = row
-    return data
+class InvoiceStream:
+    """One pass over an invoice's items, parsed page by page as they are consumed.
+
+    Items come from the parsed-invoice cache when there is an entry for this PDF;
+    otherwise pages are parsed lazily and the cache entry is written alongside.
+    Items are held back until both invoice_no and invoice_date are known (normally
+    the first page), so those attributes are final whenever an item is yielded.
+    """
+
+    def __init__(self, pdf_path, use_cache=True, page_workers=None, engine=DEFAULT_ENGINE,
+                 max_rss_mb=None):
+        self.pdf_path = pdf_path
+        self.use_cache = use_cache
+        self.page_workers = page_workers
+        self.engine = engine
+        self.max_rss_mb = max_rss_mb
+        self.invoice_no = None
+        self.invoice_date = None
+        self.from_cache = False
+        self.item_count = 0
+        self.digest = None      # the PDF's SHA-256, once the cache lookup has computed it
+
+    def __iter__(self):
+        for item in self._items():
+            self.item_count += 1
+            yield item
+
+    def _items(self):
+        cache_writer = None
+        if self.use_cache:
+            with timings.stage("cache_lookup"):
+                digest = self.digest = invoice_cache.pdf_digest(self.pdf_path)
+                version = cache_version(self.engine)
+                cached = invoice_cache.lookup(digest, version)
+            if cached is not None:
+                meta, items = cached
+                self.invoice_no = meta["invoice_no"]
+                self.invoice_date = meta["invoice_date"]
+                self.from_cache = True
+                yield from items
+                return
+            cache_writer = invoice_cache.CacheWriter(digest, version, self.pdf_path)
+
+        try:
+            pending = []
+            pages = iter_invoice_pages(self.pdf_path, self.page_workers, self.engine, self.max_rss_mb)
+            for page_no, page_date, page_items in pages:
+                self.invoice_no = self.invoice_no or page_no
+                self.invoice_date = self.invoice_date or page_date
+                if cache_writer:
+                    for item in page_items:
+                        cache_writer.add(item)
+                if self.invoice_no and self.invoice_date:
+                    yield from pending
+                    pending = []
+                    yield from page_items
+                else:
+                    pending.extend(page_items)
+            yield from pending
+        except BaseException:
+            # Includes GeneratorExit: a partially consumed parse is not cached
+            if cache_writer:
+                cache_writer.abort()
+            raise
+
+        if cache_writer:
+            cache_writer.commit(self.invoice_no, self.invoice_date)
+
+
+class ParsedInvoice:
+    """An already-parsed invoice, usable wherever an InvoiceStream is."""
+
+    def __init__(self, invoice_no, invoice_date, items, from_cache=False, pdf_path=None, digest=None):
+        self.invoice_no = invoice_no
+        self.invoice_date = invoice_date
+        self.items = items
+        self.from_cache = from_cache
+        self.item_count = len(items)
+        self.pdf_path = pdf_path
+        self.digest = digest
+
+    def __iter__(self):
+        return iter(self.items)
+
+
+def load_invoice(pdf_path, use_cache=True, page_workers=None, engine=DEFAULT_ENGINE, max_rss_mb=None):
+    """parse_invoice() with the on-disk cache in invoice_cache.py in front of it.
+
+    Returns (invoice_no, invoice_date, items, from_cache).
+    """
+    stream = InvoiceStream(pdf_path, use_cache, page_workers, engine, max_rss_mb)
+    items = list(stream)
+    return stream.invoice_no, stream.invoice_date, items, stream.from_cache
+
+
+def load_master_data(path=MASTER_FILE, use_index=True):
+    """Return a SKU → MasterRow mapping, projected to the columns PO rows use.
+
+    By default this is backed by the compiled index in master_index.py, which is
+    rebuilt only when the CSV changes; use_index=False parses the CSV into a dict.
+    """
+    if use_index:
+        return open_index(path)
+    return load_master_records(path)
 
 
 def strip_currency(value):
     return value.replace("$", "").strip() if value else ""
 
 
-def parse_retirement(s):
-    """Returns (is_retired: bool, date_str: str)."""
+def parse_retirement(s, now=None):
+    """Returns (is_retired: bool, date_str: str). Dates are compared with now (default: now)."""
     if not s or not s.strip():
         return False, ""
     s = s.strip()
@@ -138,35 +569,42 @@ def parse_retirement(s):
         return True, ""
     try:
         dt = datetime.strptime(s, "%m/%d/%Y")
-        return dt < datetime.now(), s
+        return dt < (now or datetime.now()), s
     except ValueError:
         return False, s
 
 
 DEFAULT_LOCATION = "Bricks and Minifigs Herndon"
 
+# PO_HEADERS positions that vary per invoice line; everything else depends only on the SKU
+PO_NO_AT = PO_HEADERS.index("PO #")
+START_SHIP_AT = PO_HEADERS.index("PO Start Ship")
+LOCATION_AT = PO_HEADERS.index("PO Received at location")
+UPC_AT = PO_HEADERS.index("Item UPC")
+UNIT_COST_AT = PO_HEADERS.index("PO Line Unit Cost")
+QTY_AT = PO_HEADERS.index("PO Line Qty")
+VENDOR_ITEM_AT = PO_HEADERS.index("Item Vendor Details Item #")
+ITEM_NO_AT = PO_HEADERS.index("Item #")
 
-def build_po_row(invoice_no, invoice_date, inv_item, master_item, location):
-    sku       = inv_item["sku"]
-    pack_size = inv_item["pack_size"]
-    qty_cases = inv_item["qty_cases"]
-    case_price = inv_item["case_price"]
 
-    unit_cost = round(case_price / pack_size, 4)
-    total_qty = pack_size * qty_cases
+def po_item_template(sku, master_item, now=None):
+    """The PO row for one SKU in PO_HEADERS order, with the per-line fields left empty.
 
-    is_retired, ret_date = parse_retirement(master_item.get("Retirement Date", ""))
+    Item UPC holds the master UPC, which fill_po_row() replaces with the
+    invoice's when it is blank.
+    """
+    is_retired, ret_date = parse_retirement(master_item.get("Retirement Date", ""), now)
 
     def val(key):
         return master_item.get(key, "")
 
-    return {
-        "PO #":                          invoice_no,
+    row = {
+        "PO #":                          "",
         "PO Description":                "",
-        "PO Start Ship":                 invoice_date or "",
+        "PO Start Ship":                 "",
         "PO End Ship":                   "",
         "PO Vendor":                     PO_VENDOR,
-        "PO Received at location":       location,
+        "PO Received at location":       "",
         "Item Description":              val("Description"),
         "Item Default Cost":             strip_currency(val("Default Cost")),
         "Item Original Price":           strip_currency(val("MSRP")),
@@ -176,7 +614,7 @@ def build_po_row(invoice_no, invoice_date, inv_item, master_item, location):
         "Item Primary Image":            val("Image 1"),
         "Item Primary Vendor":           val("Primary Vendor"),
         "Item Taxable":                  val("Taxable"),
-        "Item UPC":                      val("UPC") or inv_item["upc"],
+        "Item UPC":                      val("UPC"),
         "Item Department":               val("Department"),
         "Item Category":                 val("Theme"),
         "Item Series":                   val("Theme"),
@@ -197,19 +635,80 @@ def build_po_row(invoice_no, invoice_date, inv_item, master_item, location):
         "Item Depth":                    val("Depth"),
         "Item Depth Unit":               "in" if val("Depth") else "",
         "Item #":                        sku,
-        "PO Line Unit Cost":             unit_cost,
-        "PO Line Qty":                   total_qty,
+        "PO Line Unit Cost":             "",
+        "PO Line Qty":                   "",
         "Item Vendor Details Item #":    sku,
         "Item Vendor Details Default Cost": strip_currency(val("Default Cost")),
         "Item Vendor Details #":         "",
         "Item Images URL":               val("Image 1"),
     }
+    return tuple(row[h] for h in PO_HEADERS)
+
 
+def fill_po_row(template, invoice_no, invoice_date, inv_item, location):
+    """A PO row (a list in PO_HEADERS order) from a SKU's template and one invoice line."""
+    pack_size = inv_item["pack_size"]
+    row = list(template)
+    row[PO_NO_AT] = invoice_no
+    row[START_SHIP_AT] = invoice_date or ""
+    row[LOCATION_AT] = location
+    if not row[UPC_AT]:
+        row[UPC_AT] = inv_item["upc"]
+    row[UNIT_COST_AT] = round(inv_item["case_price"] / pack_size, 4)
+    row[QTY_AT] = pack_size * inv_item["qty_cases"]
+    return row
 
-def build_exception_row(inv_item, reason):
+
+def build_po_row(invoice_no, invoice_date, inv_item, master_item, location, now=None):
+    """One PO row as a dict keyed by PO_HEADERS."""
+    template = po_item_template(inv_item["sku"], master_item, now)
+    return dict(zip(PO_HEADERS, fill_po_row(template, invoice_no, invoice_date, inv_item, location)))
+
+
+class POProjection:
+    """Per-SKU PO templates for one master data version and one run timestamp.
+
+    Each SKU's template is built on first lookup and reused, so repeated SKUs,
+    and in long-running processes every later invoice, skip the per-SKU work:
+    currency stripping, retirement dates and unit columns. Retirement is judged
+    against the projection's now, not the clock at each row.
+    """
+
+    def __init__(self, master_data, now=None):
+        self.master_data = master_data
+        self.now = now or datetime.now()
+        self._templates = {}
+        self._secondary = None
+
+    def template(self, sku):
+        """The SKU's PO template, or None if the SKU is not in master data."""
+        try:
+            return self._templates[sku]
+        except KeyError:
+            pass
+        master_item = self.master_data.get(sku)
+        template = po_item_template(sku, master_item, self.now) if master_item else None
+        self._templates[sku] = template
+        return template
+
+    def secondary_index(self):
+        """The UPC/title indexes for unmatched lines, built on first use."""
+        if self._secondary is None:
+            with timings.stage("secondary_index"):
+                self._secondary = SecondaryIndex(self.master_data)
+        return self._secondary
+
+    def is_current(self, master_data):
+        """True if this projection was built from master_data today."""
+        return master_data is self.master_data and self.now.date() == datetime.now().date()
+
+
+def build_exception_row(inv_item, reason, candidates=()):
+    """An exceptions CSV row; candidates are secondary_match.Candidates, best first."""
     unit_cost = round(inv_item["case_price"] / inv_item["pack_size"], 4)
     total_qty = inv_item["pack_size"] * inv_item["qty_cases"]
     total_cost = round(inv_item["case_price"] * inv_item["qty_cases"], 2)
+    best = candidates[0] if candidates else None
     return {
         "Item #":             inv_item["sku"],
         "Title":              inv_item["title"],
@@ -220,55 +719,517 @@ def build_exception_row(inv_item, reason):
         "Invoice Unit Cost":  unit_cost,
         "Invoice Total Cost": total_cost,
         "Reason":             reason,
+        "Candidate Item #":   best.sku if best else "",
+        "Candidate Description": best.description if best else "",
+        "Candidate Reason":   best.reason if best else "",
+        "Other Candidates":   "; ".join(f"{c.sku} ({c.reason})" for c in candidates[1:]),
     }
 
 
-def main():
-    if len(sys.argv) < 2:
-        print("Usage: python generate_po.py <order_number> [location]")
-        print("Example: python generate_po.py TH20003")
-        sys.exit(1)
+INVOICES_DIR = "invoices"
+INVOICE_SUFFIX = "_invoice.pdf"
 
-    order_number = sys.argv[1].upper()
-    location = sys.argv[2] if len(sys.argv) >= 3 else DEFAULT_LOCATION
-    pdf_path = f"invoices/{order_number}_invoice.pdf"
+SUMMARY_HEADERS = ["Order", "Status", "Invoice #", "Matched", "Exceptions", "UPC Accepted", "Error"]
 
-    print(f"Parsing invoice: {pdf_path}")
-    invoice_no, invoice_date, inv_items = parse_invoice(pdf_path)
-    print(f"  Invoice #: {invoice_no}, Date: {invoice_date}, Items: {len(inv_items)}")
 
+def invoice_path(order_number):
+    return os.path.join(INVOICES_DIR, f"{order_number}{INVOICE_SUFFIX}")
+
+
+def order_from_invoice_path(path):
+    """Return the order number for an invoices/<order>_invoice.pdf path, or None."""
+    name = os.path.basename(path)
+    if not name.endswith(INVOICE_SUFFIX):
+        return None
+    return name[:-len(INVOICE_SUFFIX)].upper()
+
+
+NOT_FOUND = "Item # not found in master data"
+
+
+def match_items(invoice, master_data, location, projection=None, accept_upc=False):
+    """Yield (kind, row) for each item of an invoice stream.
+
+    kind is "po" for PO rows and "exception" for exceptions CSV rows. Rows are
+    lists in PO_HEADERS / EXCEPTION_HEADERS order. Unmatched items get ranked
+    candidates from secondary_match.py. With accept_upc, an unmatched item whose
+    UPC matches exactly one master item goes into the PO as that item. It also
+    yields an "accepted" row for the exceptions CSV, so the substitution can be
+    reviewed.
+
+    Pass a POProjection to reuse SKU templates and indexes across invoices; by
+    default one is made for this call.
+    """
+    if projection is None:
+        projection = POProjection(master_data)
+    timed = timings.active() is not None
+    for item in invoice:
+        if timed:
+            start = time.perf_counter()
+        template = projection.template(item["sku"])
+        if timed:
+            looked_up = time.perf_counter()
+            timings.add("master_lookup", looked_up - start)
+        if template:
+            row = fill_po_row(template, invoice.invoice_no, invoice.invoice_date, item, location)
+            if timed:
+                timings.add("build_row", time.perf_counter() - looked_up)
+            yield "po", row
+            continue
+
+        secondary = projection.secondary_index()
+        if timed:
+            start = time.perf_counter()
+        candidates = secondary.candidates(item)
+        accepted = secondary.upc_match(item) if accept_upc else None
+        if timed:
+            timings.add("secondary_match", time.perf_counter() - start)
+        if accepted:
+            row = fill_po_row(projection.template(accepted), invoice.invoice_no,
+                              invoice.invoice_date, item, location)
+            # The vendor's item number is still the one on the invoice
+            row[VENDOR_ITEM_AT] = item["sku"]
+            yield "po", row
+            exception = build_exception_row(
+                item, f"Added to PO as Item # {accepted} (exact UPC match)", candidates)
+            yield "accepted", [exception[h] for h in EXCEPTION_HEADERS]
+        else:
+            exception = build_exception_row(item, NOT_FOUND, candidates)
+            yield "exception", [exception[h] for h in EXCEPTION_HEADERS]
+
+
+def _write_outputs(po_path, exc_path, rows):
+    """Write (kind, row) pairs to the PO/exceptions CSVs. Returns the count per kind.
+
+    Both files go to temp files that replace the real ones only once every row
+    is written, so a failure part-way through never leaves a truncated PO behind.
+    """
+    po_tmp = f"{po_path}.{os.getpid()}.tmp"
+    exc_tmp = f"{exc_path}.{os.getpid()}.tmp"
+    counts = {"po": 0, "exception": 0, "accepted": 0}
+
+    try:
+        with open(po_tmp, "w", newline="", encoding="utf-8") as po_file, \
+                open(exc_tmp, "w", newline="", encoding="utf-8") as exc_file:
+            exc_writer = csv.writer(exc_file)
+            writers = {"po": csv.writer(po_file), "exception": exc_writer, "accepted": exc_writer}
+            writers["po"].writerow(PO_HEADERS)
+            writers["exception"].writerow(EXCEPTION_HEADERS)
+            timed = timings.active() is not None
+            for kind, row in rows:
+                if timed:
+                    start = time.perf_counter()
+                writers[kind].writerow(row)
+                if timed:
+                    timings.add("csv_write", time.perf_counter() - start)
+                counts[kind] += 1
+
+        # Exceptions first: a fresh PO never sits next to a stale exceptions file
+        os.replace(exc_tmp, exc_path)
+        os.replace(po_tmp, po_path)
+    finally:
+        for tmp in (po_tmp, exc_tmp):
+            if os.path.exists(tmp):
+                os.remove(tmp)
+    return counts
+
+
+class _ManifestLines:
+    """Wraps an invoice stream, writing each item's line to a po_manifest.ManifestWriter.
+
+    Only the current item is held, as [item, kind, master SKU]. It starts as an
+    exception; generate_po() fills in the kind and SKU from the rows
+    match_items() yields for it, and it is written when the next item is taken.
+    """
+
+    def __init__(self, invoice, writer):
+        self.invoice = invoice
+        self.writer = writer
+        self.current = None
+
+    def __iter__(self):
+        for item in self.invoice:
+            self._flush()
+            self.current = [item, "exception", None]
+            yield item
+        self._flush()
+
+    def _flush(self):
+        if self.current:
+            self.writer.add(*self.current)
+            self.current = None
+
+    def __getattr__(self, name):
+        return getattr(self.invoice, name)
+
+
+def generate_po(order_number, invoice, master_data, location, projection=None, accept_upc=False,
+                use_ledger=False):
+    """Match an invoice stream against master data, writing the PO/exceptions CSVs.
+
+    Rows are written as the invoice is parsed (see _write_outputs), and so is
+    a manifest of what each line matched, for --refresh (see po_manifest.py).
+    With use_ledger, the invoice is then recorded in the ledger from the
+    manifest's lines, using the digest the stream already computed when there
+    is one. Memory use doesn't grow with the number of invoice lines.
+
+    Returns (po_path, exc_path, matched_count, exception_count, accepted_count);
+    accepted lines (see match_items) are in matched_count, not exception_count.
+    """
+    po_path = os.path.join(INVOICES_DIR, f"{order_number}_PO.csv")
+    exc_path = os.path.join(INVOICES_DIR, f"{order_number}_exceptions.csv")
+    manifest = po_manifest.ManifestWriter(order_number, master_data)
+    invoice = _ManifestLines(invoice, manifest)
+
+    def rows():
+        for kind, row in match_items(invoice, master_data, location, projection, accept_upc):
+            # match_items yields an item's rows before taking the next item, so
+            # invoice.current is this row's item. An accepted line yields its PO
+            # row, then its "accepted" exceptions row.
+            if kind == "po":
+                invoice.current[1:] = "po", row[ITEM_NO_AT]
+            elif kind == "accepted":
+                invoice.current[1] = "accepted"
+            yield kind, row
+
+    try:
+        counts = _write_outputs(po_path, exc_path, rows())
+    except BaseException:
+        manifest.abort()
+        raise
+    manifest.commit(invoice.invoice_no, invoice.invoice_date, location, accept_upc, po_path, exc_path)
+    if use_ledger:
+        with timings.stage("ledger"):
+            ledger.record(order_number, invoice.invoice_no, invoice.invoice_date,
+                          po_manifest.iter_items(order_number), invoice.pdf_path, invoice.digest)
+
+    timings.count("po_rows", counts["po"])
+    timings.count("exceptions", counts["exception"])
+    timings.count("upc_accepted", counts["accepted"])
+    return po_path, exc_path, counts["po"], counts["exception"], counts["accepted"]
+
+
+def _csv_text(row):
+    """A row as csv.writer writes it and csv.reader reads it back."""
+    return ["" if v is None else str(v) for v in row]
+
+
+def refresh_po(order_number, master_data, projection=None):
+    """Bring an order's PO/exceptions CSVs up to date with master data, without the PDF.
+
+    Uses the manifest generate_po() saved. PO lines whose master row is
+    unchanged keep their rows. The rest, and every exception and accepted
+    line, are matched again, so the exceptions also get fresh candidates.
+    The CSVs are rewritten only if a row changed.
+
+    Returns a dict: "status" is "updated", "unchanged" or "skipped" (with a
+    "reason"), and "changed", "resolved" and "new_exceptions" list the Item #s
+    of changed lines, exceptions now in the PO, and PO lines now exceptions.
+    """
+    result = {"order": order_number, "status": "unchanged", "reason": "",
+              "changed": [], "resolved": [], "new_exceptions": []}
+    manifest = po_manifest.load(order_number)
+    if manifest is None:
+        return {**result, "status": "skipped",
+                "reason": "no manifest; generate the PO once without --refresh"}
+    problem = po_manifest.outputs_problem(manifest)
+    if problem:
+        return {**result, "status": "skipped", "reason": problem}
+    version = po_manifest.master_version(master_data)
+    if version and version == manifest["master_version"]:
+        return result
+
+    if projection is None:
+        projection = POProjection(master_data)
+    po_path, exc_path = manifest["po"]["path"], manifest["exceptions"]["path"]
+    with open(po_path, newline="", encoding="utf-8") as f:
+        old_po = list(csv.reader(f))[1:]
+    with open(exc_path, newline="", encoding="utf-8") as f:
+        old_exc = list(csv.reader(f))[1:]
+    old_po, old_exc = iter(old_po), iter(old_exc)
+
+    rows, lines = [], []
+    for line in manifest["lines"]:
+        item, kind, sku = line["item"], line["kind"], line["sku"]
+        old = []
+        if kind != "exception":
+            old.append(("po", next(old_po)))
+        if kind != "po":
+            old.append((kind, next(old_exc)))
+
+        if kind == "po" and po_manifest.row_hash(master_data.get(sku)) == line["hash"]:
+            rows.extend(old)
+            lines.append((item, kind, sku))
+            continue
+
+        invoice = ParsedInvoice(manifest["invoice_no"], manifest["invoice_date"], [item])
+        fresh = [(k, _csv_text(r)) for k, r in match_items(
+            invoice, master_data, manifest["location"], projection, manifest["accept_upc"])]
+        kinds = [k for k, _ in fresh]
+        new_kind = "accepted" if "accepted" in kinds else kinds[0]
+        new_sku = fresh[0][1][ITEM_NO_AT] if kinds[0] == "po" else None
+        rows.extend(fresh)
+        lines.append((item, new_kind, new_sku))
+        if fresh != old:
+            result["changed"].append(item["sku"])
+            if kind == "exception" and new_kind != "exception":
+                result["resolved"].append(item["sku"])
+            elif kind != "exception" and new_kind == "exception":
+                result["new_exceptions"].append(item["sku"])
+
+    if result["changed"]:
+        _write_outputs(po_path, exc_path, rows)
+        result["status"] = "updated"
+    # Rewritten even when nothing changed, to record the new master version and hashes
+    po_manifest.write(order_number, manifest["invoice_no"], manifest["invoice_date"], lines,
+                      master_data, manifest["location"], manifest["accept_upc"], po_path, exc_path)
+    return result
+
+
+def run_refresh(orders, use_index=True):
+    """Refresh the POs of orders (default: every order with a manifest). Returns the results."""
+    orders = orders or po_manifest.orders()
+    print(f"Refreshing {len(orders)} purchase orders against master data...")
     print("Loading master data...")
-    master_data = load_master_data()
+    with timings.stage("master_load"):
+        master_data = load_master_data(use_index=use_index)
     print(f"  {len(master_data)} items loaded")
+    projection = POProjection(master_data)
 
-    po_rows = []
-    exception_rows = []
-
-    for item in inv_items:
-        sku = item["sku"]
-        master_item = master_data.get(sku)
-        if master_item:
-            po_rows.append(build_po_row(invoice_no, invoice_date, item, master_item, location))
+    results = []
+    for order_number in orders:
+        with timings.stage("refresh"):
+            result = refresh_po(order_number, master_data, projection)
+        results.append(result)
+        if result["status"] == "skipped":
+            detail = result["reason"]
+        elif result["status"] == "updated":
+            changed = len(result["changed"])
+            detail = f"{changed} line{'s' if changed != 1 else ''} changed"
+            if result["resolved"]:
+                detail += f"; resolved: {', '.join(result['resolved'])}"
+            if result["new_exceptions"]:
+                detail += f"; now exceptions: {', '.join(result['new_exceptions'])}"
         else:
-            exception_rows.append(
-                build_exception_row(item, "Item # not found in master data")
-            )
+            detail = ""
+        print(f"  {order_number:<10} {result['status']:<9} {detail}".rstrip())
 
-    po_path = f"invoices/{order_number}_PO.csv"
-    with open(po_path, "w", newline="", encoding="utf-8") as f:
-        writer = csv.DictWriter(f, fieldnames=PO_HEADERS)
-        writer.writeheader()
-        writer.writerows(po_rows)
+    statuses = [r["status"] for r in results]
+    resolved = sum(len(r["resolved"]) for r in results)
+    print(f"\nRefresh results: {statuses.count('updated')} updated, "
+          f"{statuses.count('unchanged')} unchanged, {statuses.count('skipped')} skipped; "
+          f"{resolved} exceptions resolved")
+    return results
+
+
+def _parse_order(order_number, use_cache=True, engine=DEFAULT_ENGINE, max_rss_mb=None):
+    """Process-pool worker: parse one order's invoice PDF.
+
+    Returns ParsedInvoice arguments: load_invoice()'s tuple plus the PDF path and digest.
+    """
+    pdf_path = invoice_path(order_number)
+    stream = InvoiceStream(pdf_path, use_cache, engine=engine, max_rss_mb=max_rss_mb)
+    items = list(stream)
+    return stream.invoice_no, stream.invoice_date, items, stream.from_cache, pdf_path, stream.digest
+
+
+def batch_orders(orders=(), pattern=None, missing=False):
+    """Resolve the orders for a batch run from explicit numbers, a glob and/or --missing."""
+    selected = [o.upper().lstrip("#") for o in orders]
+
+    if pattern:
+        for path in sorted(glob.glob(pattern)):
+            order_number = order_from_invoice_path(path)
+            if order_number:
+                selected.append(order_number)
+
+    if missing:
+        for path in sorted(glob.glob(os.path.join(INVOICES_DIR, f"*{INVOICE_SUFFIX}"))):
+            order_number = order_from_invoice_path(path)
+            po_path = os.path.join(INVOICES_DIR, f"{order_number}_PO.csv")
+            if order_number and not os.path.exists(po_path):
+                selected.append(order_number)
+
+    # De-duplicate while keeping the requested order
+    return list(dict.fromkeys(selected))
+
+
+def run_batch(orders, location, jobs=None, use_index=True, use_cache=True,
+              engine=DEFAULT_ENGINE, use_ledger=True, accept_upc=False, max_rss_mb=None):
+    """Generate POs for many orders with one master-data load and a parse process pool.
+
+    Returns the list of per-order summary dicts (also written to batch_summary.csv).
+    """
+    jobs = max(1, min(jobs or os.cpu_count() or 1, len(orders)))
+    print(f"Generating {len(orders)} purchase orders with {jobs} parser processes...")
+
+    summary = []
+    with ProcessPoolExecutor(max_workers=jobs) as pool:
+        # Submit first so the workers parse PDFs while master data loads here
+        futures = {pool.submit(_parse_order, o, use_cache, engine, max_rss_mb): o for o in orders}
+
+        print("Loading master data...")
+        with timings.stage("master_load"):
+            master_data = load_master_data(use_index=use_index)
+        print(f"  {len(master_data)} items loaded")
+        # One projection for the batch: SKUs shared between invoices are templated once
+        projection = POProjection(master_data)
 
-    exc_path = f"invoices/{order_number}_exceptions.csv"
-    with open(exc_path, "w", newline="", encoding="utf-8") as f:
-        writer = csv.DictWriter(f, fieldnames=EXCEPTION_HEADERS)
+        for future in as_completed(futures):
+            order_number = futures[future]
+            result = {"Order": order_number, "Status": "ok", "Invoice #": "",
+                      "Matched": "", "Exceptions": "", "UPC Accepted": "", "Error": ""}
+            try:
+                invoice = ParsedInvoice(*future.result())
+                timings.count("items", invoice.item_count)
+                with timings.stage("generate_po"):
+                    _, _, matched, exceptions, accepted = generate_po(
+                        order_number, invoice, master_data, location, projection, accept_upc,
+                        use_ledger
+                    )
+                result.update({"Invoice #": invoice.invoice_no or "", "Matched": matched,
+                               "Exceptions": exceptions, "UPC Accepted": accepted})
+                source = " (cached parse)" if invoice.from_cache else ""
+                by_upc = f" ({accepted} by UPC)" if accepted else ""
+                print(f"  {order_number:<10} ok      {matched} matched{by_upc}, "
+                      f"{exceptions} exceptions{source}")
+            except Exception as e:
+                result.update({"Status": "failed", "Error": f"{type(e).__name__}: {e}"})
+                print(f"  {order_number:<10} FAILED  {result['Error']}")
+            summary.append(result)
+
+    # Report in the order the batch was requested, not completion order
+    position = {o: i for i, o in enumerate(orders)}
+    summary.sort(key=lambda r: position[r["Order"]])
+
+    summary_path = os.path.join(INVOICES_DIR, "batch_summary.csv")
+    with open(summary_path, "w", newline="", encoding="utf-8") as f:
+        writer = csv.DictWriter(f, fieldnames=SUMMARY_HEADERS)
         writer.writeheader()
-        writer.writerows(exception_rows)
+        writer.writerows(summary)
+
+    failed = sum(1 for r in summary if r["Status"] != "ok")
+    print(f"\nBatch results: {len(summary) - failed} succeeded, {failed} failed")
+    print(f"  Summary → {summary_path}")
+    if max_rss_mb:
+        # The pool has shut down, so its processes count as finished children
+        print(f"  Peak RSS: {timings.peak_rss_mb()} MB here, "
+              f"{timings.peak_rss_mb(children=True)} MB in the parser processes")
+    return summary
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Generate Purchase Order CSVs from Toyhouse invoice PDFs."
+    )
+    parser.add_argument("args", nargs="*", metavar="order_number [location]",
+                        help="order number and optional location, or with --batch, many order numbers")
+    parser.add_argument("--batch", action="store_true",
+                        help="treat every positional argument as an order number")
+    parser.add_argument("--glob", dest="pattern", metavar="PATTERN",
+                        help=f"batch: every invoice PDF matching PATTERN (e.g. '{INVOICES_DIR}/*{INVOICE_SUFFIX}')")
+    parser.add_argument("--missing", action="store_true",
+                        help="batch: every invoice PDF that has no PO CSV yet")
+    parser.add_argument("--location", help=f"received-at location (default: {DEFAULT_LOCATION!r})")
+    parser.add_argument("--jobs", type=int, metavar="N",
+                        help="batch: parser processes (default: number of CPU cores)")
+    parser.add_argument("--page-workers", type=int, metavar="N",
+                        help="parse the pages of a single invoice in N worker processes "
+                             "(batch mode already parses one invoice per process)")
+    parser.add_argument("--engine", choices=sorted(PAGE_PARSERS), default=DEFAULT_ENGINE,
+                        help="invoice page parser: 'table' (default), or 'words', which maps "
+                             "word positions onto the learned column layout")
+    parser.add_argument("--max-rss", dest="max_rss_mb", type=int, metavar="MB",
+                        help="memory ceiling for invoice parsing: checked before each page, and the "
+                             "parse stops with an error once RSS is over it (applies to each parser "
+                             "process); peak RSS is reported")
+    parser.add_argument("--no-index", dest="use_index", action="store_false",
+                        help="parse ToyhousemasterData.csv directly instead of using the compiled index")
+    parser.add_argument("--no-cache", dest="use_cache", action="store_false",
+                        help="always parse the invoice PDF, bypassing the parsed-invoice cache")
+    parser.add_argument("--no-ledger", dest="use_ledger", action="store_false",
+                        help=f"don't record the parsed invoices in {ledger.LEDGER_FILE}")
+    parser.add_argument("--refresh", action="store_true",
+                        help="after a master data update, update the POs of the given orders (default: "
+                             "every generated PO) from their manifests, without parsing the PDFs")
+    parser.add_argument("--accept-upc", action="store_true",
+                        help="put lines whose Item # isn't in master data but whose UPC matches "
+                             "exactly one master item into the PO as that item (they are also "
+                             "listed in the exceptions CSV for review)")
+    timings.add_arguments(parser)
+    return parser.parse_args(argv)
+
+
+def main():
+    args = parse_args()
+    timings.start_from_args("generate_po", args)
+    try:
+        run(args)
+    finally:
+        timings.finish()
+
+
+def run(args):
+    if args.refresh:
+        run_refresh([o.upper().lstrip("#") for o in args.args], args.use_index)
+        return
+
+    if args.batch or args.pattern or args.missing:
+        orders = batch_orders(args.args, args.pattern, args.missing)
+        if not orders:
+            print("No orders to process.")
+            sys.exit(1)
+        timings.annotate(orders=len(orders), engine=args.engine)
+        summary = run_batch(orders, args.location or DEFAULT_LOCATION, args.jobs,
+                            args.use_index, args.use_cache, args.engine, args.use_ledger,
+                            args.accept_upc, args.max_rss_mb)
+        if any(r["Status"] != "ok" for r in summary):
+            sys.exit(1)
+        return
+
+    if not args.args or len(args.args) > 2:
+        print("Usage: python generate_po.py <order_number> [location]")
+        print("Example: python generate_po.py TH20003")
+        sys.exit(1)
+
+    order_number = args.args[0].upper()
+    if len(args.args) == 2:
+        location = args.args[1]
+    else:
+        location = args.location or DEFAULT_LOCATION
+    pdf_path = invoice_path(order_number)
+
+    print("Loading master data...")
+    with timings.stage("master_load"):
+        master_data = load_master_data(use_index=args.use_index)
+    print(f"  {len(master_data)} items loaded")
+
+    print(f"Parsing invoice: {pdf_path}")
+    invoice = InvoiceStream(pdf_path, args.use_cache, args.page_workers, args.engine, args.max_rss_mb)
+    try:
+        po_path, exc_path, matched, exceptions, accepted = generate_po(
+            order_number, invoice, master_data, location, accept_upc=args.accept_upc,
+            use_ledger=args.use_ledger
+        )
+    except MemoryError as e:
+        print(f"Parsing stopped: {e}")
+        sys.exit(1)
+    source = " (cached parse)" if invoice.from_cache else ""
+    print(f"  Invoice #: {invoice.invoice_no}, Date: {invoice.invoice_date}, "
+          f"Items: {invoice.item_count}{source}")
+    timings.count("items", invoice.item_count)
+    timings.annotate(order=order_number, invoice_no=invoice.invoice_no, engine=args.engine,
+                     page_workers=args.page_workers, from_cache=invoice.from_cache)
 
     print(f"\nResults:")
-    print(f"  Matched   → {po_path} ({len(po_rows)} items)")
-    print(f"  Exceptions → {exc_path} ({len(exception_rows)} items)")
+    print(f"  Matched   → {po_path} ({matched} items)")
+    print(f"  Exceptions → {exc_path} ({exceptions} items)")
+    if accepted:
+        print(f"  {accepted} items accepted into the PO by UPC; review them in the exceptions file")
+    if args.max_rss_mb:
+        workers = (f", {timings.peak_rss_mb(children=True)} MB in page workers"
+                   if args.page_workers and args.page_workers > 1 else "")
+        print(f"  Peak RSS: {timings.peak_rss_mb()} MB (ceiling {args.max_rss_mb} MB){workers}")
 
 
 if __name__ == "__main__":
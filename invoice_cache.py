@@ -0,0 +1,196 @@
+#!/usr/bin/env python3
+"""Content-addressed cache of parsed invoice PDFs.
+
+Parsing a PDF with pdfplumber is by far the slowest part of generate_po.py, and
+the same invoice is often re-run after master data is fixed. Parsed results are
+stored as JSON Lines under .cache/invoices/, keyed by the PDF's SHA-256 and the
+parser version, so an unchanged invoice never goes through layout analysis twice
+and a parser change invalidates old entries automatically.
+
+Usage:
+    python invoice_cache.py list             # show cached invoices
+    python invoice_cache.py show TH20003     # show the cached parse for an order
+    python invoice_cache.py clear            # delete every entry
+    python invoice_cache.py clear TH20003    # delete the entries for one order
+"""
+
+import hashlib
+import json
+import os
+import sys
+import time
+
+from master_index import CACHE_DIR
+
+INVOICE_CACHE_DIR = os.path.join(CACHE_DIR, "invoices")
+
+
+def pdf_digest(pdf_path):
+    h = hashlib.sha256()
+    with open(pdf_path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def _entry_path(digest, parser_version):
+    return os.path.join(INVOICE_CACHE_DIR, f"{digest}-{parser_version}.jsonl")
+
+
+def _read_entry(path):
+    """Open an entry file. Returns (meta, items_iterator) or None if unreadable.
+
+    Entries are JSON Lines: a header line with the invoice fields, then one line
+    per item, so callers can stream the items without loading them all.
+    """
+    try:
+        f = open(path, encoding="utf-8")
+    except OSError:
+        return None
+    try:
+        meta = json.loads(f.readline())
+    except ValueError:
+        f.close()
+        return None
+
+    def items():
+        with f:
+            for line in f:
+                yield json.loads(line)
+
+    return meta, items()
+
+
+def lookup(digest, parser_version):
+    """Return (meta, items_iterator) for a PDF digest and parser version, or None."""
+    return _read_entry(_entry_path(digest, parser_version))
+
+
+def get(digest, parser_version):
+    """Return the cached entry (meta plus an "items" list), or None."""
+    found = lookup(digest, parser_version)
+    if found is None:
+        return None
+    meta, items = found
+    return {**meta, "items": list(items)}
+
+
+class CacheWriter:
+    """Builds a cache entry one item at a time, as the invoice is parsed.
+
+    Items are spooled to a temp file; commit() writes the final entry and renames
+    it into place, so an interrupted parse never leaves a partial entry behind.
+    """
+
+    def __init__(self, digest, parser_version, pdf_path):
+        os.makedirs(INVOICE_CACHE_DIR, exist_ok=True)
+        self.digest = digest
+        self.parser_version = parser_version
+        self.pdf_path = pdf_path
+        self.path = _entry_path(digest, parser_version)
+        self._spool_path = f"{self.path}.{os.getpid()}.items.tmp"
+        self._spool = open(self._spool_path, "w", encoding="utf-8")
+        self.count = 0
+
+    def add(self, item):
+        self._spool.write(json.dumps(item) + "\n")
+        self.count += 1
+
+    def commit(self, invoice_no, invoice_date):
+        self._spool.close()
+        meta = {
+            "pdf_sha256":     self.digest,
+            "parser_version": self.parser_version,
+            "source":         self.pdf_path,
+            "cached_at":      time.strftime("%Y-%m-%d %H:%M:%S"),
+            "invoice_no":     invoice_no,
+            "invoice_date":   invoice_date,
+            "item_count":     self.count,
+        }
+        tmp_path = f"{self.path}.{os.getpid()}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as out, \
+                open(self._spool_path, encoding="utf-8") as spool:
+            out.write(json.dumps(meta) + "\n")
+            for line in spool:
+                out.write(line)
+        os.replace(tmp_path, self.path)
+        os.remove(self._spool_path)
+
+    def abort(self):
+        self._spool.close()
+        if os.path.exists(self._spool_path):
+            os.remove(self._spool_path)
+
+
+def put(digest, parser_version, pdf_path, invoice_no, invoice_date, items):
+    """Store a complete parse result."""
+    writer = CacheWriter(digest, parser_version, pdf_path)
+    for item in items:
+        writer.add(item)
+    writer.commit(invoice_no, invoice_date)
+
+
+def entries():
+    """Yield (path, meta) for every readable cache entry."""
+    if not os.path.isdir(INVOICE_CACHE_DIR):
+        return
+    for name in sorted(os.listdir(INVOICE_CACHE_DIR)):
+        if not name.endswith(".jsonl"):
+            continue
+        path = os.path.join(INVOICE_CACHE_DIR, name)
+        try:
+            with open(path, encoding="utf-8") as f:
+                meta = json.loads(f.readline())
+        except (OSError, ValueError):
+            continue
+        yield path, meta
+
+
+def _matches(entry, order_number):
+    order_number = order_number.upper().lstrip("#")
+    source = os.path.basename(entry.get("source") or "").upper()
+    return entry.get("invoice_no") == order_number or source.startswith(f"{order_number}_")
+
+
+def clear(order_number=None):
+    """Delete cache entries (all of them, or just one order's). Returns the count."""
+    removed = 0
+    for path, entry in list(entries()):
+        if order_number and not _matches(entry, order_number):
+            continue
+        os.remove(path)
+        removed += 1
+    return removed
+
+
+def main():
+    command = sys.argv[1] if len(sys.argv) > 1 else "list"
+    order_number = sys.argv[2] if len(sys.argv) > 2 else None
+
+    if command == "list":
+        total = 0
+        print(f"{'Invoice':<10} {'Date':<12} {'Items':>5}  {'Parser':<20} {'Cached':<20} Source")
+        print("-" * 100)
+        for path, entry in entries():
+            total += os.path.getsize(path)
+            print(f"{entry.get('invoice_no') or '?':<10} {entry.get('invoice_date') or '':<12} "
+                  f"{entry.get('item_count', ''):>5}  {entry.get('parser_version', ''):<20} "
+                  f"{entry.get('cached_at', ''):<20} {entry.get('source', '')}")
+        print(f"\n{INVOICE_CACHE_DIR}: {total / 1024:.1f} KiB")
+    elif command == "show" and order_number:
+        found = [entry for _, entry in entries() if _matches(entry, order_number)]
+        if not found:
+            print(f"No cached parse for {order_number}")
+            sys.exit(1)
+        for meta in found:
+            print(json.dumps(get(meta["pdf_sha256"], meta["parser_version"]), indent=2))
+    elif command == "clear":
+        removed = clear(order_number)
+        print(f"Removed {removed} cached invoice parse(s)")
+    else:
+        print("Usage: python invoice_cache.py [list | show <order_number> | clear [order_number]]")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,82 @@
+#!/usr/bin/env python3
+"""Learn, inspect and benchmark the column layout used by the 'words' parser engine.
+
+Usage:
+    python invoice_layout.py learn <order_number>     # save invoice_layout.json from an invoice
+    python invoice_layout.py show                     # print the saved template
+    python invoice_layout.py bench <order_number> [...]  # time every engine, check outputs match
+
+Without a saved template the words engine learns the layout from each
+document's header row; a template lets it start bucketing words from page 1.
+"""
+
+import sys
+import time
+
+import pdfplumber
+
+from generate_po import (
+    ITEM_COLUMNS, LAYOUT_FILE, PAGE_PARSERS, WordsPageParser, invoice_path,
+    load_layout, parse_invoice, save_layout,
+)
+
+
+def learn(order_number):
+    pdf_path = invoice_path(order_number.upper().lstrip("#"))
+    # Learn from the document itself, not from a previously saved template
+    parser = WordsPageParser(layout_path="")
+    with pdfplumber.open(pdf_path) as pdf:
+        for page in pdf.pages:
+            parser.parse(page)
+            if parser.columns:
+                break
+    if not parser.columns:
+        print(f"ERROR: no {'/'.join(ITEM_COLUMNS)} header row found in {pdf_path}")
+        sys.exit(1)
+    save_layout(parser.columns, pdf_path)
+    print(f"Saved layout from {pdf_path} to {LAYOUT_FILE}")
+    show()
+
+
+def show():
+    columns = load_layout()
+    if not columns:
+        print(f"No layout template at {LAYOUT_FILE}")
+        sys.exit(1)
+    print(f"{'Column':<8} {'x from':>8} {'x to':>8}")
+    for name, x0, x1 in zip(ITEM_COLUMNS, columns, columns[1:]):
+        print(f"{name:<8} {x0:>8.1f} {x1:>8.1f}")
+
+
+def bench(order_numbers):
+    """Parse each invoice with every engine; report times and whether outputs match."""
+    print(f"{'Invoice':<10} {'Engine':<7} {'Seconds':>8} {'Items':>6}  Matches 'table'")
+    print("-" * 50)
+    for order_number in order_numbers:
+        pdf_path = invoice_path(order_number.upper().lstrip("#"))
+        baseline = None
+        for engine in ["table"] + sorted(e for e in PAGE_PARSERS if e != "table"):
+            start = time.perf_counter()
+            result = parse_invoice(pdf_path, engine=engine)
+            elapsed = time.perf_counter() - start
+            if baseline is None:
+                baseline = result
+            same = "yes" if result == baseline else "NO"
+            print(f"{order_number:<10} {engine:<7} {elapsed:>8.3f} {len(result[2]):>6}  {same}")
+
+
+def main():
+    command = sys.argv[1] if len(sys.argv) > 1 else ""
+    if command == "learn" and len(sys.argv) == 3:
+        learn(sys.argv[2])
+    elif command == "show":
+        show()
+    elif command == "bench" and len(sys.argv) >= 3:
+        bench(sys.argv[2:])
+    else:
+        print("Usage: python invoice_layout.py [learn <order_number> | show | bench <order_number> ...]")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
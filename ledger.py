@@ -0,0 +1,398 @@
+#!/usr/bin/env python3
+"""Invoice ledger: every parsed invoice's header and line items in one SQLite file.
+
+generate_po.py, watch_invoices.py and po_service.py record each invoice they
+parse, so cost history and reports come from indexed queries instead of
+re-parsing PDFs. PDFs from before the ledger existed are imported with backfill,
+which parses them in parallel and skips any already recorded with the same
+contents.
+
+Usage:
+    python ledger.py backfill [--glob PATTERN] [--jobs N] [--engine NAME] [--force]
+    python ledger.py info
+    python ledger.py orders [--since 2025-01-01] [--until 2025-12-31]
+    python ledger.py order TH19087
+    python ledger.py history SKU [--since DATE] [--until DATE] [--csv FILE]
+    python ledger.py history --csv cost_history.csv         # every SKU
+    python ledger.py landed [--since DATE] [--until DATE] [--sku SKU ...] [--csv FILE]
+
+Dates are stored and queried as YYYY-MM-DD. Invoices carry no freight or fee
+lines, so landed cost is the quantity-weighted unit cost actually paid.
+"""
+
+import argparse
+import csv
+import glob
+import os
+import sqlite3
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from datetime import datetime
+
+from invoice_cache import pdf_digest
+
+LEDGER_FILE = "invoice_ledger.sqlite"
+
+# Stored in the meta table; bump whenever the schema changes
+LEDGER_VERSION = 1
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT);
+CREATE TABLE IF NOT EXISTS invoices (
+    order_number TEXT PRIMARY KEY,
+    invoice_no   TEXT,
+    invoice_date TEXT,
+    pdf_sha256   TEXT NOT NULL,
+    source       TEXT,
+    line_count   INTEGER NOT NULL,
+    units        INTEGER NOT NULL,
+    total_cost   REAL NOT NULL,
+    recorded_at  TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS lines (
+    order_number TEXT NOT NULL REFERENCES invoices(order_number) ON DELETE CASCADE,
+    line_no      INTEGER NOT NULL,
+    invoice_date TEXT,
+    sku          TEXT NOT NULL,
+    upc          TEXT,
+    title        TEXT,
+    pack_size    INTEGER NOT NULL,
+    qty_cases    INTEGER NOT NULL,
+    case_price   REAL NOT NULL,
+    units        INTEGER NOT NULL,
+    unit_cost    REAL NOT NULL,
+    total_cost   REAL NOT NULL,
+    PRIMARY KEY (order_number, line_no)
+);
+CREATE INDEX IF NOT EXISTS lines_sku_date ON lines (sku, invoice_date);
+CREATE INDEX IF NOT EXISTS lines_date ON lines (invoice_date);
+CREATE INDEX IF NOT EXISTS invoices_date ON invoices (invoice_date);
+CREATE INDEX IF NOT EXISTS invoices_sha ON invoices (pdf_sha256);
+"""
+
+HISTORY_HEADERS = [
+    "Invoice Date", "Order", "Invoice #", "Item #", "UPC", "Title", "Pack Size",
+    "Cases", "Units", "Case Price", "Unit Cost", "Total Cost",
+]
+LANDED_HEADERS = [
+    "Item #", "Title", "Orders", "Units", "Total Cost", "Landed Unit Cost",
+    "Min Unit Cost", "Max Unit Cost", "Last Unit Cost", "First Date", "Last Date",
+]
+
+
+def iso_date(invoice_date):
+    """The parser's MM/DD/YYYY invoice date as YYYY-MM-DD, or None."""
+    if not invoice_date:
+        return None
+    try:
+        return datetime.strptime(invoice_date, "%m/%d/%Y").date().isoformat()
+    except ValueError:
+        return None
+
+
+def connect(path=LEDGER_FILE):
+    """Open the ledger, creating it if needed."""
+    conn = sqlite3.connect(path, timeout=30)
+    conn.execute("PRAGMA journal_mode = WAL")
+    conn.execute("PRAGMA foreign_keys = ON")
+    conn.executescript(SCHEMA)
+    conn.execute("INSERT OR IGNORE INTO meta (key, value) VALUES ('ledger_version', ?)",
+                 (str(LEDGER_VERSION),))
+    conn.commit()
+    return conn
+
+
+def recorded_digest(conn, order_number):
+    found = conn.execute("SELECT pdf_sha256 FROM invoices WHERE order_number = ?",
+                         (order_number,)).fetchone()
+    return found[0] if found else None
+
+
+def record_invoice(conn, order_number, invoice_no, invoice_date, items, digest, source=None):
+    """Store one invoice and its line items, replacing any earlier record for the order.
+
+    items may be any iterable: lines are inserted as they are read, and the
+    invoice's totals are filled in once all of them are in.
+    """
+    date = iso_date(invoice_date)
+    totals = {"lines": 0, "units": 0, "cost": 0}
+
+    def lines():
+        for line_no, item in enumerate(items, 1):
+            pack_size, qty_cases, case_price = item["pack_size"], item["qty_cases"], item["case_price"]
+            units, cost = pack_size * qty_cases, round(case_price * qty_cases, 2)
+            totals["lines"] = line_no
+            totals["units"] += units
+            totals["cost"] += cost
+            yield (
+                order_number, line_no, date, item["sku"], item["upc"], item["title"],
+                pack_size, qty_cases, case_price, units, round(case_price / pack_size, 4), cost,
+            )
+
+    with conn:
+        conn.execute("DELETE FROM invoices WHERE order_number = ?", (order_number,))
+        conn.execute(
+            "INSERT INTO invoices (order_number, invoice_no, invoice_date, pdf_sha256, source, "
+            "line_count, units, total_cost, recorded_at) VALUES (?, ?, ?, ?, ?, 0, 0, 0, ?)",
+            (order_number, invoice_no, date, digest, source, time.strftime("%Y-%m-%d %H:%M:%S")),
+        )
+        conn.executemany("INSERT INTO lines VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)", lines())
+        conn.execute("UPDATE invoices SET line_count = ?, units = ?, total_cost = ? "
+                     "WHERE order_number = ?",
+                     (totals["lines"], totals["units"], round(totals["cost"], 2), order_number))
+    return totals["lines"]
+
+
+def record(order_number, invoice_no, invoice_date, items, pdf_path=None, digest=None,
+           path=LEDGER_FILE):
+    """Record a parsed invoice from the PO scripts. Never raises: the PO matters more.
+
+    Returns True if it was recorded.
+    """
+    try:
+        digest = digest or pdf_digest(pdf_path)
+        conn = connect(path)
+        try:
+            record_invoice(conn, order_number, invoice_no, invoice_date, items, digest, pdf_path)
+        finally:
+            conn.close()
+        return True
+    except (OSError, sqlite3.Error) as e:
+        print(f"  Warning: could not record {order_number} in {path}: {e}", file=sys.stderr)
+        return False
+
+
+# --- Backfill ----------------------------------------------------------------
+
+def backfill(pattern=None, jobs=None, engine=None, force=False, path=LEDGER_FILE):
+    """Parse every matching invoice PDF not yet in the ledger, in parallel. Returns the count."""
+    # Imported here: generate_po records into the ledger, so it imports this module
+    from generate_po import (
+        DEFAULT_ENGINE, INVOICE_SUFFIX, INVOICES_DIR, load_invoice, order_from_invoice_path,
+    )
+
+    pattern = pattern or os.path.join(INVOICES_DIR, f"*{INVOICE_SUFFIX}")
+    engine = engine or DEFAULT_ENGINE
+    conn = connect(path)
+    todo = []
+    for pdf_path in sorted(glob.glob(pattern)):
+        order_number = order_from_invoice_path(pdf_path)
+        if not order_number:
+            continue
+        digest = pdf_digest(pdf_path)
+        if force or recorded_digest(conn, order_number) != digest:
+            todo.append((order_number, pdf_path, digest))
+
+    if not todo:
+        print(f"Ledger is up to date ({path}).")
+        conn.close()
+        return 0
+
+    jobs = max(1, min(jobs or os.cpu_count() or 1, len(todo)))
+    print(f"Importing {len(todo)} invoices with {jobs} parser processes...")
+    start = time.perf_counter()
+    done = failed = 0
+    try:
+        with ProcessPoolExecutor(max_workers=jobs) as pool:
+            futures = {pool.submit(load_invoice, pdf_path, engine=engine): (order_number, pdf_path, digest)
+                       for order_number, pdf_path, digest in todo}
+            # Parsing runs in the workers; this process is the ledger's only writer
+            for future in as_completed(futures):
+                order_number, pdf_path, digest = futures[future]
+                try:
+                    invoice_no, invoice_date, items, _ = future.result()
+                    count = record_invoice(conn, order_number, invoice_no, invoice_date,
+                                           items, digest, pdf_path)
+                    done += 1
+                    print(f"  {order_number:<10} {count} lines, {invoice_date}")
+                except Exception as e:
+                    failed += 1
+                    print(f"  {order_number:<10} FAILED  {type(e).__name__}: {e}")
+    finally:
+        conn.close()
+    print(f"Imported {done} invoices in {time.perf_counter() - start:.1f}s"
+          + (f", {failed} failed" if failed else ""))
+    return done
+
+
+# --- Queries -----------------------------------------------------------------
+
+def _date_filter(column, since, until):
+    clauses, params = [], []
+    if since:
+        clauses.append(f"{column} >= ?")
+        params.append(since)
+    if until:
+        clauses.append(f"{column} <= ?")
+        params.append(until)
+    return clauses, params
+
+
+def cost_history(conn, sku=None, since=None, until=None):
+    """Line items oldest first, for one SKU or all of them, as HISTORY_HEADERS rows."""
+    clauses, params = _date_filter("l.invoice_date", since, until)
+    if sku:
+        clauses.insert(0, "l.sku = ?")
+        params.insert(0, sku)
+    where = f"WHERE {' AND '.join(clauses)}" if clauses else ""
+    return conn.execute(
+        "SELECT l.invoice_date, l.order_number, i.invoice_no, l.sku, l.upc, l.title, l.pack_size, "
+        "l.qty_cases, l.units, l.case_price, l.unit_cost, l.total_cost "
+        f"FROM lines l JOIN invoices i USING (order_number) {where} "
+        "ORDER BY l.sku, l.invoice_date, l.order_number, l.line_no",
+        params,
+    ).fetchall()
+
+
+def landed_costs(conn, skus=None, since=None, until=None):
+    """One LANDED_HEADERS row per SKU: units, spend and unit costs over the period."""
+    clauses, params = _date_filter("invoice_date", since, until)
+    if skus:
+        clauses.append(f"sku IN ({', '.join('?' * len(skus))})")
+        params.extend(skus)
+    where = f"WHERE {' AND '.join(clauses)}" if clauses else ""
+    # The "last" subquery has a single MAX(), so SQLite takes its bare title and unit_cost
+    # from the row holding the maximum: each SKU's last line by date, order and line number
+    return conn.execute(
+        "WITH totals AS ("
+        "  SELECT sku, COUNT(DISTINCT order_number) AS orders, SUM(units) AS units, "
+        "  SUM(total_cost) AS spend, MIN(unit_cost) AS low, MAX(unit_cost) AS high, "
+        f"  MIN(invoice_date) AS first, MAX(invoice_date) AS last FROM lines {where} GROUP BY sku), "
+        "last AS ("
+        "  SELECT sku, title, unit_cost, "
+        "  MAX(COALESCE(invoice_date, '') || order_number || printf('%08d', line_no)) "
+        f"  FROM lines {where} GROUP BY sku) "
+        "SELECT t.sku, l.title, t.orders, t.units, ROUND(t.spend, 2), ROUND(t.spend / t.units, 4), "
+        "t.low, t.high, l.unit_cost, t.first, t.last "
+        "FROM totals t JOIN last l USING (sku) ORDER BY t.sku",
+        params * 2,
+    ).fetchall()
+
+
+def _write_csv(path, headers, rows):
+    with open(path, "w", newline="", encoding="utf-8") as f:
+        writer = csv.writer(f)
+        writer.writerow(headers)
+        writer.writerows(rows)
+    print(f"{len(rows)} rows → {path}")
+
+
+def _print_table(headers, rows, widths):
+    print("  ".join(f"{h:<{w}}" for h, w in zip(headers, widths)))
+    for row in rows:
+        print("  ".join(f"{'' if v is None else str(v)[:w]:<{w}}" for v, w in zip(row, widths)))
+
+
+def _elapsed(start):
+    print(f"({(time.perf_counter() - start) * 1000:.1f}ms)")
+
+
+def main():
+    from generate_po import DEFAULT_ENGINE, INVOICE_SUFFIX, INVOICES_DIR, PAGE_PARSERS
+
+    parser = argparse.ArgumentParser(description="Query and fill the invoice ledger.")
+    parser.add_argument("--ledger", default=LEDGER_FILE, help=f"ledger file (default: {LEDGER_FILE})")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    b = sub.add_parser("backfill", help="import invoice PDFs that are not in the ledger yet")
+    b.add_argument("--glob", dest="pattern", metavar="PATTERN",
+                   help=f"PDFs to import (default: {INVOICES_DIR}/*{INVOICE_SUFFIX})")
+    b.add_argument("--jobs", type=int, metavar="N", help="parser processes (default: CPU cores)")
+    b.add_argument("--engine", choices=sorted(PAGE_PARSERS), default=DEFAULT_ENGINE,
+                   help="invoice page parser (see generate_po.py --help)")
+    b.add_argument("--force", action="store_true", help="re-import invoices already recorded")
+
+    sub.add_parser("info", help="what the ledger holds")
+
+    o = sub.add_parser("orders", help="list recorded invoices")
+
+    o1 = sub.add_parser("order", help="show one invoice's lines")
+    o1.add_argument("order")
+
+    h = sub.add_parser("history", help="unit cost history for a SKU, or every SKU with --csv")
+    h.add_argument("sku", nargs="?")
+    h.add_argument("--csv", metavar="FILE", help="write the history to FILE")
+
+    l = sub.add_parser("landed", help="landed unit cost per SKU")
+    l.add_argument("--sku", nargs="+", metavar="SKU", help="only these SKUs")
+    l.add_argument("--csv", metavar="FILE", help="write the report to FILE")
+
+    for p in (o, h, l):
+        p.add_argument("--since", metavar="YYYY-MM-DD", help="first invoice date to include")
+        p.add_argument("--until", metavar="YYYY-MM-DD", help="last invoice date to include")
+    args = parser.parse_args()
+
+    if args.command == "backfill":
+        backfill(args.pattern, args.jobs, args.engine, args.force, args.ledger)
+        return
+
+    if not os.path.exists(args.ledger):
+        print(f"No ledger at {args.ledger}; run: python ledger.py backfill")
+        sys.exit(1)
+    conn = connect(args.ledger)
+    start = time.perf_counter()
+
+    if args.command == "info":
+        invoices, first, last = conn.execute(
+            "SELECT COUNT(*), MIN(invoice_date), MAX(invoice_date) FROM invoices").fetchone()
+        lines, skus, spend = conn.execute(
+            "SELECT COUNT(*), COUNT(DISTINCT sku), ROUND(COALESCE(SUM(total_cost), 0), 2) FROM lines"
+        ).fetchone()
+        print(f"Ledger:   {args.ledger} ({os.path.getsize(args.ledger) / 1e6:.1f}MB)")
+        print(f"Invoices: {invoices} ({first} to {last})")
+        print(f"Lines:    {lines} across {skus} SKUs, ${spend:,.2f} total")
+
+    elif args.command == "orders":
+        clauses, params = _date_filter("invoice_date", args.since, args.until)
+        where = f"WHERE {' AND '.join(clauses)}" if clauses else ""
+        rows = conn.execute(
+            "SELECT invoice_date, order_number, invoice_no, line_count, units, total_cost "
+            f"FROM invoices {where} ORDER BY invoice_date, order_number", params).fetchall()
+        _print_table(["Date", "Order", "Invoice #", "Lines", "Units", "Total"], rows,
+                     [10, 10, 10, 6, 6, 10])
+
+    elif args.command == "order":
+        order_number = args.order.upper().lstrip("#")
+        rows = conn.execute(
+            "SELECT line_no, sku, title, pack_size, qty_cases, units, unit_cost, total_cost "
+            "FROM lines WHERE order_number = ? ORDER BY line_no", (order_number,)).fetchall()
+        if not rows:
+            print(f"{order_number} is not in the ledger.")
+            sys.exit(1)
+        _print_table(["#", "Item #", "Title", "Pack", "Cases", "Units", "Unit Cost", "Total"], rows,
+                     [4, 8, 40, 4, 5, 5, 9, 10])
+
+    elif args.command == "history":
+        if not args.sku and not args.csv:
+            print("Give a SKU, or --csv FILE to export every SKU's history.")
+            sys.exit(1)
+        rows = cost_history(conn, args.sku, args.since, args.until)
+        if args.csv:
+            _write_csv(args.csv, HISTORY_HEADERS, rows)
+        else:
+            _print_table(["Date", "Order", "Pack", "Cases", "Units", "Unit Cost", "Total"],
+                         [(r[0], r[1], r[6], r[7], r[8], r[10], r[11]) for r in rows],
+                         [10, 10, 4, 5, 5, 9, 10])
+            if rows:
+                units = sum(r[8] for r in rows)
+                spend = sum(r[11] for r in rows)
+                costs = [r[10] for r in rows]
+                print(f"\n{args.sku}: {units} units on {len(rows)} lines, "
+                      f"avg ${spend / units:.4f}/unit (min ${min(costs)}, max ${max(costs)}, "
+                      f"last ${costs[-1]})")
+
+    elif args.command == "landed":
+        rows = landed_costs(conn, args.sku, args.since, args.until)
+        if args.csv:
+            _write_csv(args.csv, LANDED_HEADERS, rows)
+        else:
+            _print_table(["Item #", "Title", "Orders", "Units", "Total", "Landed", "Min", "Max",
+                          "Last"], [r[:9] for r in rows], [8, 30, 6, 6, 10, 9, 9, 9, 9])
+
+    conn.close()
+    _elapsed(start)
+
+
+if __name__ == "__main__":
+    main()
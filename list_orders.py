@@ -1,46 +1,18 @@
-import os
-from playwright.sync_api import sync_playwright
-from bs4 import BeautifulSoup
-
-ORDERS_URL = "https://account.toyhousellc.com/orders"
-SESSION_FILE = "toyhouse_session.json"
-
-
-def parse_orders(html):
-    soup = BeautifulSoup(html, "html.parser")
-    orders = []
-
-    for row in soup.find_all("div", role="row"):
-        if row.find(attrs={"role": "columnheader"}):
-            continue
-
-        link = row.find("a", href=lambda h: h and "/orders/" in h)
-        if not link:
-            continue
+"""List Toyhouse orders.
 
-        order_id = link["href"].split("/orders/")[1].split("?")[0]
-        order_number = link.get_text(strip=True)
+Usage:
+    python list_orders.py             # first page of orders
+    python list_orders.py --refresh   # keep loading until reaching already-indexed orders
+    python list_orders.py --fast      # headless, resource-blocking browser (see toyhouse_browser.py)
+    python list_orders.py --timings   # per-stage timings (also --profile FILE, --trace FILE)
+"""
 
-        cells = row.find_all("div", role="cell")
-
-        status = ""
-        if len(cells) >= 3:
-            strong = cells[2].find("strong")
-            if strong:
-                status = strong.get_text(strip=True)
-
-        total = ""
-        if len(cells) >= 5:
-            total = cells[4].get_text(strip=True)
-
-        orders.append({
-            "order_id": order_id,
-            "order_number": order_number,
-            "status": status,
-            "total": total,
-        })
-
-    return orders
+import sys
+from playwright.sync_api import sync_playwright
+import timings
+from order_index import load_index, normalize, record_orders
+from orders_parser import OrderList
+from toyhouse_browser import LOAD_MORE_SELECTOR, ORDERS_URL, BrowserSession
 
 
 def display_orders(orders):
@@ -52,42 +24,46 @@ def display_orders(orders):
 
 
 def main():
-    with sync_playwright() as p:
-        browser = p.chromium.launch(headless=False)
+    args = timings.start_from_argv("list_orders", sys.argv[1:])
+    try:
+        run(args)
+    finally:
+        timings.finish()
 
-        if os.path.exists(SESSION_FILE):
-            context = browser.new_context(storage_state=SESSION_FILE)
-        else:
-            context = browser.new_context()
 
-        page = context.new_page()
+def run(args):
+    refresh = "--refresh" in args
 
+    with sync_playwright() as p, BrowserSession(p, fast="--fast" in args) as session:
         print(f"Navigating to {ORDERS_URL}...")
-        page.goto(ORDERS_URL)
-        page.wait_for_load_state("networkidle")
+        page = session.open_orders()
 
-        if "authentication" in page.url.lower():
-            print("\nNot logged in. Please log in in the browser.")
-            print("Waiting until you reach the orders page...")
-            page.wait_for_url(ORDERS_URL, timeout=300000)
-            page.wait_for_load_state("networkidle")
+        known = set(load_index())
 
-        context.storage_state(path=SESSION_FILE)
+        listed = OrderList()
+        listed.read(page)
+        if refresh:
+            # Newest orders come first; stop once a page reaches orders we already know
+            while not any(normalize(o["order_number"]) in known for o in listed.orders):
+                print(f"Loaded {len(listed.orders)} orders, none indexed yet — loading more...")
+                if not session.load_more():
+                    break
+                listed.read(page)
+        orders = listed.orders
 
-        orders = parse_orders(page.content())
         if not orders:
             print("No orders found.")
-            browser.close()
             return
 
+        new = record_orders(orders)
         display_orders(orders)
+        if refresh:
+            print(f"\n{len(new)} new orders added to the order index")
 
-        has_more = page.locator("button", has_text="Load more").count() > 0
-        if has_more:
+        has_more = page.locator(LOAD_MORE_SELECTOR).count() > 0
+        if has_more and not refresh:
             print(f"\n({len(orders)} orders shown — run again with --more to load the next page)")
 
-        browser.close()
-
 
 if __name__ == "__main__":
     main()
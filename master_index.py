@@ -0,0 +1,365 @@
+#!/usr/bin/env python3
+"""Compiled on-disk index of ToyhousemasterData.csv.
+
+Parsing the full sheet export with csv.DictReader on every PO run is slow, and
+the CSV only changes when download_sheet.py runs. This module compiles the CSV
+into a SQLite file keyed by SKU so later runs can look up just the SKUs on an
+invoice. The index records the CSV's size, mtime and SHA-256 and is rebuilt
+automatically whenever they no longer match.
+
+Usage:
+    python master_index.py           # build the index if it is stale
+    python master_index.py build     # force a rebuild
+    python master_index.py info      # show what the index was built from
+    python master_index.py stats     # time the in-memory load and measure its memory
+"""
+
+import csv
+import hashlib
+import json
+import os
+import sqlite3
+import sys
+import threading
+import time
+import tracemalloc
+from collections.abc import Mapping
+
+MASTER_FILE = "ToyhousemasterData.csv"
+CACHE_DIR = ".cache"
+INDEX_FILE = os.path.join(CACHE_DIR, "master_index.sqlite")
+
+# Bump whenever the schema or the stored row format changes
+INDEX_VERSION = 2
+
+# Master data columns that generate_po.py reads when building PO rows
+MASTER_COLUMNS = [
+    "Item #", "Description", "Default Cost", "MSRP", "Current price", "Active?",
+    "Long Description", "Image 1", "Primary Vendor", "Taxable", "UPC",
+    "Department", "Theme", "Bricklink ID", "Shopify Tags", "Sub Department",
+    "BAM Category", "Retirement Date", "Launch", "Weight in oz", "Width",
+    "Height", "Depth",
+]
+COLUMN_INDEX = {name: i for i, name in enumerate(MASTER_COLUMNS)}
+
+# Columns with few distinct values; interning stores each value once
+SHARED_VALUE_COLUMNS = {
+    "Default Cost", "MSRP", "Current price", "Active?", "Primary Vendor", "Taxable",
+    "Department", "Theme", "Shopify Tags", "Sub Department", "BAM Category",
+    "Retirement Date", "Launch", "Weight in oz", "Width", "Height", "Depth",
+}
+
+
+class MasterRow(tuple):
+    """A master row projected to MASTER_COLUMNS, in that order.
+
+    Reads like the row dict through get(), but is a plain tuple: no per-row
+    key storage, and the values of SHARED_VALUE_COLUMNS are interned.
+    """
+
+    __slots__ = ()
+
+    def get(self, key, default=None):
+        i = COLUMN_INDEX.get(key)
+        return default if i is None else self[i]
+
+    def as_dict(self):
+        return dict(zip(MASTER_COLUMNS, self))
+
+
+def iter_master_rows(path=MASTER_FILE):
+    """Yield (sku, row) for each master data row, with whitespace-stripped keys.
+
+    Every column of the sheet is kept, as a dict per row; the PO paths use the
+    much smaller iter_master_records() instead.
+    """
+    with open(path, newline="", encoding="utf-8") as f:
+        reader = csv.DictReader(f)
+        # Strip whitespace from header names to handle trailing spaces in sheet
+        reader.fieldnames = [h.strip() for h in reader.fieldnames]
+        for row in reader:
+            row = {k.strip() if k else "": v for k, v in row.items()}
+            key = str(row.get("Item #", "")).strip()
+            if key:
+                yield key, row
+
+
+def iter_master_records(path=MASTER_FILE):
+    """Yield (sku, MasterRow) for each master data row, reading only MASTER_COLUMNS.
+
+    Unlike iter_master_rows() no dict is built per row, so memory grows with
+    the number of SKUs, not the width of the sheet export. Columns missing from
+    the CSV read as "".
+    """
+    intern = sys.intern
+    with open(path, newline="", encoding="utf-8") as f:
+        reader = csv.reader(f)
+        # Later duplicate headers win, as they do in iter_master_rows()
+        positions = {h.strip(): i for i, h in enumerate(next(reader, []))}
+        if "Item #" not in positions:
+            return
+        sku_at = positions["Item #"]
+        picks = [(positions.get(name), name in SHARED_VALUE_COLUMNS) for name in MASTER_COLUMNS]
+        for row in reader:
+            if len(row) <= sku_at:
+                continue
+            key = row[sku_at].strip()
+            if not key:
+                continue
+            width = len(row)
+            yield key, MasterRow(
+                "" if i is None or i >= width else intern(row[i]) if shared else row[i]
+                for i, shared in picks
+            )
+
+
+def load_master_records(path=MASTER_FILE):
+    """Return a SKU → MasterRow dict of the whole master CSV."""
+    return dict(iter_master_records(path))
+
+
+def file_sha256(path):
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def _file_stamp(path):
+    st = os.stat(path)
+    return st.st_size, st.st_mtime_ns
+
+
+def build_index(csv_path=MASTER_FILE, index_path=INDEX_FILE):
+    """Compile csv_path into a fresh SQLite index at index_path. Returns the row count."""
+    os.makedirs(os.path.dirname(index_path) or ".", exist_ok=True)
+    size, mtime_ns = _file_stamp(csv_path)
+    digest = file_sha256(csv_path)
+
+    # Build beside the live index and swap it in, so readers never see a partial file
+    tmp_path = f"{index_path}.{os.getpid()}.tmp"
+    if os.path.exists(tmp_path):
+        os.remove(tmp_path)
+
+    conn = sqlite3.connect(tmp_path)
+    try:
+        conn.execute("PRAGMA journal_mode = OFF")
+        conn.execute("PRAGMA synchronous = OFF")
+        conn.execute("CREATE TABLE meta (key TEXT PRIMARY KEY, value TEXT)")
+        # row is a JSON array of the MASTER_COLUMNS values
+        conn.execute("CREATE TABLE items (sku TEXT PRIMARY KEY, row TEXT NOT NULL)")
+        # Later duplicates win, matching a dict built from the CSV
+        conn.executemany(
+            "INSERT OR REPLACE INTO items (sku, row) VALUES (?, ?)",
+            ((sku, json.dumps(row, ensure_ascii=False)) for sku, row in iter_master_records(csv_path)),
+        )
+        count = conn.execute("SELECT COUNT(*) FROM items").fetchone()[0]
+        conn.executemany("INSERT INTO meta (key, value) VALUES (?, ?)", [
+            ("index_version", str(INDEX_VERSION)),
+            ("csv_path", os.path.abspath(csv_path)),
+            ("csv_size", str(size)),
+            ("csv_mtime_ns", str(mtime_ns)),
+            ("csv_sha256", digest),
+            ("row_count", str(count)),
+            ("built_at", time.strftime("%Y-%m-%d %H:%M:%S")),
+        ])
+        conn.commit()
+    finally:
+        conn.close()
+
+    os.replace(tmp_path, index_path)
+    return count
+
+
+def _read_meta(index_path):
+    try:
+        conn = sqlite3.connect(f"file:{index_path}?mode=ro", uri=True)
+    except sqlite3.Error:
+        return None
+    try:
+        return dict(conn.execute("SELECT key, value FROM meta"))
+    except sqlite3.Error:
+        return None
+    finally:
+        conn.close()
+
+
+def index_is_fresh(csv_path=MASTER_FILE, index_path=INDEX_FILE):
+    """True if index_path was built from the current contents of csv_path.
+
+    Size and mtime are checked first; if only the mtime moved (e.g. the file was
+    re-downloaded with identical contents) the SHA-256 decides, and the stored
+    stamp is refreshed so the next check is cheap again.
+    """
+    if not os.path.exists(index_path):
+        return False
+    meta = _read_meta(index_path)
+    if not meta or meta.get("index_version") != str(INDEX_VERSION):
+        return False
+
+    size, mtime_ns = _file_stamp(csv_path)
+    if meta.get("csv_size") == str(size) and meta.get("csv_mtime_ns") == str(mtime_ns):
+        return True
+    if meta.get("csv_size") != str(size) or meta.get("csv_sha256") != file_sha256(csv_path):
+        return False
+
+    conn = sqlite3.connect(index_path)
+    try:
+        conn.execute("UPDATE meta SET value = ? WHERE key = 'csv_mtime_ns'", (str(mtime_ns),))
+        conn.commit()
+    finally:
+        conn.close()
+    return True
+
+
+class MasterIndex(Mapping):
+    """Read-only SKU → MasterRow mapping backed by the SQLite index."""
+
+    def __init__(self, index_path=INDEX_FILE):
+        self.path = index_path
+        self._conn = sqlite3.connect(f"file:{index_path}?mode=ro", uri=True)
+        self.meta = dict(self._conn.execute("SELECT key, value FROM meta"))
+
+    @property
+    def version(self):
+        """Content hash of the CSV this index was built from."""
+        return self.meta["csv_sha256"]
+
+    def __getitem__(self, sku):
+        found = self._conn.execute("SELECT row FROM items WHERE sku = ?", (sku,)).fetchone()
+        if found is None:
+            raise KeyError(sku)
+        return MasterRow(json.loads(found[0]))
+
+    def __contains__(self, sku):
+        return self._conn.execute("SELECT 1 FROM items WHERE sku = ?", (sku,)).fetchone() is not None
+
+    def __iter__(self):
+        return (sku for (sku,) in self._conn.execute("SELECT sku FROM items"))
+
+    def __len__(self):
+        return int(self.meta["row_count"])
+
+    def iter_items(self):
+        """Every (sku, MasterRow) in one query, instead of a lookup per SKU."""
+        for sku, row in self._conn.execute("SELECT sku, row FROM items"):
+            yield sku, MasterRow(json.loads(row))
+
+    def close(self):
+        self._conn.close()
+
+
+def open_index(csv_path=MASTER_FILE, index_path=INDEX_FILE):
+    """Return a MasterIndex for csv_path, rebuilding the index first if it is stale."""
+    if not index_is_fresh(csv_path, index_path):
+        build_index(csv_path, index_path)
+    return MasterIndex(index_path)
+
+
+class HotMasterData:
+    """Master data held in memory for long-running processes, reloaded when the CSV changes.
+
+    current() returns the SKU → MasterRow dict, first re-reading the CSV if its size or
+    mtime changed and it has then been left alone for settle seconds, so a
+    download that is still being written is never loaded. Until then, and if
+    the CSV disappears, the previously loaded data keeps being served. Safe to
+    call from several threads.
+    """
+
+    def __init__(self, csv_path=MASTER_FILE, settle=2.0):
+        self.csv_path = csv_path
+        self.settle = settle
+        self.data = None
+        self.stamp = None
+        self.version = 0
+        self.loaded_at = None
+        self.load_seconds = None
+        self._lock = threading.Lock()
+
+    def current(self):
+        with self._lock:
+            try:
+                stamp = _file_stamp(self.csv_path)
+            except FileNotFoundError:
+                if self.data is None:
+                    raise
+                return self.data
+            settled = time.time() - stamp[1] / 1e9 >= self.settle
+            if stamp != self.stamp and (self.data is None or settled):
+                self._load(stamp)
+            return self.data
+
+    def _load(self, stamp):
+        start = time.perf_counter()
+        data = load_master_records(self.csv_path)
+        # If the file changed while it was read, the stale stamp makes the next call reload
+        self.data, self.stamp = data, stamp
+        self.version += 1
+        self.loaded_at = time.strftime("%Y-%m-%d %H:%M:%S")
+        self.load_seconds = time.perf_counter() - start
+
+
+def measure_load(load, path):
+    """Run load(path) under tracemalloc. Returns (data, seconds, retained bytes, peak bytes)."""
+    tracemalloc.start()
+    try:
+        start = time.perf_counter()
+        data = load(path)
+        seconds = time.perf_counter() - start
+        retained, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return data, seconds, retained, peak
+
+
+def print_load_stats(path=MASTER_FILE):
+    """Compare the projected in-memory load with full row dicts."""
+    with open(path, newline="", encoding="utf-8") as f:
+        width = len(next(csv.reader(f), []))
+    print(f"{path}: {width} columns, {len(MASTER_COLUMNS)} used")
+    print(f"  {'load':<24} {'rows':>8} {'seconds':>8} {'retained':>10} {'peak':>10}")
+    for name, load in (("projected (MasterRow)", load_master_records),
+                       ("full rows (dict)", lambda p: dict(iter_master_rows(p)))):
+        data, seconds, retained, peak = measure_load(load, path)
+        print(f"  {name:<24} {len(data):>8} {seconds:>7.2f}s "
+              f"{retained / 1e6:>8.1f}MB {peak / 1e6:>8.1f}MB")
+        del data
+    print("  (tracemalloc slows loading down; times are relative)")
+
+
+def main():
+    command = sys.argv[1] if len(sys.argv) > 1 else "update"
+
+    if command == "info":
+        meta = _read_meta(INDEX_FILE)
+        if not meta:
+            print(f"No index at {INDEX_FILE}")
+            sys.exit(1)
+        state = "fresh" if index_is_fresh(MASTER_FILE, INDEX_FILE) else "stale"
+        print(f"Index:    {INDEX_FILE} ({state})")
+        print(f"Built:    {meta.get('built_at')} (format v{meta.get('index_version')})")
+        print(f"Source:   {meta.get('csv_path')}")
+        print(f"Rows:     {meta.get('row_count')}")
+        print(f"SHA-256:  {meta.get('csv_sha256')}")
+        return
+
+    if command == "stats":
+        print_load_stats(MASTER_FILE)
+        return
+
+    if command not in ("update", "build"):
+        print("Usage: python master_index.py [build|info|stats]")
+        sys.exit(1)
+
+    if command == "update" and index_is_fresh(MASTER_FILE, INDEX_FILE):
+        print(f"Index is up to date: {INDEX_FILE}")
+        return
+
+    start = time.perf_counter()
+    count = build_index(MASTER_FILE, INDEX_FILE)
+    print(f"Indexed {count} items into {INDEX_FILE} in {time.perf_counter() - start:.2f}s")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,62 @@
+"""Local index of Toyhouse orders: order number → order ID, status and total.
+
+Every scrape of the orders page records what it saw here, so download_invoice.py
+can go straight to /orders/<id> for a known order instead of clicking
+"Load more" until it appears, and a refresh can stop paging as soon as it
+reaches orders that are already indexed.
+"""
+
+import json
+import os
+import time
+
+ORDER_INDEX_FILE = "toyhouse_orders.json"
+
+
+def normalize(order_number):
+    """'#th19087' → 'TH19087'."""
+    return order_number.strip().lstrip("#").upper()
+
+
+def load_index(path=ORDER_INDEX_FILE):
+    if not os.path.exists(path):
+        return {}
+    try:
+        with open(path, encoding="utf-8") as f:
+            return json.load(f)
+    except ValueError:
+        # A corrupt index only costs a re-scrape
+        return {}
+
+
+def save_index(index, path=ORDER_INDEX_FILE):
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(index, f, indent=2, sort_keys=True)
+    os.replace(tmp_path, path)
+
+
+def record_orders(orders, path=ORDER_INDEX_FILE):
+    """Merge scraped orders (parse_orders() dicts) into the index. Returns the new order numbers."""
+    if not orders:
+        return []
+    index = load_index(path)
+    seen_at = time.strftime("%Y-%m-%d %H:%M:%S")
+    new = []
+    for order in orders:
+        key = normalize(order["order_number"])
+        if key not in index:
+            new.append(key)
+        index[key] = {
+            "order_id": order["order_id"],
+            "status":   order.get("status", ""),
+            "total":    order.get("total", ""),
+            "seen_at":  seen_at,
+        }
+    save_index(index, path)
+    return new
+
+
+def lookup(order_number, path=ORDER_INDEX_FILE):
+    """Return the indexed entry for an order number, or None."""
+    return load_index(path).get(normalize(order_number))
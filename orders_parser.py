@@ -0,0 +1,274 @@
+"""Order-list extraction shared by the orders-page scripts.
+
+parse_orders(html) parses a full orders page. It uses selectolax or lxml when
+either is installed and falls back to BeautifulSoup's html.parser otherwise.
+All three backends return the same rows.
+
+OrderList reads a live Playwright page incrementally instead. It pulls the row
+data straight out of the DOM with one evaluate() call and only looks at rows
+added since the previous read. After each "Load more" click only the new page
+of orders is processed, rather than re-serializing and re-parsing the whole
+list.
+
+Usage:
+    python orders_parser.py bench [--orders 500] [--page-size 25] [--save FILE] [FILE ...]
+"""
+
+import argparse
+import time
+
+from bs4 import BeautifulSoup
+
+import timings
+
+try:
+    from selectolax.parser import HTMLParser
+except ImportError:
+    HTMLParser = None
+
+try:
+    import lxml.html
+except ImportError:
+    lxml = None
+
+ROW_SELECTOR = 'div[role="row"]'
+
+# Same rules as the parsers below; text is each text node stripped and joined
+# with no separator, like BeautifulSoup's get_text(strip=True)
+ORDER_ROWS_JS = """
+([start, first]) => {
+  const text = el => {
+    const parts = [];
+    const walker = document.createTreeWalker(el, NodeFilter.SHOW_TEXT);
+    while (walker.nextNode()) {
+      const t = walker.currentNode.nodeValue.trim();
+      if (t) parts.push(t);
+    }
+    return parts.join("");
+  };
+  const rows = document.querySelectorAll('div[role="row"]');
+  const head = document.querySelector('div[role="row"] a[href*="/orders/"]');
+  const headHref = head ? head.getAttribute("href") : null;
+  if (first !== null && headHref !== first) start = 0;
+  const orders = [];
+  for (let i = start; i < rows.length; i++) {
+    const row = rows[i];
+    if (row.querySelector('[role="columnheader"]')) continue;
+    const link = row.querySelector('a[href*="/orders/"]');
+    if (!link) continue;
+    const cells = row.querySelectorAll('div[role="cell"]');
+    const strong = cells.length >= 3 ? cells[2].querySelector("strong") : null;
+    orders.push({
+      href: link.getAttribute("href"),
+      order_number: text(link),
+      status: strong ? text(strong) : "",
+      total: cells.length >= 5 ? text(cells[4]) : "",
+    });
+  }
+  return {rows: rows.length, first: headHref, restarted: start === 0, orders: orders};
+}
+"""
+
+
+def order_id_from_href(href):
+    return href.split("/orders/")[1].split("?")[0]
+
+
+def _order(href, order_number, status, total):
+    return {
+        "order_id": order_id_from_href(href),
+        "order_number": order_number,
+        "status": status,
+        "total": total,
+    }
+
+
+def _parse_bs4(html):
+    soup = BeautifulSoup(html, "html.parser")
+    orders = []
+
+    for row in soup.find_all("div", role="row"):
+        # Skip header rows
+        if row.find(attrs={"role": "columnheader"}):
+            continue
+
+        link = row.find("a", href=lambda h: h and "/orders/" in h)
+        if not link:
+            continue
+
+        cells = row.find_all("div", role="cell")
+
+        status = ""
+        if len(cells) >= 3:
+            strong = cells[2].find("strong")
+            if strong:
+                status = strong.get_text(strip=True)
+
+        total = ""
+        if len(cells) >= 5:
+            total = cells[4].get_text(strip=True)
+
+        orders.append(_order(link["href"], link.get_text(strip=True), status, total))
+
+    return orders
+
+
+def _parse_selectolax(html):
+    orders = []
+    for row in HTMLParser(html).css(ROW_SELECTOR):
+        if row.css_first('[role="columnheader"]') is not None:
+            continue
+        link = row.css_first('a[href*="/orders/"]')
+        if link is None:
+            continue
+        cells = row.css('div[role="cell"]')
+        strong = cells[2].css_first("strong") if len(cells) >= 3 else None
+        status = strong.text(separator="", strip=True) if strong is not None else ""
+        total = cells[4].text(separator="", strip=True) if len(cells) >= 5 else ""
+        orders.append(_order(link.attributes["href"], link.text(separator="", strip=True),
+                             status, total))
+    return orders
+
+
+def _lxml_text(el):
+    return "".join(t.strip() for t in el.xpath(".//text()"))
+
+
+def _parse_lxml(html):
+    if not html.strip():
+        return []
+    orders = []
+    for row in lxml.html.fromstring(html).xpath('//div[@role="row"]'):
+        if row.xpath('.//*[@role="columnheader"]'):
+            continue
+        links = row.xpath('.//a[contains(@href, "/orders/")]')
+        if not links:
+            continue
+        cells = row.xpath('.//div[@role="cell"]')
+        strong = cells[2].xpath(".//strong") if len(cells) >= 3 else []
+        status = _lxml_text(strong[0]) if strong else ""
+        total = _lxml_text(cells[4]) if len(cells) >= 5 else ""
+        orders.append(_order(links[0].get("href"), _lxml_text(links[0]), status, total))
+    return orders
+
+
+BACKENDS = {"bs4": _parse_bs4}
+if lxml is not None:
+    BACKENDS["lxml"] = _parse_lxml
+if HTMLParser is not None:
+    BACKENDS["selectolax"] = _parse_selectolax
+DEFAULT_BACKEND = next(b for b in ("selectolax", "lxml", "bs4") if b in BACKENDS)
+
+
+def parse_orders(html, backend=DEFAULT_BACKEND):
+    """Parse order rows from HTML into a list of dicts."""
+    with timings.stage("parse_orders"):
+        return BACKENDS[backend](html)
+
+
+class OrderList:
+    """The orders loaded on a live page so far, read incrementally from the DOM.
+
+    read()/read_async() return only the orders added since the previous read.
+    If the list was re-rendered (its first order changed, or it got shorter),
+    the next read starts over and orders holds just the current list.
+    """
+
+    def __init__(self):
+        self.orders = []
+        self.rows_seen = 0
+        self.first = None
+
+    def _add(self, result):
+        if result["restarted"] or result["rows"] < self.rows_seen:
+            self.orders = []
+        self.rows_seen = result["rows"]
+        self.first = result["first"]
+        new = [_order(o["href"], o["order_number"], o["status"], o["total"])
+               for o in result["orders"]]
+        self.orders.extend(new)
+        timings.count("orders_read", len(new))
+        return new
+
+    def _args(self):
+        return [self.rows_seen, self.first]
+
+    def read(self, page):
+        with timings.stage("parse_orders"):
+            result = page.evaluate(ORDER_ROWS_JS, self._args())
+            if result["rows"] < self.rows_seen and not result["restarted"]:
+                result = page.evaluate(ORDER_ROWS_JS, [0, None])
+            return self._add(result)
+
+    async def read_async(self, page):
+        with timings.stage("parse_orders"):
+            result = await page.evaluate(ORDER_ROWS_JS, self._args())
+            if result["rows"] < self.rows_seen and not result["restarted"]:
+                result = await page.evaluate(ORDER_ROWS_JS, [0, None])
+            return self._add(result)
+
+
+# --- Benchmark ---------------------------------------------------------------
+
+def _time(fn, *args):
+    start = time.perf_counter()
+    result = fn(*args)
+    return time.perf_counter() - start, result
+
+
+def bench(html_pages, page_size):
+    """Time each backend on each page, both as one parse and as a "Load more" re-parse loop."""
+    for name, html in html_pages:
+        reference = _parse_bs4(html)
+        n = len(reference)
+        # What the scripts used to do: a full re-parse of the growing page after each click
+        soup = BeautifulSoup(html, "html.parser")
+        rows = soup.find_all("div", role="row")
+        header = [str(r) for r in rows if r.find(attrs={"role": "columnheader"})]
+        body = [str(r) for r in rows if not r.find(attrs={"role": "columnheader"})]
+        prefixes = [
+            '<div role="table">' + "".join(header + body[:k]) + "</div>"
+            for k in range(page_size, len(body) + page_size, page_size)
+        ]
+        print(f"\n{name}: {n} orders, {len(prefixes)} pages of {page_size}")
+        print(f"  {'backend':<12} {'one parse':>10} {'re-parse per page':>18}  output")
+        for backend, fn in BACKENDS.items():
+            once, result = _time(fn, html)
+            repeated = sum(_time(fn, prefix)[0] for prefix in prefixes)
+            same = "matches bs4" if result == reference else "DIFFERS from bs4"
+            print(f"  {backend:<12} {once * 1000:>8.1f}ms {repeated * 1000:>16.1f}ms  {same}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the order-list parsers.")
+    sub = parser.add_subparsers(dest="command", required=True)
+    b = sub.add_parser("bench", help="time each parser backend")
+    b.add_argument("files", nargs="*", help="saved orders-page HTML files")
+    b.add_argument("--orders", type=int, default=500,
+                   help="rows in the synthetic page when no files are given (default: 500)")
+    b.add_argument("--page-size", type=int, default=25,
+                   help="orders added per \"Load more\" click (default: 25)")
+    b.add_argument("--save", metavar="FILE", help="also write the synthetic page to FILE")
+    args = parser.parse_args()
+
+    if args.files:
+        pages = []
+        for path in args.files:
+            with open(path, encoding="utf-8") as f:
+                pages.append((path, f.read()))
+    else:
+        # Imported here: the scrapers import this module and don't need the test data generator
+        from synthetic import synthetic_orders_html
+
+        html = synthetic_orders_html(args.orders)
+        if args.save:
+            with open(args.save, "w", encoding="utf-8") as f:
+                f.write(html)
+        pages = [(f"synthetic ({args.orders} orders)", html)]
+
+    print(f"Backends available: {', '.join(BACKENDS)} (default: {DEFAULT_BACKEND})")
+    bench(pages, args.page_size)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,205 @@
+#!/usr/bin/env python3
+"""What each generated PO/exceptions pair was built from, for incremental refreshes.
+
+generate_po() writes one manifest per order under .cache/po_manifests/. It
+records the invoice lines, and for each line whether it went to the PO or the
+exceptions CSV, the master SKU it matched and a hash of that SKU's master row.
+It also records the master data version and the SHA-256 of both CSVs.
+
+A manifest is JSON lines: a header object, then one object per invoice line.
+Lines are spooled to disk as the invoice streams (see ManifestWriter), so
+writing one never holds the whole invoice in memory.
+generate_po.py --refresh uses it after a master data update to re-match only
+the lines whose master rows changed, plus the exceptions, without parsing the
+invoice PDFs again.
+
+Usage:
+    python po_manifest.py list             # show every manifest
+    python po_manifest.py show TH20003     # show one order's manifest
+"""
+
+import hashlib
+import json
+import os
+import shutil
+import sys
+import time
+
+from master_index import CACHE_DIR, file_sha256
+
+MANIFEST_DIR = os.path.join(CACHE_DIR, "po_manifests")
+
+# Bump whenever the manifest format changes; older manifests are ignored
+MANIFEST_VERSION = 2
+
+
+def manifest_path(order_number):
+    return os.path.join(MANIFEST_DIR, f"{order_number}.json")
+
+
+def row_hash(row):
+    """A short hash of a master row (a MasterRow), or None for a SKU not in master data."""
+    if row is None:
+        return None
+    return hashlib.sha1(json.dumps(list(row)).encode("utf-8")).hexdigest()[:16]
+
+
+def master_version(master_data):
+    """The content hash of the master CSV behind master_data, when it is known.
+
+    The compiled index carries one; a plain dict loaded with --no-index doesn't.
+    """
+    return getattr(master_data, "version", None)
+
+
+class ManifestWriter:
+    """Writes one order's manifest a line at a time.
+
+    add() appends each invoice line to a spool file next to the manifest;
+    commit() writes the header, copies the spooled lines after it and moves
+    the result into place. abort() discards the spool.
+    """
+
+    def __init__(self, order_number, master_data):
+        os.makedirs(MANIFEST_DIR, exist_ok=True)
+        self.order_number = order_number
+        self.master_data = master_data
+        self.path = manifest_path(order_number)
+        self.spool_path = f"{self.path}.{os.getpid()}.lines.tmp"
+        self.spool = open(self.spool_path, "w", encoding="utf-8")
+
+    def add(self, item, kind, sku):
+        """One invoice line: kind is "po", "exception" or "accepted" as in generate_po.match_items()."""
+        line = {"item": item, "kind": kind, "sku": sku,
+                "hash": row_hash(self.master_data.get(sku)) if sku else None}
+        self.spool.write(json.dumps(line) + "\n")
+
+    def commit(self, invoice_no, invoice_date, location, accept_upc, po_path, exc_path):
+        """Finish the manifest. Returns its header."""
+        header = {
+            "manifest_version": MANIFEST_VERSION,
+            "order":            self.order_number,
+            "generated_at":     time.strftime("%Y-%m-%d %H:%M:%S"),
+            "invoice_no":       invoice_no,
+            "invoice_date":     invoice_date,
+            "location":         location,
+            "accept_upc":       accept_upc,
+            "master_version":   master_version(self.master_data),
+            "po":               {"path": po_path, "sha256": file_sha256(po_path)},
+            "exceptions":       {"path": exc_path, "sha256": file_sha256(exc_path)},
+        }
+        tmp_path = f"{self.path}.{os.getpid()}.tmp"
+        try:
+            self.spool.close()
+            with open(tmp_path, "w", encoding="utf-8") as f, \
+                    open(self.spool_path, encoding="utf-8") as spool:
+                f.write(json.dumps(header) + "\n")
+                shutil.copyfileobj(spool, f)
+            os.replace(tmp_path, self.path)
+        finally:
+            for tmp in (tmp_path, self.spool_path):
+                if os.path.exists(tmp):
+                    os.remove(tmp)
+        return header
+
+    def abort(self):
+        self.spool.close()
+        if os.path.exists(self.spool_path):
+            os.remove(self.spool_path)
+
+
+def write(order_number, invoice_no, invoice_date, lines, master_data, location, accept_upc,
+          po_path, exc_path):
+    """Record how an order's PO/exceptions CSVs were built, from a list of lines.
+
+    lines is [(invoice item, kind, master SKU or None)] in invoice order; see
+    ManifestWriter for writing them as they are produced.
+    """
+    writer = ManifestWriter(order_number, master_data)
+    try:
+        for item, kind, sku in lines:
+            writer.add(item, kind, sku)
+    except BaseException:
+        writer.abort()
+        raise
+    return writer.commit(invoice_no, invoice_date, location, accept_upc, po_path, exc_path)
+
+
+def _read_header(f):
+    try:
+        header = json.loads(f.readline())
+    except ValueError:
+        return None
+    return header if isinstance(header, dict) and header.get("manifest_version") == MANIFEST_VERSION \
+        else None
+
+
+def load(order_number):
+    """An order's manifest with its "lines" list, or None if it has none (or an outdated one)."""
+    try:
+        with open(manifest_path(order_number), encoding="utf-8") as f:
+            manifest = _read_header(f)
+            if manifest is None:
+                return None
+            manifest["lines"] = [json.loads(line) for line in f]
+    except (OSError, ValueError):
+        return None
+    return manifest
+
+
+def iter_items(order_number):
+    """The invoice items of an order's manifest, read one line at a time."""
+    with open(manifest_path(order_number), encoding="utf-8") as f:
+        if _read_header(f) is None:
+            raise ValueError(f"no current manifest for {order_number}")
+        for line in f:
+            yield json.loads(line)["item"]
+
+
+def outputs_problem(manifest):
+    """Why the CSVs no longer match the manifest (missing or edited), or None if they do."""
+    for key in ("po", "exceptions"):
+        output = manifest[key]
+        if not os.path.exists(output["path"]):
+            return f"{output['path']} is missing"
+        if file_sha256(output["path"]) != output["sha256"]:
+            return f"{output['path']} was changed after it was generated"
+    return None
+
+
+def orders():
+    """The order numbers that have a manifest, sorted."""
+    if not os.path.isdir(MANIFEST_DIR):
+        return []
+    return sorted(name[:-len(".json")] for name in os.listdir(MANIFEST_DIR) if name.endswith(".json"))
+
+
+def main():
+    command = sys.argv[1] if len(sys.argv) > 1 else "list"
+    order_number = sys.argv[2].upper().lstrip("#") if len(sys.argv) > 2 else None
+
+    if command == "list":
+        print(f"{'Order':<10} {'Invoice':<10} {'Lines':>5} {'PO':>5} {'Exc':>5}  {'Generated':<20} Master")
+        print("-" * 80)
+        for order in orders():
+            manifest = load(order)
+            if manifest is None:
+                print(f"{order:<10} (outdated manifest)")
+                continue
+            kinds = [line["kind"] for line in manifest["lines"]]
+            print(f"{order:<10} {manifest['invoice_no'] or '?':<10} {len(kinds):>5} "
+                  f"{len(kinds) - kinds.count('exception'):>5} {kinds.count('exception'):>5}  "
+                  f"{manifest['generated_at']:<20} {(manifest['master_version'] or '?')[:12]}")
+    elif command == "show" and order_number:
+        manifest = load(order_number)
+        if manifest is None:
+            print(f"No manifest for {order_number}")
+            sys.exit(1)
+        print(json.dumps(manifest, indent=2))
+    else:
+        print("Usage: python po_manifest.py [list | show <order_number>]")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,470 @@
+#!/usr/bin/env python3
+"""Local HTTP service: upload a Toyhouse invoice PDF, get the PO back.
+
+Usage:
+    python po_service.py [--host 127.0.0.1] [--port 8765] [--workers N] [--queue N]
+
+Endpoints:
+    GET  /          upload form for a browser
+    POST /po        the invoice PDF, either as the raw request body or as the
+                    "file" field of a multipart form. Options as query or form fields:
+                      format=json (default) | csv | exceptions
+                      location=NAME     received-at location for the PO
+                      order=TH19087     order number (defaults to the invoice number)
+    GET  /health    master data status; 503 until master data can be loaded
+    GET  /metrics   request counts and latencies, parse/match times
+
+    curl --data-binary @invoices/TH19087_invoice.pdf "http://127.0.0.1:8765/po?format=csv" -o TH19087_PO.csv
+
+Master data stays in memory and is reloaded when ToyhousemasterData.csv changes
+(see master_index.HotMasterData). Invoices are parsed in a pool of --workers
+processes. Uploads beyond --workers parsing plus --queue waiting get a 503
+rather than piling up. Nothing is written to invoices/; the PO and exceptions
+are returned in the response. Unless --no-ledger, each parsed invoice is
+recorded in the ledger (see ledger.py), and unless --no-cache, in the
+parsed-invoice cache.
+
+An order= that isn't an order number (TH followed by digits) is rejected with
+a 400; an upload's file name is only used when it names an order.
+"""
+
+import argparse
+import csv
+import email.policy
+import hashlib
+import io
+import json
+import os
+import re
+import shutil
+import sys
+import tempfile
+import threading
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from email.parser import BytesParser
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from multiprocessing import get_context
+from urllib.parse import parse_qs, urlsplit
+
+from generate_po import (
+    DEFAULT_ENGINE, DEFAULT_LOCATION, EXCEPTION_HEADERS, INVOICE_SUFFIX, PAGE_PARSERS,
+    PO_HEADERS, ParsedInvoice, POProjection, load_invoice, match_items, order_from_invoice_path,
+)
+import ledger
+from master_index import MASTER_FILE, HotMasterData
+
+DEFAULT_HOST = "127.0.0.1"
+DEFAULT_PORT = 8765
+MAX_UPLOAD = 50 * 1024 * 1024
+# Latency percentiles are over this many most recent requests per endpoint
+LATENCY_WINDOW = 1000
+FORMATS = ("json", "csv", "exceptions")
+ORDER_NUMBER_RE = re.compile(r"TH\d+")
+
+UPLOAD_FORM = """<!DOCTYPE html>
+<html><head><title>Toyhouse PO</title></head>
+<body style="font-family: sans-serif; max-width: 40em; margin: 2em auto">
+<h1>Toyhouse invoice &rarr; PO</h1>
+<form method="post" action="/po" enctype="multipart/form-data">
+  <p><label>Invoice PDF <input type="file" name="file" accept="application/pdf" required></label></p>
+  <p><label>Location <input type="text" name="location" value="{location}" size="40"></label></p>
+  <p><label>Download
+    <select name="format">
+      <option value="csv">PO CSV</option>
+      <option value="exceptions">Exceptions CSV</option>
+      <option value="json">JSON (both)</option>
+    </select></label></p>
+  <p><button type="submit">Generate PO</button></p>
+</form>
+</body></html>
+"""
+
+
+class RequestError(Exception):
+    """An error reported to the client with an HTTP status."""
+
+    def __init__(self, status, message):
+        super().__init__(message)
+        self.status = status
+
+
+def _percentile(sorted_values, p):
+    return sorted_values[min(len(sorted_values) - 1, round(p / 100 * (len(sorted_values) - 1)))]
+
+
+class Metrics:
+    """Request counts, recent latencies and stage times, shared by the handler threads."""
+
+    def __init__(self, window=LATENCY_WINDOW):
+        self.window = window
+        self.started = time.time()
+        self.requests = {}      # "POST /po 200" → count
+        self.latencies = {}     # "POST /po" → recent durations
+        self.stages = {}        # "parse" → {"total": seconds, "count": n}
+        self.in_flight = 0
+        self.rejected = 0
+        self._lock = threading.Lock()
+
+    def record(self, route, status, seconds):
+        with self._lock:
+            key = f"{route} {status}"
+            self.requests[key] = self.requests.get(key, 0) + 1
+            self.latencies.setdefault(route, deque(maxlen=self.window)).append(seconds)
+
+    def enter(self):
+        with self._lock:
+            self.in_flight += 1
+
+    def leave(self):
+        with self._lock:
+            self.in_flight -= 1
+
+    def reject(self):
+        with self._lock:
+            self.rejected += 1
+
+    def add_stage(self, name, seconds):
+        with self._lock:
+            stage = self.stages.setdefault(name, {"total": 0.0, "count": 0})
+            stage["total"] += seconds
+            stage["count"] += 1
+
+    def snapshot(self):
+        with self._lock:
+            latency = {}
+            for route, values in self.latencies.items():
+                values = sorted(values)
+                latency[route] = {
+                    "count": len(values),
+                    "mean":  round(sum(values) / len(values), 4),
+                    "p50":   round(_percentile(values, 50), 4),
+                    "p95":   round(_percentile(values, 95), 4),
+                    "p99":   round(_percentile(values, 99), 4),
+                    "max":   round(values[-1], 4),
+                }
+            return {
+                "uptime_seconds": round(time.time() - self.started, 1),
+                "in_flight":      self.in_flight,
+                "rejected_busy":  self.rejected,
+                "requests":       dict(self.requests),
+                "latency":        latency,
+                "stages":         {name: {"count": s["count"], "total": round(s["total"], 4),
+                                          "mean": round(s["total"] / s["count"], 4)}
+                                   for name, s in self.stages.items()},
+            }
+
+
+def _ping():
+    """Process-pool warm-up: importing this module loads pdfplumber in the worker."""
+    return os.getpid()
+
+
+class POService:
+    """Resident master data plus a bounded invoice-parsing pool."""
+
+    def __init__(self, workers=None, queue=None, engine=DEFAULT_ENGINE, use_cache=True,
+                 location=DEFAULT_LOCATION, master_path=MASTER_FILE, accept_upc=False,
+                 use_ledger=True):
+        self.workers = workers or os.cpu_count() or 1
+        self.queue = self.workers * 2 if queue is None else queue
+        self.engine = engine
+        self.use_cache = use_cache
+        self.location = location
+        self.accept_upc = accept_upc
+        self.use_ledger = use_ledger
+        self.master = HotMasterData(master_path)
+        self.metrics = Metrics()
+        self.projection = None
+        # spawn, not fork: the handler threads make forking this process unsafe
+        self.pool = ProcessPoolExecutor(max_workers=self.workers, mp_context=get_context("spawn"))
+        self._slots = threading.BoundedSemaphore(self.workers + self.queue)
+
+    def warm_up(self):
+        """Start the parser processes and load master data before the first request."""
+        for future in [self.pool.submit(_ping) for _ in range(self.workers)]:
+            future.result()
+        return self.master_data()
+
+    def master_data(self):
+        try:
+            return self.master.current()
+        except OSError as e:
+            raise RequestError(503, f"master data not available: {e}")
+
+    def master_status(self):
+        return {
+            "file":         self.master.csv_path,
+            "items":        len(self.master.data) if self.master.data is not None else None,
+            "version":      self.master.version,
+            "loaded_at":    self.master.loaded_at,
+            "load_seconds": (round(self.master.load_seconds, 3)
+                             if self.master.load_seconds is not None else None),
+        }
+
+    def generate(self, pdf, order_number=None, location=None):
+        """Parse an uploaded PDF and match it against master data.
+
+        Returns a dict with the invoice details and the PO and exception rows.
+        """
+        if not self._slots.acquire(blocking=False):
+            self.metrics.reject()
+            raise RequestError(503, "busy: too many invoices in progress, retry shortly")
+        tmp_dir = tempfile.mkdtemp(prefix="po_service_")
+        try:
+            # A fixed name: invoice_cache.py's per-order clear matches on the invoice number
+            pdf_path = os.path.join(tmp_dir, f"upload{INVOICE_SUFFIX}")
+            with open(pdf_path, "wb") as f:
+                f.write(pdf)
+
+            start = time.perf_counter()
+            future = self.pool.submit(load_invoice, pdf_path, self.use_cache, None, self.engine)
+            try:
+                invoice_no, invoice_date, items, from_cache = future.result()
+            except Exception as e:
+                raise RequestError(422, f"could not parse invoice: {type(e).__name__}: {e}")
+            parsed = time.perf_counter()
+            self.metrics.add_stage("parse", parsed - start)
+        finally:
+            self._slots.release()
+            shutil.rmtree(tmp_dir, ignore_errors=True)
+
+        master_data = self.master_data()
+        projection = self.projection
+        if projection is None or not projection.is_current(master_data):
+            # Racing threads may each build one; the last to finish is kept
+            projection = self.projection = POProjection(master_data)
+        invoice = ParsedInvoice(invoice_no, invoice_date, items, from_cache)
+        rows = {"po": [], "exception": [], "accepted": []}
+        for kind, row in match_items(invoice, master_data, location or self.location, projection,
+                                     self.accept_upc):
+            rows[kind].append(row)
+        matched = time.perf_counter()
+        self.metrics.add_stage("match", matched - parsed)
+        order_number = order_number or valid_order_number(invoice_no)
+        if order_number and self.use_ledger:
+            ledger.record(order_number, invoice_no, invoice_date, items,
+                          digest=hashlib.sha256(pdf).hexdigest())
+
+        return {
+            "order":          order_number,
+            "invoice_no":     invoice_no,
+            "invoice_date":   invoice_date,
+            "items":          len(items),
+            "matched":        len(rows["po"]),
+            "exceptions":     len(rows["exception"]),
+            "upc_accepted":   len(rows["accepted"]),
+            "from_cache":     from_cache,
+            "master_version": self.master.version,
+            "seconds":        {"parse": round(parsed - start, 4), "match": round(matched - parsed, 4)},
+            "po_rows":        [dict(zip(PO_HEADERS, row)) for row in rows["po"]],
+            # Like the exceptions CSV: accepted lines are listed for review too
+            "exception_rows": [dict(zip(EXCEPTION_HEADERS, row))
+                               for row in rows["exception"] + rows["accepted"]],
+        }
+
+    def close(self):
+        self.pool.shutdown(wait=False, cancel_futures=True)
+
+
+def valid_order_number(value):
+    """Return value as an order number ("TH19087"), or None if it isn't one."""
+    if not value:
+        return None
+    value = value.strip().upper().lstrip("#")
+    return value if ORDER_NUMBER_RE.fullmatch(value) else None
+
+
+def attachment(name):
+    """A Content-Disposition value, with anything but [A-Za-z0-9_.-] dropped from the name."""
+    return f'attachment; filename="{re.sub(r"[^A-Za-z0-9_.-]", "", name)}"'
+
+
+def to_csv(headers, rows):
+    out = io.StringIO(newline="")
+    writer = csv.DictWriter(out, fieldnames=headers)
+    writer.writeheader()
+    writer.writerows(rows)
+    return out.getvalue()
+
+
+def parse_form(content_type, body):
+    """Return (fields, file bytes, file name) from a multipart/form-data body."""
+    message = BytesParser(policy=email.policy.HTTP).parsebytes(
+        f"Content-Type: {content_type}\r\n\r\n".encode("latin-1") + body
+    )
+    if not message.is_multipart():
+        raise RequestError(400, "malformed multipart form")
+    fields, pdf, filename = {}, None, None
+    for part in message.iter_parts():
+        name = part.get_param("name", header="content-disposition")
+        if name == "file":
+            pdf, filename = part.get_payload(decode=True), part.get_filename()
+        elif name:
+            fields[name] = part.get_payload(decode=True).decode("utf-8", "replace").strip()
+    return fields, pdf, filename
+
+
+class Handler(BaseHTTPRequestHandler):
+    server_version = "POService/1"
+
+    @property
+    def service(self):
+        return self.server.service
+
+    def log_message(self, format, *args):
+        pass  # _handle() prints one line per request instead
+
+    def do_GET(self):
+        self._handle(self._get)
+
+    def do_POST(self):
+        self._handle(self._post)
+
+    def _handle(self, route):
+        start = time.perf_counter()
+        path = urlsplit(self.path).path
+        metrics = self.service.metrics
+        metrics.enter()
+        try:
+            status = route(path)
+        except RequestError as e:
+            status = e.status
+            self._send_json(status, {"error": str(e)})
+        except Exception as e:
+            status = 500
+            self._send_json(status, {"error": f"{type(e).__name__}: {e}"})
+        finally:
+            metrics.leave()
+        elapsed = time.perf_counter() - start
+        route_name = f"{self.command} {path}" if path in ("/", "/po", "/health", "/metrics") \
+            else f"{self.command} other"
+        metrics.record(route_name, status, elapsed)
+        print(f"[{time.strftime('%Y-%m-%d %H:%M:%S')}] {self.command} {self.path} "
+              f"{status} {elapsed:.3f}s", flush=True)
+
+    def _send(self, status, body, content_type, headers=()):
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        for name, value in headers:
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+        return status
+
+    def _send_json(self, status, data):
+        return self._send(status, json.dumps(data, indent=1).encode(), "application/json")
+
+    def _get(self, path):
+        if path == "/":
+            form = UPLOAD_FORM.format(location=self.service.location.replace('"', "&quot;"))
+            return self._send(200, form.encode(), "text/html; charset=utf-8")
+        if path == "/health":
+            status = 200
+            try:
+                self.service.master_data()
+                health = "ok"
+            except RequestError as e:
+                status, health = e.status, str(e)
+            return self._send_json(status, {
+                "status": health,
+                "master": self.service.master_status(),
+                "workers": self.service.workers,
+                "queue": self.service.queue,
+                "engine": self.service.engine,
+            })
+        if path == "/metrics":
+            metrics = self.service.metrics.snapshot()
+            metrics["master"] = self.service.master_status()
+            return self._send_json(200, metrics)
+        raise RequestError(404, f"no such endpoint: {path}")
+
+    def _post(self, path):
+        if path != "/po":
+            raise RequestError(404, f"no such endpoint: {path}")
+        length = int(self.headers.get("Content-Length") or 0)
+        if length > MAX_UPLOAD:
+            raise RequestError(413, f"upload larger than {MAX_UPLOAD // (1024 * 1024)}MB")
+        body = self.rfile.read(length)
+
+        fields = {k: v[-1] for k, v in parse_qs(urlsplit(self.path).query).items()}
+        content_type = self.headers.get("Content-Type", "")
+        filename = None
+        if content_type.startswith("multipart/form-data"):
+            form, body, filename = parse_form(content_type, body)
+            fields.update(form)
+        if not body or not body.startswith(b"%PDF"):
+            raise RequestError(400, "expected an invoice PDF")
+
+        fmt = fields.get("format", "json")
+        if fmt not in FORMATS:
+            raise RequestError(400, f"format must be one of: {', '.join(FORMATS)}")
+        order_number = valid_order_number(fields.get("order"))
+        if fields.get("order") and not order_number:
+            raise RequestError(400, "order must be an order number like TH19087")
+        if not order_number and filename:
+            order_number = valid_order_number(order_from_invoice_path(filename))
+        result = self.service.generate(body, order_number, fields.get("location"))
+        download_name = result["order"] or "invoice"
+
+        counts = [("X-Matched", str(result["matched"])), ("X-Exceptions", str(result["exceptions"]))]
+        if fmt == "csv":
+            return self._send(200, to_csv(PO_HEADERS, result["po_rows"]).encode("utf-8"),
+                              "text/csv; charset=utf-8",
+                              [("Content-Disposition", attachment(f"{download_name}_PO.csv"))]
+                              + counts)
+        if fmt == "exceptions":
+            return self._send(200, to_csv(EXCEPTION_HEADERS, result["exception_rows"]).encode("utf-8"),
+                              "text/csv; charset=utf-8",
+                              [("Content-Disposition", attachment(f"{download_name}_exceptions.csv"))]
+                              + counts)
+        return self._send_json(200, result)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Serve PO generation over HTTP with master data kept in memory.")
+    parser.add_argument("--host", default=DEFAULT_HOST, help=f"address to listen on (default: {DEFAULT_HOST})")
+    parser.add_argument("--port", type=int, default=DEFAULT_PORT, help=f"port (default: {DEFAULT_PORT})")
+    parser.add_argument("--workers", type=int, metavar="N",
+                        help="invoice parser processes (default: number of CPU cores)")
+    parser.add_argument("--queue", type=int, metavar="N",
+                        help="uploads allowed to wait for a parser before new ones get a 503 "
+                             "(default: twice --workers)")
+    parser.add_argument("--location", default=DEFAULT_LOCATION,
+                        help=f"default received-at location (default: {DEFAULT_LOCATION!r})")
+    parser.add_argument("--engine", choices=sorted(PAGE_PARSERS), default=DEFAULT_ENGINE,
+                        help="invoice page parser (see generate_po.py --help)")
+    parser.add_argument("--no-cache", dest="use_cache", action="store_false",
+                        help="always parse uploads, bypassing the parsed-invoice cache")
+    parser.add_argument("--accept-upc", action="store_true",
+                        help="put unknown Item #s with an exact UPC match into the PO "
+                             "(see generate_po.py --help)")
+    parser.add_argument("--no-ledger", dest="use_ledger", action="store_false",
+                        help=f"don't record the parsed invoices in {ledger.LEDGER_FILE}")
+    args = parser.parse_args()
+
+    service = POService(args.workers, args.queue, args.engine, args.use_cache, args.location,
+                        accept_upc=args.accept_upc, use_ledger=args.use_ledger)
+    print(f"Starting {service.workers} parser processes...")
+    try:
+        master_data = service.warm_up()
+        print(f"  master data: {len(master_data)} items")
+    except RequestError as e:
+        print(f"  {e} (will retry on each request)")
+
+    server = ThreadingHTTPServer((args.host, args.port), Handler)
+    server.service = service
+    print(f"Serving on http://{args.host}:{args.port}/ (Ctrl+C to stop)")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        print("\nStopped.")
+    finally:
+        server.server_close()
+        service.close()
+
+
+if __name__ == "__main__":
+    sys.exit(main())
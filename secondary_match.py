@@ -0,0 +1,228 @@
+#!/usr/bin/env python3
+"""Suggest master data matches for invoice lines whose Item # is not in master data.
+
+Exact Item # lookup is the only match generate_po.py trusts. For the lines it
+can't match, SecondaryIndex proposes ranked candidates from indexes built once
+over master data:
+
+- UPC: invoice and master UPCs normalized to GTIN-14, so UPC-A, EAN-13, a
+  dropped leading zero or a missing check digit all compare equal. A match
+  that depends on an inferred check digit is only a suggestion: an 11-digit
+  UPC missing its check digit and a different 12-digit code can normalize alike
+- Item #: ignoring leading zeros, and the set number in Bricklink ID
+- title: a word index over Description, scored by how many rare words the
+  invoice title shares with it
+
+Candidates go into the exceptions CSV with the reason each one matched, and
+generate_po.py --accept-upc puts lines whose UPC matches exactly one master
+item, digit for digit apart from leading zeros, straight into the PO.
+
+Usage:
+    python secondary_match.py "LEGO Star Wars Millennium Falcon 75375" [--upc 673419377919]
+"""
+
+import argparse
+import math
+import re
+import sys
+import time
+from array import array
+from collections import namedtuple
+
+from master_index import MASTER_FILE, MasterIndex, load_master_records
+
+# Words that say nothing about which item a title is
+STOP_WORDS = {"lego", "set", "the", "and", "of", "with", "in", "for", "a", "cs", "pk", "pack"}
+PACK_SUFFIX_RE = re.compile(r"\bCS\s+PK\s+\d+", re.IGNORECASE)
+WORD_RE = re.compile(r"[a-z0-9]+")
+
+MAX_CANDIDATES = 3
+MIN_TITLE_SCORE = 0.5
+# Only words on at most this share of master items are used to find title candidates;
+# commoner words still count toward the score
+RARE_WORD_SHARE = 0.01
+# Title candidates scored in full per line, after ranking by shared rare words
+TITLE_SHORTLIST = 50
+
+Candidate = namedtuple("Candidate", "sku description score reason exact_upc")
+
+
+def gtin_check_digit(body):
+    """The GS1 check digit for a string of digits without one."""
+    total = sum(int(d) * (3 if i % 2 == 0 else 1) for i, d in enumerate(reversed(body)))
+    return str((10 - total % 10) % 10)
+
+
+def upc_digits(value):
+    """A UPC/EAN/GTIN's digits without leading zeros, or None if it can't be one.
+
+    Leading zeros are not significant (spreadsheets drop them), so UPC-A and
+    its EAN-13 form give the same digits.
+    """
+    digits = re.sub(r"\D", "", value or "")
+    if "e" in (value or "").lower() or not 6 <= len(digits) <= 14:
+        return None  # scientific notation from a spreadsheet has lost digits
+    return digits.lstrip("0") or None
+
+
+def normalize_upc(value):
+    """A UPC/EAN/GTIN as a 14-digit GTIN, or None if it can't be one.
+
+    If the digits (see upc_digits) don't end in a valid check digit they are
+    taken to be missing it, so this can equate two different codes.
+    """
+    core = upc_digits(value)
+    if not core:
+        return None
+    if gtin_check_digit(core[:-1]) == core[-1] and len(core) > 1:
+        return core.zfill(14)
+    if len(core) <= 13:
+        return (core + gtin_check_digit(core)).zfill(14)
+    return None
+
+
+def title_words(title):
+    """The words of a title that identify an item, pack size and filler removed."""
+    title = PACK_SUFFIX_RE.sub(" ", title or "")
+    return [w for w in WORD_RE.findall(title.lower()) if w not in STOP_WORDS and len(w) > 1]
+
+
+def _set_number(bricklink_id):
+    """The set number in a Bricklink ID: 75375-1 → 75375."""
+    return (bricklink_id or "").strip().split("-")[0].lstrip("0")
+
+
+class SecondaryIndex:
+    """UPC, Item # and title-word indexes over one master data version."""
+
+    def __init__(self, master_data):
+        start = time.perf_counter()
+        self.master_data = master_data
+        self.skus = []
+        self.by_upc = {}        # GTIN-14 → [sku, ...]
+        self.by_upc_digits = {}  # UPC digits without leading zeros → [sku, ...]
+        self.by_number = {}     # Item # without leading zeros, or set number → [sku, ...]
+        words = {}              # word → array of positions in self.skus
+
+        rows = master_data.iter_items() if isinstance(master_data, MasterIndex) else master_data.items()
+        for sku, row in rows:
+            position = len(self.skus)
+            self.skus.append(sku)
+            gtin = normalize_upc(row.get("UPC"))
+            if gtin:
+                self.by_upc.setdefault(gtin, []).append(sku)
+                self.by_upc_digits.setdefault(upc_digits(row.get("UPC")), []).append(sku)
+            for number in {sku.lstrip("0"), _set_number(row.get("Bricklink ID"))}:
+                if number:
+                    self.by_number.setdefault(number, []).append(sku)
+            for word in set(title_words(row.get("Description"))):
+                postings = words.get(word)
+                if postings is None:
+                    postings = words[word] = array("I")
+                postings.append(position)
+
+        self.words = words
+        count = max(1, len(self.skus))
+        self.idf = {word: math.log(count / len(postings)) + 1 for word, postings in words.items()}
+        self.rare_limit = max(10, int(count * RARE_WORD_SHARE))
+        self.build_seconds = time.perf_counter() - start
+
+    def _description(self, sku):
+        row = self.master_data.get(sku)
+        return row.get("Description", "") if row else ""
+
+    def _title_score(self, words, description):
+        """Weighted overlap of two titles' words, 0-1 (IDF-weighted Dice)."""
+        other = set(title_words(description))
+        if not words or not other:
+            return 0.0, []
+        shared = words & other
+        weight = self.idf.get
+        score = 2 * sum(weight(w, 0) for w in shared) / (
+            sum(weight(w, 0) for w in words) + sum(weight(w, 0) for w in other))
+        return score, sorted(shared, key=lambda w: -weight(w, 0))
+
+    def title_candidates(self, title, limit=MAX_CANDIDATES):
+        """[(score, sku, shared words)] best first, for titles scoring at least MIN_TITLE_SCORE."""
+        words = set(title_words(title))
+        rare = [w for w in words if w in self.words and len(self.words[w]) <= self.rare_limit]
+        if not rare:
+            return []
+        hits = {}
+        for word in rare:
+            idf = self.idf[word]
+            for position in self.words[word]:
+                hits[position] = hits.get(position, 0.0) + idf
+        shortlist = sorted(hits, key=hits.get, reverse=True)[:TITLE_SHORTLIST]
+        scored = []
+        for position in shortlist:
+            sku = self.skus[position]
+            score, shared = self._title_score(words, self._description(sku))
+            if score >= MIN_TITLE_SCORE:
+                scored.append((score, sku, shared))
+        scored.sort(key=lambda c: (-c[0], c[1]))
+        return scored[:limit]
+
+    def candidates(self, item, limit=MAX_CANDIDATES):
+        """Ranked Candidates for an invoice item ({"sku", "upc", "title", ...})."""
+        found = {}
+
+        def add(sku, score, reason, exact_upc=False):
+            if sku not in found or found[sku].score < score:
+                found[sku] = Candidate(sku, self._description(sku), round(score, 3), reason, exact_upc)
+
+        gtin = normalize_upc(item.get("upc"))
+        exact = self._exact_upc_skus(item) if gtin else ()
+        for sku in self.by_upc.get(gtin, ()) if gtin else ():
+            if sku in exact:
+                add(sku, 1.0, f"UPC {gtin} matches", exact_upc=True)
+            else:
+                add(sku, 0.95, f"UPC {gtin} matches (check digit inferred)")
+        number = (item.get("sku") or "").lstrip("0")
+        for sku in self.by_number.get(number, ()) if number else ():
+            add(sku, 0.9, f"Item # {item.get('sku')} matches Item #/Bricklink ID {sku}")
+        for score, sku, shared in self.title_candidates(item.get("title")):
+            add(sku, score * 0.8, f"title {score:.2f}: {' '.join(shared[:4])}")
+        return sorted(found.values(), key=lambda c: (-c.score, c.sku))[:limit]
+
+    def _exact_upc_skus(self, item):
+        digits = upc_digits(item.get("upc"))
+        return self.by_upc_digits.get(digits, ()) if digits else ()
+
+    def upc_match(self, item):
+        """The master SKU whose UPC is exactly this item's, if exactly one is, else None.
+
+        Exactly means the same digits apart from leading zeros. A UPC that only
+        matches once a check digit is inferred is never returned, and neither is
+        one that normalizes to the same GTIN as any other master item.
+        """
+        gtin = normalize_upc(item.get("upc"))
+        skus = self.by_upc.get(gtin, []) if gtin else []
+        if len(skus) == 1 and skus[0] in self._exact_upc_skus(item):
+            return skus[0]
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Look up master data candidates for an invoice line.")
+    parser.add_argument("title", help="invoice line title")
+    parser.add_argument("--upc", default="", help="invoice UPC")
+    parser.add_argument("--sku", default="", help="invoice Item #")
+    args = parser.parse_args()
+
+    print(f"Indexing {MASTER_FILE}...")
+    index = SecondaryIndex(load_master_records(MASTER_FILE))
+    print(f"  {len(index.skus)} items, {len(index.words)} words, {len(index.by_upc)} UPCs "
+          f"in {index.build_seconds:.2f}s")
+    start = time.perf_counter()
+    found = index.candidates({"sku": args.sku, "upc": args.upc, "title": args.title})
+    print(f"  lookup {(time.perf_counter() - start) * 1000:.1f}ms\n")
+    if not found:
+        print("No candidates.")
+        sys.exit(1)
+    for c in found:
+        print(f"  {c.score:.2f}  {c.sku:<10} {c.description[:50]:<50}  {c.reason}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,312 @@
+"""Self-checks of the network code paths against local fake servers, entirely offline.
+
+Each check starts a throwaway HTTP server on 127.0.0.1 that imitates the real
+endpoint, points the code at it and compares what comes out with what went in:
+
+    sheets   download_sheet.fetch_projected() against a fake Sheets values API:
+             row chunking, column projection (including a repeated header) and
+             the retry on a rate-limited batchGet
+    toyhouse toyhouse_http.ToyhouseHTTP against a stub of the Toyhouse account
+             site: order lookup, the invoice PDF fetch, and SessionExpired (the
+             browser fallback) for a logged-out or malformed saved session
+
+Data comes from synthetic.py, so no Google account or Toyhouse login is needed.
+The exit status is 1 if any check fails.
+
+Usage:
+    python selfcheck.py            # every check
+    python selfcheck.py sheets
+    python selfcheck.py toyhouse
+"""
+
+import argparse
+import csv
+import json
+import math
+import os
+import re
+import shutil
+import sys
+import tempfile
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, unquote, urlsplit
+
+import requests
+
+import synthetic
+from master_index import load_master_records
+
+
+class Checks:
+    """Collects pass/fail results and prints one line per check."""
+
+    def __init__(self):
+        self.failed = 0
+
+    def expect(self, ok, name, detail=""):
+        print(f"  {'ok    ' if ok else 'FAILED'}  {name}" + (f": {detail}" if detail and not ok else ""))
+        if not ok:
+            self.failed += 1
+
+
+def _serve(handler, **state):
+    """Start a ThreadingHTTPServer on a free port with state as attributes. Returns it."""
+    server = ThreadingHTTPServer(("127.0.0.1", 0), handler)
+    server.daemon_threads = True
+    server.lock = threading.Lock()
+    server.log = []
+    for name, value in state.items():
+        setattr(server, name, value)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+class QuietHandler(BaseHTTPRequestHandler):
+    def log_message(self, format, *args):
+        pass
+
+    def send_body(self, status, body, content_type="application/json", headers=()):
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        for name, value in headers:
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def send_json(self, status, data):
+        self.send_body(status, json.dumps(data).encode())
+
+
+# --- Sheets values API ----------------------------------------------------------
+
+SPREADSHEET_ID = "fake-sheet"
+SHEET_TITLE = "Master Data"
+A1_RE = re.compile(r"^(?:'(?:[^']|'')*'!)?([A-Z]*)(\d*):([A-Z]*)(\d*)$")
+
+
+def _column_index(letters):
+    """A → 0, Z → 25, AA → 26."""
+    index = 0
+    for letter in letters:
+        index = index * 26 + ord(letter) - ord("A") + 1
+    return index - 1
+
+
+class FakeSheetsHandler(QuietHandler):
+    """The three Sheets API calls fetch_projected() makes, over server.sheet (a list of rows).
+
+    Like the real API, trailing empty cells and rows are left out of values.
+    The first server.rate_limited batchGet requests get a 429.
+    """
+
+    def do_GET(self):
+        url = urlsplit(self.path)
+        sheet_path = f"/v4/spreadsheets/{SPREADSHEET_ID}"
+        with self.server.lock:
+            self.server.log.append(url.path)
+        if url.path == sheet_path:
+            return self.send_json(200, {"sheets": [{"properties": {
+                "title": SHEET_TITLE, "gridProperties": {"rowCount": len(self.server.sheet)}}}]})
+        if url.path == f"{sheet_path}/values:batchGet":
+            with self.server.lock:
+                limited = self.server.rate_limited > 0
+                self.server.rate_limited -= limited
+            if limited:
+                return self.send_json(429, {"error": {"code": 429, "status": "RESOURCE_EXHAUSTED"}})
+            ranges = parse_qs(url.query).get("ranges", [])
+            with self.server.lock:
+                self.server.ranges.extend(ranges)
+            return self.send_json(200, {"valueRanges": [self._values(r) for r in ranges]})
+        if url.path.startswith(f"{sheet_path}/values/"):
+            return self.send_json(200, self._values(unquote(url.path[len(sheet_path) + 8:])))
+        return self.send_json(404, {"error": {"code": 404}})
+
+    def _values(self, a1):
+        first_col, first_row, last_col, last_row = A1_RE.match(a1).groups()
+        sheet = self.server.sheet
+        rows = sheet[int(first_row or 1) - 1:int(last_row or len(sheet))]
+        start = _column_index(first_col) if first_col else 0
+        stop = _column_index(last_col) + 1 if last_col else None
+        values = []
+        for row in rows:
+            cells = row[start:stop]
+            while cells and cells[-1] == "":
+                cells.pop()
+            values.append(cells)
+        while values and not values[-1]:
+            values.pop()
+        return {"range": a1, "values": values} if values else {"range": a1}
+
+
+def check_sheets(checks, skus=2500, width=60, chunk_rows=300, workers=3):
+    import download_sheet
+
+    tmp_dir = tempfile.mkdtemp(prefix="selfcheck_")
+    try:
+        full_path = os.path.join(tmp_dir, "full.csv")
+        synthetic.write_master_csv(full_path, skus, width)
+        with open(full_path, newline="", encoding="utf-8") as f:
+            sheet = list(csv.reader(f))
+        # A repeated header: the full CSV load keeps the last one, so the projection must too
+        sheet[0][-1] = "Default Cost"
+        with open(full_path, "w", newline="", encoding="utf-8") as f:
+            csv.writer(f).writerows(sheet)
+
+        server = _serve(FakeSheetsHandler, sheet=sheet, rate_limited=1, ranges=[])
+        retry_seconds, download_sheet.RETRY_SECONDS = download_sheet.RETRY_SECONDS, 0.05
+        try:
+            out_path = os.path.join(tmp_dir, "projected.csv")
+            written = download_sheet.fetch_projected(
+                requests.Session, out_path, chunk_rows=chunk_rows, workers=workers,
+                base_url=f"http://127.0.0.1:{server.server_port}/v4/spreadsheets",
+                spreadsheet_id=SPREADSHEET_ID)
+        finally:
+            download_sheet.RETRY_SECONDS = retry_seconds
+            server.shutdown()
+
+        checks.expect(written == len(sheet), "every row written",
+                      f"{written} rows, the sheet has {len(sheet)}")
+        full, projected = load_master_records(full_path), load_master_records(out_path)
+        differing = [sku for sku in full if projected.get(sku) != full[sku]]
+        checks.expect(len(projected) == len(full) and not differing,
+                      "projected master data matches the full sheet's",
+                      f"{len(projected)} SKUs vs {len(full)}, {len(differing)} differ")
+        with open(out_path, newline="", encoding="utf-8") as f:
+            columns = len(next(csv.reader(f)))
+        checks.expect(columns < width, "only the used columns are fetched", f"{columns} columns")
+        chunks = math.ceil((len(sheet) - 1) / chunk_rows)
+        batches = sum(path.endswith("values:batchGet") for path in server.log)
+        checks.expect(batches == chunks + 1, "one batchGet per chunk, plus the rate-limited retry",
+                      f"{batches} requests for {chunks} chunks")
+        checks.expect(server.rate_limited == 0, "the 429 was retried")
+    finally:
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+
+
+# --- Toyhouse account site ------------------------------------------------------
+
+SESSION_COOKIE = ("toyhouse_session", "logged-in")
+ORDER_ID_RE = re.compile(r"^/orders/(\d+)(/invoice\.pdf)?$")
+
+
+class StubToyhouseHandler(QuietHandler):
+    """The orders list, order pages and invoice PDFs, for server.orders_html and server.pdf.
+
+    Requests without the session cookie are redirected to the login page, as
+    the real site does when a session has expired.
+    """
+
+    def do_GET(self):
+        url = urlsplit(self.path)
+        with self.server.lock:
+            self.server.log.append(url.path)
+        if url.path == "/authentication":
+            return self.send_body(200, b"<html><body>Log in</body></html>", "text/html")
+        if "=".join(SESSION_COOKIE) not in (self.headers.get("Cookie") or ""):
+            return self.send_body(302, b"", headers=[("Location", "/authentication?returnUrl=/orders")])
+        if url.path == "/orders":
+            return self.send_body(200, self.server.orders_html.encode(), "text/html")
+        match = ORDER_ID_RE.match(url.path)
+        if match and match.group(2):
+            return self.send_body(200, self.server.pdf, "application/pdf")
+        if match:
+            page = (f'<html><body><h1>Order {match.group(1)}</h1>'
+                    f'<a class="btn" href="/orders/{match.group(1)}/invoice.pdf">Download Your Invoice</a>'
+                    f'</body></html>')
+            return self.send_body(200, page.encode(), "text/html")
+        return self.send_body(404, b"not found", "text/plain")
+
+
+def _write_session(path, cookie_value=SESSION_COOKIE[1], **overrides):
+    cookie = {"name": SESSION_COOKIE[0], "value": cookie_value, "domain": "127.0.0.1", "path": "/",
+              "expires": -1, "httpOnly": True, "secure": False, "sameSite": "Lax", **overrides}
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump({"cookies": [cookie], "origins": []}, f)
+
+
+def check_toyhouse(checks):
+    from toyhouse_http import FastPathUnavailable, SessionExpired, ToyhouseHTTP
+
+    tmp_dir = tempfile.mkdtemp(prefix="selfcheck_")
+    cwd = os.getcwd()
+    # The order index (toyhouse_orders.json) is written to the working directory
+    os.chdir(tmp_dir)
+    try:
+        pdf_path = synthetic.write_invoice_pdf("sample.pdf", pages=1)
+        with open(pdf_path, "rb") as f:
+            pdf = f.read()
+        server = _serve(StubToyhouseHandler, orders_html=synthetic.synthetic_orders_html(20), pdf=pdf)
+        base_url = f"http://127.0.0.1:{server.server_port}"
+        try:
+            _write_session("session.json")
+            http = ToyhouseHTTP("session.json", base_url)
+            saved = http.download_invoice("#TH19995", "invoices/TH19995_invoice.pdf")
+            with open(saved, "rb") as f:
+                checks.expect(f.read() == pdf, "invoice PDF fetched over HTTP")
+            checks.expect(server.log == ["/orders", "/orders/5019995", "/orders/5019995/invoice.pdf"],
+                          "order found on the orders page", f"requests: {server.log}")
+
+            server.log.clear()
+            http.download_invoice("TH19990", "invoices/TH19990_invoice.pdf")
+            checks.expect(server.log[0] == "/orders/5019990", "order found in the order index",
+                          f"requests: {server.log}")
+
+            def falls_back(name):
+                try:
+                    ToyhouseHTTP("session.json", base_url).download_invoice(
+                        "TH19987", "invoices/TH19987_invoice.pdf")
+                except SessionExpired as e:
+                    checks.expect(isinstance(e, FastPathUnavailable), name)
+                    return
+                except Exception as e:
+                    checks.expect(False, name, f"{type(e).__name__}: {e}")
+                    return
+                checks.expect(False, name, "the download succeeded")
+
+            _write_session("session.json", cookie_value="expired")
+            falls_back("login redirect falls back to the browser")
+            with open("session.json", "w", encoding="utf-8") as f:
+                f.write('{"cookies": [')
+            falls_back("truncated session file falls back to the browser")
+            with open("session.json", "w", encoding="utf-8") as f:
+                json.dump({"cookies": [{"name": SESSION_COOKIE[0]}]}, f)
+            falls_back("session cookie without a value falls back to the browser")
+            checks.expect(not os.path.exists("invoices/TH19987_invoice.pdf"),
+                          "no invoice written when falling back")
+        finally:
+            server.shutdown()
+    finally:
+        os.chdir(cwd)
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+
+
+CHECKS = {
+    "sheets":   check_sheets,
+    "toyhouse": check_toyhouse,
+}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Check the network code paths against local fakes.")
+    parser.add_argument("checks", nargs="*", metavar="CHECK",
+                        help=f"checks to run: {', '.join(CHECKS)} (default: all)")
+    args = parser.parse_args()
+    unknown = [name for name in args.checks if name not in CHECKS]
+    if unknown:
+        parser.error(f"unknown check(s): {', '.join(unknown)}")
+
+    checks = Checks()
+    for name in args.checks or CHECKS:
+        print(f"{name}:")
+        CHECKS[name](checks)
+    if checks.failed:
+        print(f"\n{checks.failed} check(s) failed")
+        return 1
+    print("\nAll checks passed")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
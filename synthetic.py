@@ -0,0 +1,224 @@
+"""Synthetic Toyhouse-shaped test data: invoice PDFs, master data CSVs and orders pages.
+
+Everything is generated offline and deterministically from a seed, so the
+benchmarks in benchmark.py are repeatable without real invoices or a Google
+account. The invoice PDFs are written by hand (no PDF library needed) with the
+same layout generate_po.py parses: an "Invoice #TH…" header, the invoice date,
+and a ruled TITLE/SKU/UPC/QTY/PRICE table whose titles may carry a second
+"CS PK N" line.
+
+Usage:
+    python synthetic.py invoice OUT.pdf [--pages 20] [--rows 25] [--skus 1000]
+    python synthetic.py master OUT.csv [--skus 1000] [--width 120]
+    python synthetic.py orders OUT.html [--orders 500]
+"""
+
+import argparse
+import csv
+import random
+
+from master_index import MASTER_COLUMNS
+
+FIRST_SKU = 100000
+# Share of invoice lines whose SKU is outside the master data (→ exceptions)
+MISSING_SKU_RATE = 0.1
+INVOICE_COLUMNS = ["TITLE", "SKU", "UPC", "QTY", "PRICE"]
+COLUMN_X = [40, 260, 330, 430, 480, 560]
+THEMES = ["City", "Star Wars", "Technic", "Friends", "Ninjago", "Icons", "Duplo"]
+STATUSES = ["Delivered", "Shipped", "Processing", "Cancelled"]
+
+
+def sku(n):
+    return str(FIRST_SKU + n)
+
+
+# --- Invoice PDFs ------------------------------------------------------------
+
+def _pdf_text(s):
+    return s.replace("\\", "\\\\").replace("(", "\\(").replace(")", "\\)")
+
+
+def _invoice_page(rows, invoice_no, invoice_date, first):
+    ops = []
+    y = 760
+    if first:
+        ops.append(f"BT /F1 14 Tf 40 {y} Td ({_pdf_text('Invoice #' + invoice_no)}) Tj ET")
+        y -= 20
+        ops.append(f"BT /F1 10 Tf 40 {y} Td ({_pdf_text(invoice_date)}) Tj ET")
+        y -= 30
+
+    ys = [y]
+    for row in [INVOICE_COLUMNS] + rows:
+        top = ys[-1]
+        for x, cell in zip(COLUMN_X, row):
+            for j, line in enumerate(cell.split("\n")):
+                ops.append(f"BT /F1 8 Tf {x + 3} {top - 10 - 11 * j} Td ({_pdf_text(line)}) Tj ET")
+        ys.append(top - 6 - 11 * len(row[0].split("\n")))
+
+    # Ruling lines, so pdfplumber's lattice table detection finds the cells
+    for yy in ys:
+        ops.append(f"{COLUMN_X[0]} {yy} m {COLUMN_X[-1]} {yy} l S")
+    for x in COLUMN_X:
+        ops.append(f"{x} {ys[0]} m {x} {ys[-1]} l S")
+    ops.append("BT /F1 8 Tf 40 30 Td (Thank you for your order) Tj ET")
+    return "\n".join(ops)
+
+
+def invoice_rows(pages, rows_per_page=25, skus=1000, seed=1):
+    """The table rows for each page: [[title, sku, upc, qty, price], ...] per page."""
+    rng = random.Random(seed)
+    out = []
+    for _ in range(pages):
+        rows = []
+        for _ in range(rows_per_page):
+            n = rng.randrange(int(skus * (1 + MISSING_SKU_RATE)))
+            code = sku(n) if n < skus else str(900000 + n)
+            title = f"LEGO {rng.choice(THEMES)} Set {code}"
+            if rng.random() < 0.5:
+                title += f"\nCS PK {rng.choice([2, 4, 6, 8])}"
+            rows.append([
+                title, code, f"6734{rng.randint(10000000, 99999999)}",
+                str(rng.randint(1, 5)), f"${rng.randint(5, 500)}.{rng.randint(0, 99):02d}",
+            ])
+        out.append(rows)
+    return out
+
+
+def write_invoice_pdf(path, pages=1, rows_per_page=25, skus=1000, seed=1,
+                      invoice_no="TH20003", invoice_date="January 5, 2025"):
+    """Write a pages-long invoice PDF whose SKUs mostly come from a skus-row master file."""
+    streams = [
+        _invoice_page(rows, invoice_no, invoice_date, i == 0)
+        for i, rows in enumerate(invoice_rows(pages, rows_per_page, skus, seed))
+    ]
+
+    # Objects: 1 catalog, 2 page tree, 3 font, then a page and a content stream per page
+    out = [b"%PDF-1.4\n"]
+    offsets = []
+    size = len(out[0])
+
+    def add(body):
+        nonlocal size
+        offsets.append(size)
+        obj = f"{len(offsets)} 0 obj\n".encode() + body + b"\nendobj\n"
+        out.append(obj)
+        size += len(obj)
+
+    kids = " ".join(f"{4 + 2 * i} 0 R" for i in range(pages))
+    add(b"<< /Type /Catalog /Pages 2 0 R >>")
+    add(f"<< /Type /Pages /Kids [{kids}] /Count {pages} >>".encode())
+    add(b"<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>")
+    for i, stream in enumerate(streams):
+        add(f"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 612 792] "
+            f"/Resources << /Font << /F1 3 0 R >> >> /Contents {5 + 2 * i} 0 R >>".encode())
+        data = stream.encode("latin-1")
+        add(f"<< /Length {len(data)} >>\nstream\n".encode() + data + b"\nendstream")
+
+    out.append(f"xref\n0 {len(offsets) + 1}\n0000000000 65535 f \n".encode())
+    out.extend(f"{o:010d} 00000 n \n".encode() for o in offsets)
+    out.append(f"trailer\n<< /Size {len(offsets) + 1} /Root 1 0 R >>\n"
+               f"startxref\n{size}\n%%EOF\n".encode())
+    with open(path, "wb") as f:
+        f.write(b"".join(out))
+    return path
+
+
+# --- Master data CSVs --------------------------------------------------------
+
+def master_header(width):
+    """The used columns plus filler up to width columns, like the sheet's A:ZZ export."""
+    # The real sheet has a trailing space on "Item #"
+    header = ["Item # "] + MASTER_COLUMNS[1:]
+    header += [f"Column {i}" for i in range(len(header) + 1, width + 1)]
+    return header
+
+
+def write_master_csv(path, skus=1000, width=120, seed=2):
+    """Write a skus-row master data CSV with width columns."""
+    rng = random.Random(seed)
+    header = master_header(width)
+    filler = len(header) - len(MASTER_COLUMNS)
+    # A pool of filler patterns keeps 200k x 702 files quick to generate
+    fillers = [[rng.choice(["", "x", "n/a", "0"]) for _ in range(filler)] for _ in range(64)]
+    with open(path, "w", newline="", encoding="utf-8") as f:
+        writer = csv.writer(f)
+        writer.writerow(header)
+        for n in range(skus):
+            code = sku(n)
+            theme = rng.choice(THEMES)
+            msrp = rng.randint(5, 500) + 0.99
+            writer.writerow([
+                code, f"{theme} Set {code}", f"${msrp * 0.6:.2f}", f"${msrp:.2f}", f"${msrp:.2f}",
+                "Y", f"LEGO {theme} building set {code} with minifigures", f"https://img.example/{code}.jpg",
+                "ToyHouse", "Y", f"6734{rng.randint(10000000, 99999999)}", "LEGO", theme,
+                f"{code}-1", f"lego,{theme.lower()}", "Sets", "New",
+                rng.choice(["", "", "Retired", "01/01/2020", "12/31/2030"]),
+                f"{rng.randint(1, 12):02d}/01/20{rng.randint(15, 26)}",
+                rng.choice(["", str(rng.randint(4, 80))]),
+                str(rng.randint(4, 24)), str(rng.randint(4, 24)), str(rng.randint(1, 6)),
+            ] + rng.choice(fillers))
+    return path
+
+
+# --- Orders pages ------------------------------------------------------------
+
+def synthetic_orders_html(n_orders, seed=0):
+    """An orders page shaped like the Toyhouse account list, with n_orders rows."""
+    rng = random.Random(seed)
+    rows = ['<div role="row"><div role="columnheader">Order</div><div role="columnheader">Date</div>'
+            '<div role="columnheader">Status</div><div role="columnheader">Items</div>'
+            '<div role="columnheader">Total</div></div>']
+    for i in range(n_orders):
+        number = 19999 - i
+        rows.append(
+            f'<div role="row" class="order-row">'
+            f'<div role="cell"><a href="/orders/{5000000 + number}?ref=list" class="link">'
+            f'  <span>#TH{number}</span> </a></div>'
+            f'<div role="cell"><span>Jan {1 + i % 28}, 2026</span></div>'
+            f'<div role="cell"><span class="badge"><strong> {rng.choice(STATUSES)} </strong></span></div>'
+            f'<div role="cell">{rng.randint(1, 40)} items</div>'
+            f'<div role="cell"><span>$</span>{rng.randint(100, 99999) / 100:,.2f}</div>'
+            f'</div>'
+        )
+    return ('<!DOCTYPE html><html><head><title>Orders</title></head><body><main>'
+            '<div role="table">' + "\n".join(rows) + '</div>'
+            '<button type="button">Load more</button></main></body></html>')
+
+
+def write_orders_html(path, orders=500, seed=0):
+    with open(path, "w", encoding="utf-8") as f:
+        f.write(synthetic_orders_html(orders, seed))
+    return path
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Generate synthetic Toyhouse test data.")
+    sub = parser.add_subparsers(dest="command", required=True)
+    inv = sub.add_parser("invoice", help="an invoice PDF")
+    inv.add_argument("out")
+    inv.add_argument("--pages", type=int, default=20)
+    inv.add_argument("--rows", type=int, default=25, help="line items per page")
+    inv.add_argument("--skus", type=int, default=1000, help="master SKUs to draw from")
+    inv.add_argument("--seed", type=int, default=1)
+    master = sub.add_parser("master", help="a master data CSV")
+    master.add_argument("out")
+    master.add_argument("--skus", type=int, default=1000)
+    master.add_argument("--width", type=int, default=120, help="total columns")
+    master.add_argument("--seed", type=int, default=2)
+    orders = sub.add_parser("orders", help="an orders-page HTML file")
+    orders.add_argument("out")
+    orders.add_argument("--orders", type=int, default=500)
+    orders.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    if args.command == "invoice":
+        write_invoice_pdf(args.out, args.pages, args.rows, args.skus, args.seed)
+    elif args.command == "master":
+        write_master_csv(args.out, args.skus, args.width, args.seed)
+    else:
+        write_orders_html(args.out, args.orders, args.seed)
+    print(f"Wrote {args.out}")
+
+
+if __name__ == "__main__":
+    main()
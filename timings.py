@@ -0,0 +1,257 @@
+"""Per-stage timing and profiling behind the scripts' --timings/--profile/--trace options.
+
+Instrumented code calls the module-level helpers (stage(), add(), page(),
+count()); they do nothing unless a script has started a recorder, so the
+normal path pays only a function call. A finished run can:
+
+- print per-stage wall/CPU time, per-page parse times and row counts (--timings)
+- write a cProfile dump for snakeviz/pstats (--profile FILE)
+- write a JSON trace in Chrome trace format for chrome://tracing or Perfetto
+  (--trace FILE)
+- append one summary line to po_metrics.jsonl, to compare runs over time
+"""
+
+import cProfile
+import json
+import os
+import sys
+import time
+from contextlib import contextmanager, nullcontext
+
+try:
+    import resource
+except ImportError:
+    # Windows: no getrusage, so no peak RSS
+    resource = None
+
+METRICS_FILE = "po_metrics.jsonl"
+# Print every page's time up to this many pages, only the slowest beyond it
+PAGE_DETAIL_LIMIT = 30
+
+
+class Recorder:
+    """Stage totals, per-page times, counts and trace events for one run."""
+
+    def __init__(self, script, argv=None, profile_path=None, trace_path=None,
+                 metrics_path=METRICS_FILE):
+        self.script = script
+        self.argv = list(sys.argv[1:] if argv is None else argv)
+        self.profile_path = profile_path
+        self.trace_path = trace_path
+        self.metrics_path = metrics_path
+        self.stages = {}
+        self.pages = []
+        self.counts = {}
+        self.info = {}
+        self.events = []
+        self.started_at = time.strftime("%Y-%m-%d %H:%M:%S")
+        self.t0 = time.perf_counter()
+        self.cpu0 = time.process_time()
+        self.profiler = None
+        if profile_path:
+            self.profiler = cProfile.Profile()
+            self.profiler.enable()
+
+    def add(self, name, wall, cpu=None, calls=1):
+        stage = self.stages.setdefault(name, {"wall": 0.0, "cpu": None, "calls": 0})
+        stage["wall"] += wall
+        stage["calls"] += calls
+        if cpu is not None:
+            stage["cpu"] = (stage["cpu"] or 0.0) + cpu
+
+    @contextmanager
+    def stage(self, name):
+        start, cpu = time.perf_counter(), time.process_time()
+        try:
+            yield
+        finally:
+            wall = time.perf_counter() - start
+            self.add(name, wall, time.process_time() - cpu)
+            self.events.append((name, start - self.t0, wall))
+
+    def page(self, number, wall, cpu=None, rows=0, offset=None):
+        self.pages.append({"page": number, "wall": wall, "cpu": cpu, "rows": rows})
+        if offset is not None:
+            self.events.append((f"page {number}", offset - self.t0, wall))
+
+    def count(self, name, n=1):
+        self.counts[name] = self.counts.get(name, 0) + n
+
+    def annotate(self, **info):
+        self.info.update(info)
+
+    def record(self):
+        """The run summary that goes into the metrics log."""
+        wall = time.perf_counter() - self.t0
+        pages = [p["wall"] for p in self.pages]
+        return {
+            "script":      self.script,
+            "started_at":  self.started_at,
+            "argv":        self.argv,
+            "wall":        round(wall, 6),
+            "cpu":         round(time.process_time() - self.cpu0, 6),
+            "stages":      {name: {"wall": round(s["wall"], 6),
+                                   "cpu": None if s["cpu"] is None else round(s["cpu"], 6),
+                                   "calls": s["calls"]}
+                            for name, s in self.stages.items()},
+            "pages":       {"count": len(pages), "total": round(sum(pages), 6),
+                            "max": round(max(pages), 6) if pages else 0.0},
+            "counts":      self.counts,
+            "peak_rss_mb": peak_rss_mb(),
+            **self.info,
+        }
+
+    def report(self, record):
+        peak = f", peak RSS {record['peak_rss_mb']} MB" if record["peak_rss_mb"] else ""
+        print(f"\nTimings ({self.script}): {record['wall']:.3f}s wall, {record['cpu']:.3f}s CPU{peak}")
+        if self.stages:
+            print(f"  {'stage':<22} {'wall':>9} {'cpu':>9} {'calls':>7}")
+            for name, s in sorted(self.stages.items(), key=lambda kv: -kv[1]["wall"]):
+                cpu = f"{s['cpu']:.3f}s" if s["cpu"] is not None else "-"
+                print(f"  {name:<22} {s['wall']:>8.3f}s {cpu:>9} {s['calls']:>7}")
+        if self.pages:
+            total = sum(p["wall"] for p in self.pages)
+            print(f"  pages: {len(self.pages)} parsed in {total:.3f}s "
+                  f"(mean {total / len(self.pages) * 1000:.1f}ms)")
+            shown = self.pages
+            if len(shown) > PAGE_DETAIL_LIMIT:
+                shown = sorted(shown, key=lambda p: -p["wall"])[:5]
+                print("  slowest pages:")
+            for p in shown:
+                print(f"    page {p['page']:>4}: {p['wall'] * 1000:8.1f}ms  {p['rows']} rows")
+        if self.counts:
+            print("  counts: " + ", ".join(f"{k} {v}" for k, v in self.counts.items()))
+
+    def write_trace(self):
+        events = [{"name": name, "ph": "X", "ts": round(start * 1e6), "dur": round(wall * 1e6),
+                   "pid": os.getpid(), "tid": 0 if name.startswith("page ") else 1}
+                  for name, start, wall in self.events]
+        with open(self.trace_path, "w", encoding="utf-8") as f:
+            json.dump({"traceEvents": events, "otherData": self.record()}, f, indent=1)
+
+    def finish(self):
+        if self.profiler:
+            self.profiler.disable()
+            self.profiler.dump_stats(self.profile_path)
+        record = self.record()
+        self.report(record)
+        if self.profile_path:
+            print(f"  profile → {self.profile_path} (python -m pstats {self.profile_path})")
+        if self.trace_path:
+            self.write_trace()
+            print(f"  trace   → {self.trace_path} (open in chrome://tracing or ui.perfetto.dev)")
+        if self.metrics_path:
+            with open(self.metrics_path, "a", encoding="utf-8") as f:
+                f.write(json.dumps(record) + "\n")
+        return record
+
+
+def peak_rss_mb(children=False):
+    """Peak RSS in MB of this process, or of its finished child processes; None if unknown."""
+    if resource is None:
+        return None
+    rss = resource.getrusage(resource.RUSAGE_CHILDREN if children else resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is bytes on macOS, KiB elsewhere
+    return round(rss / (1 << 20 if sys.platform == "darwin" else 1 << 10), 1)
+
+
+def current_rss_mb():
+    """This process's RSS right now in MB, where /proc has it (Linux); else None."""
+    try:
+        with open("/proc/self/statm") as f:
+            pages = int(f.read().split()[1])
+    except (OSError, ValueError, IndexError):
+        return None
+    return round(pages * os.sysconf("SC_PAGE_SIZE") / (1 << 20), 1)
+
+
+_active = None
+
+
+def start(script, argv=None, profile_path=None, trace_path=None, metrics_path=METRICS_FILE):
+    """Start recording for this process. Returns the Recorder."""
+    global _active
+    _active = Recorder(script, argv, profile_path, trace_path, metrics_path)
+    return _active
+
+
+def active():
+    return _active
+
+
+def finish():
+    """Report and save the active run, if any. Returns its record or None."""
+    global _active
+    if _active is None:
+        return None
+    recorder, _active = _active, None
+    return recorder.finish()
+
+
+def stage(name):
+    """Context manager timing a stage; a no-op when nothing is recording."""
+    return _active.stage(name) if _active else nullcontext()
+
+
+def add(name, wall, cpu=None, calls=1):
+    if _active:
+        _active.add(name, wall, cpu, calls)
+
+
+def page(number, wall, cpu=None, rows=0, offset=None):
+    if _active:
+        _active.page(number, wall, cpu, rows, offset)
+
+
+def count(name, n=1):
+    if _active:
+        _active.count(name, n)
+
+
+def annotate(**info):
+    if _active:
+        _active.annotate(**info)
+
+
+def add_arguments(parser):
+    """Add --timings, --profile FILE and --trace FILE to an argparse parser."""
+    group = parser.add_argument_group("timing")
+    group.add_argument("--timings", action="store_true",
+                       help=f"print per-stage timings and append a record to {METRICS_FILE}")
+    group.add_argument("--profile", metavar="FILE",
+                       help="write a cProfile dump to FILE (implies --timings)")
+    group.add_argument("--trace", metavar="FILE",
+                       help="write a JSON trace to FILE (implies --timings)")
+
+
+def start_from_args(script, args):
+    """Start recording if any of the add_arguments() options were given."""
+    if args.timings or args.profile or args.trace:
+        return start(script, profile_path=args.profile, trace_path=args.trace)
+    return None
+
+
+def start_from_argv(script, argv):
+    """For scripts without argparse: take the timing options out of argv.
+
+    Starts recording if any were present and returns the remaining arguments.
+    """
+    rest, profile_path, trace_path, enabled = [], None, None, False
+    it = iter(argv)
+    for arg in it:
+        if arg == "--timings":
+            enabled = True
+        elif arg in ("--profile", "--trace"):
+            value = next(it, None)
+            if value is None:
+                sys.exit(f"{arg} needs a file name")
+            enabled = True
+            if arg == "--profile":
+                profile_path = value
+            else:
+                trace_path = value
+        else:
+            rest.append(arg)
+    if enabled:
+        start(script, argv, profile_path, trace_path)
+    return rest
@@ -0,0 +1,266 @@
+"""Shared Playwright session handling for the Toyhouse account scripts.
+
+BrowserSession wraps launching Chromium, loading toyhouse_session.json, the
+manual-login fallback, and the waits after each navigation. In the default
+mode it behaves like the original scripts: a visible browser, with a wait for
+network idle after every navigation. In fast mode:
+
+- the browser runs headless once a saved session exists, and reopens visibly
+  only if a login turns out to be needed
+- images, media, fonts and third-party scripts are blocked by route
+  interception
+- each navigation waits for the element the script needs (order rows, the
+  download button) instead of for network idle
+
+Every navigation's wall time is logged so the two modes can be compared.
+
+When browser_daemon.py is running, sessions attach to its already-running,
+logged-in browser over CDP instead of launching Chromium. They work only in
+tabs they open themselves, and in fast mode block resources on those tabs
+only, so the daemon's orders tab and other clients' tabs are never touched.
+If the daemon isn't reachable, sessions launch their own browser as usual.
+"""
+
+import json
+import os
+import time
+import urllib.request
+from urllib.parse import urlparse
+
+from playwright.sync_api import Error as PlaywrightError
+from playwright.sync_api import TimeoutError as PlaywrightTimeoutError
+
+import timings
+
+BASE_URL = "https://account.toyhousellc.com"
+ORDERS_URL = f"{BASE_URL}/orders"
+SESSION_FILE = "toyhouse_session.json"
+
+ORDER_ROW_SELECTOR = 'div[role="row"] a[href*="/orders/"]'
+LOAD_MORE_SELECTOR = 'button:has-text("Load more")'
+DOWNLOAD_SELECTOR = 'button:has-text("Download Your Invoice"), a:has-text("Download Your Invoice")'
+
+BLOCKED_RESOURCE_TYPES = {"image", "media", "font"}
+# Scripts from anywhere else are treated as third-party (analytics, chat widgets, ...)
+FIRST_PARTY_DOMAINS = ("toyhousellc.com",)
+SELECTOR_TIMEOUT = 30000
+LOGIN_TIMEOUT = 300000
+
+DAEMON_STATE_FILE = os.path.join(".cache", "browser_daemon.json")
+DAEMON_CONNECT_TIMEOUT = 5000
+
+
+def should_block(resource_type, url):
+    """True for requests fast mode doesn't need: media, fonts and third-party scripts."""
+    if resource_type in BLOCKED_RESOURCE_TYPES:
+        return True
+    if resource_type == "script":
+        host = urlparse(url).hostname or ""
+        return not any(host == d or host.endswith("." + d) for d in FIRST_PARTY_DOMAINS)
+    return False
+
+
+def _route(route):
+    if should_block(route.request.resource_type, route.request.url):
+        route.abort()
+    else:
+        route.continue_()
+
+
+def order_url(order_id):
+    return f"{BASE_URL}/orders/{order_id}"
+
+
+def daemon_endpoint(state_file=DAEMON_STATE_FILE):
+    """The CDP endpoint of a running browser_daemon.py, or None."""
+    try:
+        with open(state_file, encoding="utf-8") as f:
+            endpoint = json.load(f)["endpoint"]
+        # Cheap liveness probe; a stale state file fails here, not in connect_over_cdp
+        with urllib.request.urlopen(f"{endpoint}/json/version", timeout=1):
+            return endpoint
+    except (OSError, ValueError, KeyError):
+        return None
+
+
+def is_orders_tab(page):
+    return page.url.split("?")[0].rstrip("/") == ORDERS_URL
+
+
+class BrowserSession:
+    """One authenticated browser context and page, used as a context manager."""
+
+    def __init__(self, playwright, fast=False, accept_downloads=False, use_daemon=True):
+        self.playwright = playwright
+        self.fast = fast
+        self.accept_downloads = accept_downloads
+        self.use_daemon = use_daemon
+        self.browser = None
+        self.context = None
+        self.page = None
+        self.attached = False
+        self.owned_pages = []
+        self.timings = []
+
+    def __enter__(self):
+        if not (self.use_daemon and self._attach()):
+            self._launch(headless=self.fast and os.path.exists(SESSION_FILE))
+        return self
+
+    def _attach(self):
+        """Attach to the browser daemon if one is running. Returns True on success."""
+        endpoint = daemon_endpoint()
+        if endpoint is None:
+            return False
+        try:
+            self.browser = self.playwright.chromium.connect_over_cdp(
+                endpoint, timeout=DAEMON_CONNECT_TIMEOUT)
+        except PlaywrightError as e:
+            print(f"Browser daemon at {endpoint} not usable ({e}); launching a browser.")
+            return False
+        print(f"Using the browser daemon at {endpoint}")
+        self.attached = True
+        self.headless = False
+        self.context = self.browser.contexts[0]
+        self.page = self._new_page()
+        return True
+
+    def _new_page(self):
+        """A tab of our own in the daemon's context, routed in fast mode.
+
+        Routes go on the page, not the shared context, so other clients of
+        the daemon keep loading everything.
+        """
+        page = self.context.new_page()
+        if self.fast:
+            page.route("**/*", _route)
+        self.owned_pages.append(page)
+        return page
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def _launch(self, headless):
+        self.headless = headless
+        self.browser = self.playwright.chromium.launch(headless=headless)
+        options = {"accept_downloads": self.accept_downloads}
+        if os.path.exists(SESSION_FILE):
+            options["storage_state"] = SESSION_FILE
+        self.context = self.browser.new_context(**options)
+        if self.fast:
+            self.context.route("**/*", _route)
+        self.page = self.context.new_page()
+
+    def close(self):
+        if not self.browser:
+            return
+        if self.attached:
+            # Leave the daemon's browser and orders tab running; close only our tabs
+            for page in self.owned_pages:
+                if not page.is_closed():
+                    page.close()
+            self.attached = False
+            self.owned_pages = []
+        self.browser.close()
+        self.browser = None
+
+    def save_session(self):
+        self.context.storage_state(path=SESSION_FILE)
+
+    def _timed(self, label, start, stage="navigate"):
+        elapsed = time.perf_counter() - start
+        self.timings.append((label, elapsed))
+        timings.add(stage, elapsed)
+        mode = "fast" if self.fast else "normal"
+        print(f"  [{mode}] {label}: {elapsed:.2f}s")
+
+    def _wait(self, selector):
+        if not self.fast:
+            self.page.wait_for_load_state("networkidle")
+            return
+        try:
+            self.page.wait_for_selector(selector, timeout=SELECTOR_TIMEOUT)
+        except PlaywrightTimeoutError:
+            # Nothing to wait for (e.g. an empty list) or the page needs something
+            # we blocked; settle for network idle rather than failing
+            self.page.wait_for_load_state("networkidle")
+
+    def goto(self, url, wait_for, label):
+        """Navigate and wait for wait_for (fast) or network idle, logging the time taken."""
+        start = time.perf_counter()
+        self.page.goto(url, wait_until="domcontentloaded" if self.fast else "load")
+        if "authentication" not in self.page.url.lower():
+            self._wait(wait_for)
+        self._timed(label, start)
+
+    def _login(self, url, wait_for, label):
+        """Let the user log in (in a visible browser), then return to url."""
+        if self.headless or self.attached:
+            print("\nSaved session has expired; reopening the browser so you can log in.")
+            self.close()
+            self._launch(headless=False)
+            self.page.goto(url)
+        print("\nNot logged in. Please log in in the browser.")
+        print("Waiting until you are logged in...")
+        self.page.wait_for_url(lambda u: "authentication" not in u.lower(), timeout=LOGIN_TIMEOUT)
+        self.goto(url, wait_for, label)
+
+    def open_orders(self):
+        """Open the orders list (logging in if needed) and save the session.
+
+        Attached to the daemon, this loads the list in our own tab: clicking
+        "Load more" on the daemon's orders tab would change it for every client.
+        """
+        self.goto(ORDERS_URL, ORDER_ROW_SELECTOR, "orders page")
+        if "authentication" in self.page.url.lower():
+            self._login(ORDERS_URL, ORDER_ROW_SELECTOR, "orders page")
+        self.save_session()
+        return self.page
+
+    def load_more(self):
+        """Click "Load more" and wait for new rows. Returns False if there is no button."""
+        btn = self.page.locator(LOAD_MORE_SELECTOR)
+        if btn.count() == 0:
+            return False
+        start = time.perf_counter()
+        rows = self.page.locator(ORDER_ROW_SELECTOR).count()
+        btn.first.click()
+        if self.fast:
+            try:
+                self.page.wait_for_function(
+                    "([sel, n]) => document.querySelectorAll(sel).length > n",
+                    arg=[ORDER_ROW_SELECTOR, rows], timeout=SELECTOR_TIMEOUT,
+                )
+            except PlaywrightTimeoutError:
+                self.page.wait_for_load_state("networkidle")
+        else:
+            self.page.wait_for_load_state("networkidle")
+        self._timed("load more", start, "load_more")
+        return True
+
+    def open_order(self, order_id):
+        """Open an order's detail page (logging in if needed)."""
+        url = order_url(order_id)
+        self.goto(url, DOWNLOAD_SELECTOR, f"order {order_id}")
+        if "authentication" in self.page.url.lower():
+            self._login(url, DOWNLOAD_SELECTOR, f"order {order_id}")
+            self.save_session()
+        return self.page
+
+    def download_invoice(self, filepath):
+        """Click "Download Your Invoice" on the open order page and save it to filepath.
+
+        Returns filepath, or None if the page has no download button.
+        """
+        btn = self.page.locator("button", has_text="Download Your Invoice")
+        if btn.count() == 0:
+            btn = self.page.locator("a", has_text="Download Your Invoice")
+        if btn.count() == 0:
+            return None
+
+        start = time.perf_counter()
+        with self.page.expect_download() as dl_info:
+            btn.first.click()
+        dl_info.value.save_as(filepath)
+        self._timed("invoice download", start, "download")
+        return filepath
@@ -0,0 +1,149 @@
+"""Browser-free access to the Toyhouse account site over pooled HTTP.
+
+Reuses the cookies Playwright saved in toyhouse_session.json, so an invoice can
+be fetched with a couple of plain requests instead of starting Chromium. Any
+sign that this won't work — the session has expired, the orders page is
+rendered client-side, there is no direct invoice link, or the response isn't
+a PDF — raises FastPathUnavailable so callers can fall back to the browser.
+"""
+
+import json
+import os
+import time
+from urllib.parse import urljoin, urlparse
+
+import requests
+from bs4 import BeautifulSoup
+from requests.adapters import HTTPAdapter
+
+import timings
+from order_index import lookup, normalize, record_orders
+from orders_parser import parse_orders
+
+BASE_URL = "https://account.toyhousellc.com"
+SESSION_FILE = "toyhouse_session.json"
+USER_AGENT = (
+    "Mozilla/5.0 (X11; Linux x86_64) AppleWebKit/537.36 "
+    "(KHTML, like Gecko) Chrome/124.0 Safari/537.36"
+)
+TIMEOUT = 30
+
+
+class FastPathUnavailable(Exception):
+    """The HTTP fast path can't complete this request; use the browser instead."""
+
+
+class SessionExpired(FastPathUnavailable):
+    """The saved session is missing or no longer logged in."""
+
+
+def load_session(session_file=SESSION_FILE, pool_size=8):
+    """A requests.Session with a pooled adapter and the saved Playwright cookies.
+
+    A missing, unreadable or malformed session file raises SessionExpired too,
+    so callers log in with the browser and save a fresh one.
+    """
+    if not os.path.exists(session_file):
+        raise SessionExpired(f"no saved session in {session_file}")
+    now = time.time()
+    try:
+        with open(session_file, encoding="utf-8") as f:
+            state = json.load(f)
+        cookies = [
+            (cookie["name"], cookie["value"], cookie.get("domain"), cookie.get("path", "/"),
+             cookie.get("secure", False))
+            for cookie in state.get("cookies", [])
+            if cookie.get("expires", -1) in (-1, None) or cookie["expires"] >= now
+        ]
+    except (OSError, ValueError, KeyError, TypeError, AttributeError) as e:
+        raise SessionExpired(f"{session_file} is not a usable saved session "
+                             f"({type(e).__name__}: {e})") from e
+    if not cookies:
+        raise SessionExpired(f"every cookie in {session_file} has expired")
+
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    session.headers["User-Agent"] = USER_AGENT
+    for name, value, domain, path, secure in cookies:
+        session.cookies.set(name, value, domain=domain, path=path, secure=secure)
+    return session
+
+
+class ToyhouseHTTP:
+    """Fetch order pages and invoice PDFs without a browser."""
+
+    def __init__(self, session_file=SESSION_FILE, base_url=BASE_URL):
+        self.base_url = base_url.rstrip("/")
+        self.session = load_session(session_file)
+
+    def _get(self, url, **kwargs):
+        try:
+            with timings.stage("http_get"):
+                response = self.session.get(url, timeout=TIMEOUT, **kwargs)
+        except requests.RequestException as e:
+            raise FastPathUnavailable(f"request failed: {e}") from e
+        if "authentication" in response.url.lower() or response.status_code in (401, 403):
+            raise SessionExpired("the saved session is no longer logged in")
+        if response.status_code != 200:
+            raise FastPathUnavailable(f"{url} returned HTTP {response.status_code}")
+        return response
+
+    def orders(self):
+        """Parse the first page of the orders list and record it in the order index."""
+        orders = parse_orders(self._get(f"{self.base_url}/orders").text)
+        if not orders:
+            # Nothing server-rendered: the page builds the list in JavaScript
+            raise FastPathUnavailable("the orders page has no server-rendered order rows")
+        record_orders(orders)
+        return orders
+
+    def order_id(self, order_number):
+        """Look the order ID up in the order index, then on the first orders page."""
+        indexed = lookup(order_number)
+        if indexed:
+            return indexed["order_id"]
+        for order in self.orders():
+            if normalize(order["order_number"]) == normalize(order_number):
+                return order["order_id"]
+        raise FastPathUnavailable(f"{normalize(order_number)} is not on the first orders page")
+
+    def invoice_url(self, order_id):
+        """The URL behind the order page's "Download Your Invoice" control."""
+        order_url = f"{self.base_url}/orders/{order_id}"
+        soup = BeautifulSoup(self._get(order_url).text, "html.parser")
+        for tag in soup.find_all(["a", "button"]):
+            if "Download Your Invoice" not in tag.get_text(" ", strip=True):
+                continue
+            href = tag.get("href") or tag.get("data-href") or tag.get("formaction")
+            if href and not href.startswith(("#", "javascript:")):
+                return urljoin(order_url, href)
+        raise FastPathUnavailable("no direct invoice link on the order page")
+
+    def download_invoice(self, order_number, filepath):
+        """Save the order's invoice PDF to filepath. Returns filepath."""
+        url = self.invoice_url(self.order_id(order_number))
+        if urlparse(url).netloc != urlparse(self.base_url).netloc:
+            # Don't send account cookies to another host
+            response = self._get_external(url)
+        else:
+            response = self._get(url)
+        if not response.content.startswith(b"%PDF"):
+            raise FastPathUnavailable("the invoice link did not return a PDF")
+
+        os.makedirs(os.path.dirname(filepath) or ".", exist_ok=True)
+        tmp_path = f"{filepath}.part"
+        with open(tmp_path, "wb") as f:
+            f.write(response.content)
+        os.replace(tmp_path, filepath)
+        return filepath
+
+    def _get_external(self, url):
+        try:
+            response = requests.get(url, timeout=TIMEOUT, headers={"User-Agent": USER_AGENT})
+        except requests.RequestException as e:
+            raise FastPathUnavailable(f"request failed: {e}") from e
+        if response.status_code != 200:
+            raise FastPathUnavailable(f"{url} returned HTTP {response.status_code}")
+        return response
@@ -0,0 +1,240 @@
+#!/usr/bin/env python3
+"""Watch invoices/ and generate the PO as soon as an invoice PDF lands or changes.
+
+Usage:
+    python watch_invoices.py [--location NAME] [--interval 1] [--settle 2] [--json]
+    python watch_invoices.py --once        # process what's pending, then exit
+
+Polls invoices/*_invoice.pdf, so it works the same on every OS and on network
+drives. A PDF is processed once its size and mtime have stopped changing for
+--settle seconds and it ends with a PDF trailer, so downloads still being
+written are skipped until they finish. On startup, every invoice whose PO is
+missing or older than the PDF is processed.
+
+Master data is parsed once and kept in memory. It is reloaded only when
+ToyhousemasterData.csv changes (see master_index.HotMasterData).
+
+Each processed invoice prints one status line, or one JSON event per line with
+--json:
+    {"event": "po_generated", "order": "TH19087", "matched": 41, "exceptions": 2, ...}
+    {"event": "failed", "order": "TH19088", "error": "..."}
+    {"event": "master_loaded", "items": 10234, "seconds": 1.8, ...}
+"""
+
+import argparse
+import glob
+import json
+import os
+import sys
+import time
+
+from generate_po import (
+    DEFAULT_ENGINE, DEFAULT_LOCATION, INVOICE_SUFFIX, INVOICES_DIR, PAGE_PARSERS,
+    InvoiceStream, POProjection, generate_po, order_from_invoice_path,
+)
+import ledger
+import timings
+from master_index import MASTER_FILE, HotMasterData
+
+DEFAULT_INTERVAL = 1.0
+DEFAULT_SETTLE = 2.0
+# A PDF without a trailer is still downloading, unless it has been still this long
+TRAILER_GRACE = 30.0
+
+
+def emit(event, as_json):
+    event = {"event": event.pop("event"), "at": time.strftime("%Y-%m-%d %H:%M:%S"), **event}
+    if as_json:
+        print(json.dumps(event), flush=True)
+        return
+    kind = event["event"]
+    if kind == "po_generated":
+        source = ", cached parse" if event["from_cache"] else ""
+        print(f"[{event['at']}] {event['order']}: {event['matched']} matched, "
+              f"{event['exceptions']} exceptions ({event['seconds']:.2f}s{source})", flush=True)
+    elif kind == "failed":
+        print(f"[{event['at']}] {event['order']}: FAILED {event['error']}", flush=True)
+    elif kind == "master_loaded":
+        print(f"[{event['at']}] master data loaded: {event['items']} items "
+              f"({event['seconds']:.2f}s)", flush=True)
+    else:
+        print(f"[{event['at']}] {kind}: " + ", ".join(f"{k}={v}" for k, v in event.items()
+                                                    if k not in ("event", "at")), flush=True)
+
+
+def _signature(path):
+    st = os.stat(path)
+    return st.st_size, st.st_mtime_ns
+
+
+def _has_trailer(path):
+    with open(path, "rb") as f:
+        f.seek(max(0, os.path.getsize(path) - 1024))
+        return b"%%EOF" in f.read()
+
+
+def _po_is_current(order_number, pdf_path):
+    po_path = os.path.join(INVOICES_DIR, f"{order_number}_PO.csv")
+    return os.path.exists(po_path) and os.path.getmtime(po_path) >= os.path.getmtime(pdf_path)
+
+
+class InvoiceWatcher:
+    """Polls for new or changed invoice PDFs and turns each settled one into a PO."""
+
+    def __init__(self, location=DEFAULT_LOCATION, settle=DEFAULT_SETTLE, engine=DEFAULT_ENGINE,
+                 use_cache=True, as_json=False, master=None, accept_upc=False, max_rss_mb=None,
+                 use_ledger=True):
+        self.location = location
+        self.settle = settle
+        self.engine = engine
+        self.use_cache = use_cache
+        self.as_json = as_json
+        self.accept_upc = accept_upc
+        self.max_rss_mb = max_rss_mb
+        self.use_ledger = use_ledger
+        self.master = master or HotMasterData(MASTER_FILE, settle)
+        self.master_version = 0
+        self.projection = None
+        self.done = {}      # pdf path → signature it was processed at
+        self.seen = {}      # pdf path → (signature, first time seen with it)
+
+    def prime(self, reprocess=False):
+        """Mark invoices whose PO is already up to date as done."""
+        for path in self._invoice_paths():
+            order_number = order_from_invoice_path(path)
+            if not reprocess and _po_is_current(order_number, path):
+                self.done[path] = _signature(path)
+
+    def _invoice_paths(self):
+        return sorted(glob.glob(os.path.join(INVOICES_DIR, f"*{INVOICE_SUFFIX}")))
+
+    def ready(self):
+        """Invoice paths that are new or changed and have stopped changing."""
+        now = time.time()
+        ready = []
+        paths = self._invoice_paths()
+        for path in paths:
+            try:
+                sig = _signature(path)
+            except FileNotFoundError:
+                continue
+            if self.done.get(path) == sig:
+                continue
+            seen_sig, since = self.seen.get(path, (None, None))
+            if seen_sig != sig:
+                self.seen[path] = (sig, now)
+                continue
+            quiet = now - max(since, sig[1] / 1e9)
+            if quiet < self.settle:
+                continue
+            if not _has_trailer(path) and quiet < TRAILER_GRACE:
+                continue
+            ready.append(path)
+        for path in set(self.seen) - set(paths):
+            del self.seen[path]
+        return ready
+
+    def master_data(self):
+        data = self.master.current()
+        if self.master.version != self.master_version:
+            self.master_version = self.master.version
+            emit({"event": "master_loaded", "items": len(data),
+                  "seconds": round(self.master.load_seconds, 3),
+                  "version": self.master.version}, self.as_json)
+        return data
+
+    def process(self, path):
+        order_number = order_from_invoice_path(path)
+        sig = _signature(path)
+        start = time.perf_counter()
+        rss_before = timings.current_rss_mb()
+        try:
+            master_data = self.master_data()
+            if self.projection is None or not self.projection.is_current(master_data):
+                self.projection = POProjection(master_data)
+            invoice = InvoiceStream(path, self.use_cache, engine=self.engine, max_rss_mb=self.max_rss_mb)
+            po_path, exc_path, matched, exceptions, accepted = generate_po(
+                order_number, invoice, master_data, self.location, self.projection, self.accept_upc,
+                self.use_ledger
+            )
+            rss_after = timings.current_rss_mb()
+            emit({"event": "po_generated", "order": order_number, "invoice_no": invoice.invoice_no,
+                  "items": invoice.item_count, "matched": matched, "exceptions": exceptions,
+                  "upc_accepted": accepted, "po": po_path, "exceptions_file": exc_path,
+                  "from_cache": invoice.from_cache, "seconds": round(time.perf_counter() - start, 3),
+                  # RSS change over this invoice; the peak is the watcher's lifetime peak
+                  "rss_growth_mb": (round(rss_after - rss_before, 1)
+                                    if rss_before is not None and rss_after is not None else None),
+                  "process_peak_rss_mb": timings.peak_rss_mb()}, self.as_json)
+        except Exception as e:
+            emit({"event": "failed", "order": order_number,
+                  "error": f"{type(e).__name__}: {e}"}, self.as_json)
+        # Failures are marked done too; a new download of the PDF changes its signature
+        self.done[path] = sig
+        self.seen.pop(path, None)
+
+    def poll(self):
+        """One pass: pick up master data changes and process every ready invoice."""
+        try:
+            self.master_data()
+        except OSError:
+            pass  # no master data yet; each invoice reports the error when processed
+        ready = self.ready()
+        for path in ready:
+            self.process(path)
+        return len(ready)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Generate POs automatically as invoice PDFs land in invoices/.")
+    parser.add_argument("--location", default=DEFAULT_LOCATION,
+                        help=f"received-at location (default: {DEFAULT_LOCATION!r})")
+    parser.add_argument("--interval", type=float, default=DEFAULT_INTERVAL, metavar="SECONDS",
+                        help=f"how often to look for new invoices (default: {DEFAULT_INTERVAL})")
+    parser.add_argument("--settle", type=float, default=DEFAULT_SETTLE, metavar="SECONDS",
+                        help="how long a file must stay unchanged before it is processed "
+                             f"(default: {DEFAULT_SETTLE})")
+    parser.add_argument("--engine", choices=sorted(PAGE_PARSERS), default=DEFAULT_ENGINE,
+                        help="invoice page parser (see generate_po.py --help)")
+    parser.add_argument("--no-cache", dest="use_cache", action="store_false",
+                        help="always parse the invoice PDF, bypassing the parsed-invoice cache")
+    parser.add_argument("--accept-upc", action="store_true",
+                        help="put unknown Item #s with an exact UPC match into the PO "
+                             "(see generate_po.py --help)")
+    parser.add_argument("--max-rss", dest="max_rss_mb", type=int, metavar="MB",
+                        help="memory ceiling for invoice parsing (see generate_po.py --help)")
+    parser.add_argument("--no-ledger", dest="use_ledger", action="store_false",
+                        help=f"don't record the parsed invoices in {ledger.LEDGER_FILE}")
+    parser.add_argument("--all", action="store_true",
+                        help="on startup, regenerate every PO, not just missing or outdated ones")
+    parser.add_argument("--once", action="store_true",
+                        help="process what is pending and exit instead of watching")
+    parser.add_argument("--json", action="store_true", help="print one JSON event per line")
+    args = parser.parse_args()
+
+    os.makedirs(INVOICES_DIR, exist_ok=True)
+    watcher = InvoiceWatcher(args.location, args.settle, args.engine, args.use_cache, args.json,
+                             accept_upc=args.accept_upc, max_rss_mb=args.max_rss_mb,
+                             use_ledger=args.use_ledger)
+    watcher.prime(reprocess=args.all)
+    if not args.json:
+        print(f"Watching {INVOICES_DIR}/*{INVOICE_SUFFIX} (Ctrl+C to stop)..."
+              if not args.once else f"Processing pending invoices in {INVOICES_DIR}/...")
+
+    try:
+        if args.once:
+            # Pending files are complete already; don't wait for them to settle
+            watcher.settle = 0
+            watcher.ready()
+            watcher.poll()
+            return
+        while True:
+            watcher.poll()
+            time.sleep(args.interval)
+    except KeyboardInterrupt:
+        if not args.json:
+            print("\nStopped.")
+
+
+if __name__ == "__main__":
+    sys.exit(main())